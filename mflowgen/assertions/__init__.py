@@ -1,2 +1,2 @@
 from mflowgen.assertions.assertion_classes import File, Tool
-
+from mflowgen.assertions.assertion_runner  import run_checks
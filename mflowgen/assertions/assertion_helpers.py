@@ -11,7 +11,7 @@ import os
 import re
 import stat
 
-from mflowgen.utils import read_yaml
+from mflowgen.utils import read_yaml, write_if_changed
 
 #-------------------------------------------------------------------------
 # template_pytest_file
@@ -53,11 +53,13 @@ template_pytest_file='''\
 # mflowgen-check-{check_type}.py
 #-------------------------------------------------------------------------
 # Generated: {gen}
+#
+# Runs the checks natively, or with pytest if MFLOWGEN_ASSERTIONS=pytest
+# (see mflowgen/assertions/assertion_runner.py)
 
-import pytest
 import sys
 
-from mflowgen.assertions import File, Tool
+from mflowgen.assertions import File, Tool, run_checks
 
 RED   = '\033[31m'
 GREEN = '\033[92m'
@@ -66,36 +68,8 @@ END   = '\033[0m'
 {tests}
 
 def main():
-
-  print()
-  print( GREEN + '    > Checking {check_type} for step "{step}"' + END )
-  print()
-
-  files        = [ __file__, {pyfiles} ]
-  exit_status  = []
-
-  for f in files:
-
-    # Options for short clean printout:
-    #
-    # - q         : quiet and short
-    # - rA        : print one line per pass/fail test in the short test
-    #             :   summary info
-    # - tb=short  : shorter traceback printout
-    # - color=yes : color
-    #
-
-    pytest_args = [ '-q', '-rA', '--disable-warnings',
-                    '--tb=short', '--color=yes', '--noconftest', f ]
-    print( 'pytest ' + ' '.join( pytest_args ) )
-    status = pytest.main( pytest_args )
-    exit_status.append( status )
-    print()
-
-  # Exit with an error if any test has failed
-
-  if any( exit_status ):
-    sys.exit( 1 )
+  sys.exit( run_checks( '{check_type}', '{step}', globals(),
+                        [ {pyfiles} ] ) )
 
 if __name__ == '__main__':
   main()
@@ -167,8 +141,9 @@ def improve_assert_messages( entry ):
 # dump_assertion_check_scripts
 #
 # Given a directory with a configure.yml containing preconditions and
-# postconditions, generates two python files that pytest can target to run
-# all preconditions and all postconditions.
+# postconditions, generates two python files that run all preconditions
+# and all postconditions (natively, or with pytest, see
+# assertion_runner.py).
 #
 # Expected yaml contents:
 #
@@ -186,10 +161,42 @@ def improve_assert_messages( entry ):
 #         assert math.pi > 3.00                    #         statements
 #
 
-def dump_assertion_check_scripts( step_name, dir_name ):
+# The configuration data can be passed in directly (e.g., from the step
+# in memory) to avoid re-reading the configure.yml.
+#
+
+def dump_assertion_check_scripts( step_name, dir_name, data=None ):
+
+  if data is None:
+    yaml_path = dir_name + '/configure.yml'
+    data      = read_yaml( yaml_path )
+
+  scripts = render_assertion_check_scripts( step_name, data )
+
+  for fname, text in scripts.items():
+
+    fpath = dir_name + '/' + fname
+
+    write_if_changed( fpath, text )
+
+    # Make it executable
+
+    mode = os.stat( fpath ).st_mode
+    if not mode & stat.S_IEXEC:
+      os.chmod( fpath, mode | stat.S_IEXEC )
+
+  return list( scripts.keys() )
+
+# render_assertion_check_scripts
+#
+# Returns a dict of file names to the text of the assertion checking
+# scripts for the given configuration data (see above). Only the scripts
+# for the assertion types that the step defines are included.
+#
+
+def render_assertion_check_scripts( step_name, data ):
 
-  yaml_path = dir_name + '/configure.yml'
-  data      = read_yaml( yaml_path )
+  scripts = {}
 
   # Look at both preconditions and postconditions
 
@@ -267,20 +274,16 @@ def dump_assertion_check_scripts( step_name, dir_name ):
             name         = func_name,
             code         = code )
 
-    # Dump the pytest functions to file by filling in a template
+    # Render the pytest functions by filling in a template
 
-    fpath = dir_name + '/mflowgen-check-'+t+'.py'
-
-    with open( fpath, 'w' ) as fd:
-      fd.write( template_pytest_file.format(
-                  step       = step_name,
-                  tests      = tests_str,
-                  check_type = t,
-                  gen        = os.path.abspath( __file__ ).rstrip('c'),
-                  pyfiles    = ', '.join( pyfiles ) ) )
-
-    # Make it executable
+    fname = 'mflowgen-check-' + t + '.py'
 
-    os.chmod( fpath, os.stat( fpath ).st_mode | stat.S_IEXEC )
+    scripts[ fname ] = template_pytest_file.format(
+                         step       = step_name,
+                         tests      = tests_str,
+                         check_type = t,
+                         gen        = os.path.abspath( __file__ ).rstrip('c'),
+                         pyfiles    = ', '.join( pyfiles ) )
 
+  return scripts
 
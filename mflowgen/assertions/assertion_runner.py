@@ -0,0 +1,348 @@
+#=========================================================================
+# assertion_runner.py
+#=========================================================================
+# Runner for the generated assertion checking scripts
+#
+# Each mflowgen-check-{preconditions,postconditions}.py script defines one
+# test function for each assertion of the step and calls run_checks with
+# its globals and the custom pytest files of the step (see
+# assertion_helpers.py). By default, the checks run natively:
+#
+# - The test functions of the script are called directly in this process
+#   (i.e., without starting pytest), so a check costs little more than
+#   the assertions themselves.
+# - Custom pytest files are imported and their test functions are called
+#   directly as well. Files that need pytest itself (i.e., tests that take
+#   fixtures, test classes, marks, fixture definitions, or xunit-style
+#   setup and teardown functions) are run with pytest afterwards.
+# - Tests that call pytest.skip, pytest.xfail or pytest.importorskip are
+#   skipped, and tests that call pytest.fail fail, as with pytest.
+# - The script and each custom file run concurrently in threads, and the
+#   output of each test is captured and only shown if it fails.
+#
+# The results are reported per test like "pytest -rA", and the exit status
+# is 1 if any test failed (0 otherwise, even if tests were skipped), as
+# before.
+#
+# Set MFLOWGEN_ASSERTIONS=pytest to run every file with pytest one after
+# the other instead (e.g., for the detailed assertion messages of pytest).
+#
+
+import importlib.util
+import inspect
+import io
+import os
+import sys
+import threading
+import time
+import traceback
+
+from concurrent.futures import ThreadPoolExecutor
+
+RED    = '\033[31m'
+GREEN  = '\033[92m'
+YELLOW = '\033[33m'
+END    = '\033[0m'
+
+# Most files that are checked at the same time
+
+max_threads = 8
+
+# Options for short clean printout with pytest:
+#
+# - q         : quiet and short
+# - rA        : print one line per pass/fail test in the short test
+#             :   summary info
+# - tb=short  : shorter traceback printout
+# - color=yes : color
+#
+
+pytest_args = [ '-q', '-rA', '--disable-warnings', '--tb=short',
+                '--color=yes', '--noconftest' ]
+
+# get_mode
+#
+# Returns how to run the checks ('native' or 'pytest')
+#
+
+def get_mode():
+  mode = os.environ.get( 'MFLOWGEN_ASSERTIONS' ) or 'native'
+  assert mode in [ 'native', 'pytest' ], \
+    'MFLOWGEN_ASSERTIONS must be "native" or "pytest", not "{}"'.format(
+      mode )
+  return mode
+
+#-------------------------------------------------------------------------
+# Output capture
+#-------------------------------------------------------------------------
+# Stands in for sys.stdout and sys.stderr while tests run in threads, and
+# sends what each thread writes to the buffer of that thread (if any)
+#
+
+class ThreadOutput:
+
+  def __init__( s, stream, local ):
+    s.stream = stream
+    s.local  = local
+
+  def write( s, text ):
+    buf = getattr( s.local, 'buf', None )
+    return ( buf or s.stream ).write( text )
+
+  def flush( s ):
+    s.stream.flush()
+
+  def __getattr__( s, name ):
+    return getattr( s.stream, name )
+
+#-------------------------------------------------------------------------
+# Collecting tests
+#-------------------------------------------------------------------------
+
+# Functions that pytest calls around the tests of a module
+
+xunit_names = [ 'setup_module', 'teardown_module', 'setUpModule',
+                'tearDownModule', 'setup_function', 'teardown_function' ]
+
+# is_fixture
+#
+# Returns whether the object is a function decorated with pytest.fixture
+#
+
+def is_fixture( obj ):
+  return hasattr( obj, '_pytestfixturefunction' ) or \
+         type( obj ).__module__ == '_pytest.fixtures'
+
+# collect_tests
+#
+# Returns the ( name, function ) of each test in the namespace in order
+# of definition, or None if the namespace needs pytest to run
+#
+
+def collect_tests( namespace ):
+
+  tests = []
+
+  if 'pytestmark' in namespace or \
+      any( name in namespace for name in xunit_names ):
+    return None
+
+  for name, obj in list( namespace.items() ):
+    if is_fixture( obj ):
+      return None
+    if name.startswith( 'Test' ) and inspect.isclass( obj ):
+      return None
+    if not name.startswith( 'test' ) or not inspect.isfunction( obj ):
+      continue
+    if hasattr( obj, 'pytestmark' ) or \
+        inspect.signature( obj ).parameters:
+      return None
+    tests.append( ( name, obj ) )
+
+  return tests
+
+# load_file
+#
+# Imports the custom pytest file and returns its namespace
+#
+
+def load_file( path, index ):
+  name = 'mflowgen_check_{}_{}'.format( index,
+           os.path.splitext( os.path.basename( path ) )[0] )
+  spec = importlib.util.spec_from_file_location( name, path )
+  mod  = importlib.util.module_from_spec( spec )
+  spec.loader.exec_module( mod )
+  return vars( mod )
+
+#-------------------------------------------------------------------------
+# Running tests
+#-------------------------------------------------------------------------
+
+# get_outcome
+#
+# Returns 'skipped' if the exception is from pytest.skip, pytest.xfail or
+# pytest.importorskip, and 'failed' otherwise (e.g., for pytest.fail).
+# These exceptions only exist if a test imported pytest.
+#
+
+def get_outcome( e ):
+  outcomes = sys.modules.get( '_pytest.outcomes' )
+  if outcomes and isinstance( e, ( outcomes.Skipped, outcomes.XFailed ) ):
+    return 'skipped'
+  return 'failed'
+
+# is_outcome
+#
+# Returns whether the exception is one that pytest raises to end a test
+# early (these derive from BaseException, not Exception)
+#
+
+def is_outcome( e ):
+  outcomes = sys.modules.get( '_pytest.outcomes' )
+  return bool( outcomes ) and isinstance( e, outcomes.OutcomeException )
+
+# run_test
+#
+# Runs the test function with its output captured into the buffer of the
+# thread. Returns ( outcome, message, report ), where the outcome is
+# 'passed', 'failed' or 'skipped', the message is the exception of a
+# failed test (or the reason for a skipped test), and the report holds
+# the traceback and the output of a failed test.
+#
+
+def run_test( func, local ):
+
+  local.buf = io.StringIO()
+
+  try:
+    func()
+    return ( 'passed', '', '' )
+  except ( KeyboardInterrupt, SystemExit ):
+    raise
+  except BaseException as e:
+    if not isinstance( e, Exception ) and not is_outcome( e ):
+      raise
+    if get_outcome( e ) == 'skipped':
+      return ( 'skipped', str( e ) or type( e ).__name__, '' )
+    # Skip the frame of this function in the traceback
+    tb     = e.__traceback__.tb_next
+    report = ''.join( traceback.format_exception( type( e ), e, tb ) )
+    msg    = traceback.format_exception_only( type( e ), e )[-1].strip()
+    # Bare assertions are described by the failing statement
+    frames = traceback.extract_tb( tb )
+    if isinstance( e, AssertionError ) and not str( e ) and frames:
+      msg += ': ' + frames[-1].line
+    output = local.buf.getvalue()
+    if output:
+      report += '\n' + '-'*20 + ' Captured output ' + '-'*20 + '\n'
+      report += output
+    return ( 'failed', msg, report )
+  finally:
+    local.buf = None
+
+# run_file
+#
+# Runs the tests in the namespace of the file (loading the file first if
+# no namespace is given). Returns a list of ( test, outcome, message,
+# report ) (see run_test), or None if the file needs pytest (e.g., it
+# skips itself while it is imported).
+#
+
+def run_file( path, index, namespace, local ):
+
+  if namespace is None:
+    try:
+      namespace = load_file( path, index )
+    except BaseException as e:
+      if is_outcome( e ):
+        return None
+      if not isinstance( e, Exception ):
+        raise
+      return [ ( path, 'failed',
+        traceback.format_exception_only( type( e ), e )[-1].strip(),
+        ''.join( traceback.format_exception( type( e ), e,
+                                             e.__traceback__ ) ) ) ]
+
+  tests = collect_tests( namespace )
+
+  if tests is None:
+    return None
+
+  # Assertions may refer to pytest (e.g., pytest.approx), which is only
+  # imported if they do
+
+  if any( 'pytest' in func.__code__.co_names for _, func in tests ) and \
+      'pytest' not in namespace:
+    import pytest
+    namespace[ 'pytest' ] = pytest
+
+  return [ ( path + '::' + name, ) + run_test( func, local )
+             for name, func in tests ]
+
+# run_pytest
+#
+# Runs the file with pytest and returns the exit status
+#
+
+def run_pytest( path ):
+  import pytest
+  args = pytest_args + [ path ]
+  print( 'pytest ' + ' '.join( args ) )
+  status = pytest.main( args )
+  print()
+  return status
+
+#-------------------------------------------------------------------------
+# run_checks
+#-------------------------------------------------------------------------
+# Runs the tests of the generated script with the given namespace (i.e.,
+# its globals) and the custom pytest files, and returns the exit status
+#
+
+def run_checks( check_type, step, namespace, pyfiles ):
+
+  print()
+  print( GREEN + '    > Checking {} for step "{}"'.format( check_type,
+                                                            step ) + END )
+  print()
+
+  files = [ os.path.relpath( namespace[ '__file__' ] ) ] + list( pyfiles )
+
+  if get_mode() == 'pytest':
+    exit_status = [ run_pytest( f ) for f in files ]
+    return 1 if any( exit_status ) else 0
+
+  start = time.time()
+
+  # Run each file in a thread with the output of the tests captured
+
+  def run( x ):
+    index, path = x
+    return run_file( path, index, namespace if index == 0 else None,
+                     local )
+
+  local = threading.local()
+
+  stdout, stderr = sys.stdout, sys.stderr
+  sys.stdout = ThreadOutput( stdout, local )
+  sys.stderr = ThreadOutput( stderr, local )
+
+  try:
+    with ThreadPoolExecutor( min( len( files ), max_threads ) ) as pool:
+      results = list( pool.map( run, enumerate( files ) ) )
+  finally:
+    sys.stdout, sys.stderr = stdout, stderr
+
+  # Report each test (failures with their traceback and output first)
+
+  tests   = [ t for r in results if r is not None for t in r ]
+  failed  = [ t for t in tests if t[1] == 'failed'  ]
+  skipped = [ t for t in tests if t[1] == 'skipped' ]
+
+  for test, outcome, msg, report in failed:
+    print( RED + '_'*20 + ' ' + test + ' ' + '_'*20 + END )
+    print()
+    print( report.rstrip() )
+    print()
+
+  for test, outcome, msg, report in tests:
+    if outcome == 'passed':
+      print( GREEN + 'PASSED' + END, test )
+    elif outcome == 'skipped':
+      print( YELLOW + 'SKIPPED' + END, test, '-', msg )
+    else:
+      print( RED + 'FAILED' + END, test, '-', msg )
+
+  print( '{}{} passed, {} failed{} in {:.2f}s{}'.format(
+    RED if failed else GREEN,
+    len( tests ) - len( failed ) - len( skipped ), len( failed ),
+    ', {} skipped'.format( len( skipped ) ) if skipped else '',
+    time.time() - start, END ) )
+  print()
+
+  # Files that need pytest run with pytest after the others
+
+  exit_status = [ run_pytest( f ) for f, r in zip( files, results )
+                   if r is None ]
+
+  return 1 if failed or any( exit_status ) else 0
@@ -0,0 +1,92 @@
+#=========================================================================
+# test_assertion_runner.py
+#=========================================================================
+
+import os
+import subprocess
+import sys
+
+import mflowgen
+
+from mflowgen.assertions.assertion_helpers import dump_assertion_check_scripts
+
+def run_script( tmpdir, postconditions, mode='native' ):
+  dump_assertion_check_scripts( 'foo', str( tmpdir ),
+                                { 'postconditions': postconditions } )
+  env = dict( os.environ, MFLOWGEN_ASSERTIONS=mode,
+              PYTHONPATH=os.path.dirname( os.path.dirname(
+                           os.path.abspath( mflowgen.__file__ ) ) ) )
+  return subprocess.run(
+    [ sys.executable, 'mflowgen-check-postconditions.py' ],
+    cwd=str( tmpdir ), env=env, stdout=subprocess.PIPE,
+    universal_newlines=True )
+
+def test_runner_native( tmpdir ):
+  tmpdir.join( 'test_plain.py' ).write(
+    'def test_plain():\n  print( "noise" )\n  assert 1 + 1 == 3\n' )
+  tmpdir.join( 'test_fixture.py' ).write(
+    'def test_fixture( tmpdir ):\n  assert tmpdir\n' )
+  proc = run_script( tmpdir, [ 'assert File( "test_plain.py" )',
+                               { 'pytest': 'test_plain.py'   },
+                               { 'pytest': 'test_fixture.py' } ] )
+  assert proc.returncode == 1
+  assert '1 passed, 1 failed' in proc.stdout
+  # Captured output is only shown for failures
+  assert 'test_plain.py::test_plain - AssertionError' in proc.stdout
+  assert 'noise' in proc.stdout
+  # Files with fixtures still run with pytest
+  assert 'pytest -q' in proc.stdout and '1 passed' in proc.stdout
+
+def test_runner_modes_agree( tmpdir ):
+  for mode in [ 'native', 'pytest' ]:
+    assert run_script( tmpdir, [ 'assert True' ], mode ).returncode == 0
+    assert run_script( tmpdir, [ 'assert False' ], mode ).returncode == 1
+
+def test_runner_pytest_outcomes( tmpdir ):
+  tmpdir.join( 'test_outcomes.py' ).write(
+    'import pytest\n'
+    'def test_skip():\n  pytest.skip( "not here" )\n'
+    'def test_xfail():\n  pytest.xfail( "known" )\n'
+    'def test_importorskip():\n  pytest.importorskip( "no_such_module" )\n'
+    'def test_fail():\n  pytest.fail( "broken" )\n' )
+  proc = run_script( tmpdir, [ 'assert True',
+                               { 'pytest': 'test_outcomes.py' } ] )
+  assert proc.returncode == 1
+  assert '1 passed, 1 failed, 3 skipped' in proc.stdout
+  assert 'test_outcomes.py::test_skip - not here' in proc.stdout
+  assert 'test_outcomes.py::test_fail - Failed: broken' in proc.stdout
+  # Skipped tests alone do not fail the check
+  tmpdir.join( 'test_outcomes.py' ).write(
+    'import pytest\ndef test_skip():\n  pytest.skip( "not here" )\n' )
+  proc = run_script( tmpdir, [ 'assert True',
+                               { 'pytest': 'test_outcomes.py' } ] )
+  assert proc.returncode == 0 and '1 passed, 0 failed, 1 skipped' in \
+    proc.stdout
+
+def test_runner_needs_pytest( tmpdir ):
+  # Module marks, xunit-style setup and fixtures run with pytest
+  files = {
+    'test_mark.py'    : 'import pytest\npytestmark = pytest.mark.skip\n'
+                        'def test_mark():\n  assert False\n',
+    'test_setup.py'   : 'x = []\ndef setup_module():\n  x.append( 1 )\n'
+                        'def test_setup():\n  assert x\n',
+    'test_fixture.py' : 'import pytest\n@pytest.fixture\n'
+                        'def y():\n  return 1\n'
+                        'def test_fixture():\n  assert True\n',
+  }
+  for name, text in sorted( files.items() ):
+    tmpdir.join( name ).write( text )
+  proc = run_script( tmpdir, [ 'assert True' ] +
+                             [ { 'pytest': name } for name in files ] )
+  assert proc.returncode == 0
+  assert proc.stdout.count( 'pytest -q' ) == len( files )
+  # Files that skip themselves while they are imported as well (pytest
+  # collects no tests from them, which fails the check in either mode)
+  tmpdir.join( 'test_module.py' ).write(
+    'import pytest\npytest.importorskip( "no_such_module" )\n'
+    'def test_module():\n  assert False\n' )
+  for mode in [ 'native', 'pytest' ]:
+    proc = run_script( tmpdir, [ 'assert True',
+                                 { 'pytest': 'test_module.py' } ], mode )
+    assert proc.returncode == 1 and 'test_module.py' in proc.stdout
+    assert 'test_module.py::test_module' not in proc.stdout
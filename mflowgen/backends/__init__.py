@@ -1,3 +1,3 @@
 from mflowgen.backends.make_backend  import MakeBackend
 from mflowgen.backends.ninja_backend import NinjaBackend
-
+from mflowgen.backends.exec_backend  import ExecBackend
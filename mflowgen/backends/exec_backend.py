@@ -0,0 +1,35 @@
+#=========================================================================
+# exec_backend.py
+#=========================================================================
+# Backend for the native executor (i.e., "mflowgen execute")
+#
+# The executor runs the graph directly from the rules and dependencies
+# that the BuildOrchestrator collects while building (see get_all_rules
+# and get_all_deps), so this backend does not generate any build files.
+# Every backend call does nothing and returns no backend dependencies.
+#
+
+class ExecBackend:
+
+  def __init__( s ):
+    pass
+
+  # save
+
+  def save( s, order, build_dirs, step_dirs ):
+    s.order      = order
+    s.build_dirs = build_dirs
+    s.step_dirs  = step_dirs
+
+  # save_resources
+
+  def save_resources( s, limits, resources ):
+    s.limits    = limits
+    s.resources = resources
+
+  # All other backend calls (e.g., gen_header, gen_step_execute)
+
+  def __getattr__( s, name ):
+    if not name.startswith( 'gen_' ):
+      raise AttributeError( name )
+    return lambda *args, **kwargs: []
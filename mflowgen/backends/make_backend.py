@@ -9,14 +9,17 @@
 
 import datetime as dt
 import os
+import shlex
 
 from mflowgen.backends.makefile_syntax import Writer as MakeWriter
 from mflowgen.backends.makefile_syntax import make_cpdir, make_symlink
 from mflowgen.backends.makefile_syntax import make_execute, make_stamp, make_alias
 from mflowgen.backends.makefile_syntax import make_common_rules, make_clean
-from mflowgen.backends.makefile_syntax import make_diff
+from mflowgen.backends.makefile_syntax import make_diff, make_collect_inputs
 from mflowgen.backends.makefile_syntax import make_runtimes, make_list
 from mflowgen.backends.makefile_syntax import make_graph, make_status, make_info
+from mflowgen.core.resources           import is_default
+from mflowgen.utils                    import get_top_dir
 from mflowgen.utils.helpers            import stamp
 
 class MakeBackend:
@@ -37,6 +40,14 @@ class MakeBackend:
     s.build_dirs = build_dirs
     s.step_dirs  = step_dirs
 
+  # save_resources
+  #
+  # Nothing to do here, since the mflowgen-resources wrapper reads the
+  # resources from the metadata directory while the build runs
+
+  def save_resources( s, limits, resources ):
+    pass
+
   # gen_header
 
   def gen_header( s ):
@@ -91,7 +102,7 @@ class MakeBackend:
   # - Copy the {src} to the {dst}
   # - Parameterize using the saved YAML in the metadata directory
   # - This rule depends on {deps}
-  # - {sandbox} True (copies src dir), False (symlinks src contents)
+  # - {sandbox} mode (see Step.set_sandbox)
   #
   # Expected return
   #
@@ -155,7 +166,8 @@ class MakeBackend:
   #
   # Expected semantics
   #
-  # - Symlink the {src} to the {dst}
+  # - Symlink every {inputs} dst to its src using the {manifest}
+  # - Touch the {stamp}
   # - This rule depends on {deps}
   #
   # Expected return
@@ -163,7 +175,8 @@ class MakeBackend:
   # - Return a list that can pass to another backend call as extra_deps
   #
 
-  def gen_step_collect_inputs( s, dst, src, deps, extra_deps ):
+  def gen_step_collect_inputs( s, stamp, manifest, inputs, deps,
+                                                          extra_deps ):
 
     #.....................................................................
     # Built-in toggle for enabling/disabling this rule
@@ -179,7 +192,7 @@ class MakeBackend:
     # "collect-inputs" substeps are removed, then a pre-built step will
     # always look "done". So we add a knob here that checks if the step
     # build directory has a ".prebuilt" file and if so, ignores this rule.
-    dst_dir = dst.split('/')[0] # Assumes dst is relative to build dir
+    dst_dir = stamp.split('/')[0] # Assumes stamp is relative to build dir
     s.w.write( 'ifeq ("$(wildcard {}/.prebuilt)","")'.format( dst_dir ) )
     s.w.newline()
     #.....................................................................
@@ -188,12 +201,12 @@ class MakeBackend:
 
     # Rules
 
-    target = make_symlink(
-      w    = s.w,
-      dst  = dst,
-      src  = src,
-      deps = all_deps,
-      src_is_symlink = True,
+    target = make_collect_inputs(
+      w        = s.w,
+      target   = stamp,
+      manifest = manifest,
+      srcs     = [ x['src'] for x in inputs ],
+      deps     = all_deps,
     )
 
     #.....................................................................
@@ -231,7 +244,7 @@ class MakeBackend:
   #
 
   def gen_step_execute( s, outputs, command, deps, extra_deps,
-                                                     phony=False ):
+                                         phony=False, resources=None ):
 
     all_deps = deps + extra_deps
 
@@ -269,11 +282,29 @@ class MakeBackend:
 
     outputs = [ stamp( o, '.execstamp.' ) for o in outputs ]
 
-    # Update timestamps for pre-existing outputs so timestamp-based
-    # dependency checking works
+    # Skip executing if the inputs and metadata of this step still have
+    # the content digests recorded at its last execution. Otherwise
+    # execute and save the content digests of the new outputs.
+    #
+    # Note that make re-runs this rule whenever an upstream step has
+    # re-executed, even if the upstream outputs did not change, so this
+    # check is what avoids rebuilding downstream steps unnecessarily.
+
+    digest = get_top_dir() + '/mflowgen/scripts/mflowgen-digest'
+
+    # Steps that declare resources run through a wrapper that waits until
+    # the resources are free (taking cpus from the make jobserver when it
+    # can), so parallel make never oversubscribes the host
+
+    if resources and not is_default( resources ):
+      command = get_top_dir() + '/mflowgen/scripts/mflowgen-resources ' + \
+                build_dir + ' ' + shlex.quote( command )
 
     command = 'mkdir -p ' + build_dir + '/outputs && ' + \
-              command + ' && touch -c ' + build_dir + '/outputs/*'
+              '{ ' + digest + ' check ' + build_dir + ' || { ' + \
+                digest + ' invalidate ' + build_dir + ' && ' + \
+                command + ' && ' + \
+                digest + ' save ' + build_dir + '; }; }'
 
     # Stamp the build directory
 
@@ -51,10 +51,18 @@ class Writer:
 # - dst     : path to copied directory
 # - src     : path to source directory
 # - deps    : list, additional dependencies
-# - sandbox : bool, True (copies src dir), False (symlinks src contents)
+# - sandbox : sandbox mode (see Step.set_sandbox)
 #
 
-def make_cpdir( w, dst, src, deps=None, sandbox=True ):
+make_cpdir_rules = {
+  'copy'         : 'cpdir-and-parameterize',
+  'symlink'      : 'mkdir-and-symlink',
+  'hardlink'     : 'hardlink-and-parameterize',
+  'reflink'      : 'reflink-and-parameterize',
+  'symlink-farm' : 'symlink-farm-and-parameterize',
+}
+
+def make_cpdir( w, dst, src, deps=None, sandbox='copy' ):
 
   if deps:
     assert type( deps ) == list, 'Expecting deps to be of type list'
@@ -64,10 +72,7 @@ def make_cpdir( w, dst, src, deps=None, sandbox=True ):
   # $2 -- src
   # $3 -- stamp
 
-  if sandbox:
-    rule = 'cpdir-and-parameterize'
-  else:
-    rule = 'mkdir-and-symlink'
+  rule = make_cpdir_rules[ sandbox ]
 
   target = dst + '/.stamp'
 
@@ -175,6 +180,35 @@ def make_symlink( w, dst, src, deps=None, src_is_symlink=False,
 
   return target
 
+# make_collect_inputs
+#
+# Collects all inputs of a step from a manifest (see collect.py)
+#
+# - w        : instance of Writer
+# - target   : stamp to touch
+# - manifest : path to the manifest
+# - srcs     : paths to the collected outputs (which have stamps)
+# - deps     : additional dependencies
+#
+
+def make_collect_inputs( w, target, manifest, srcs, deps=None ):
+
+  deps = [ manifest ] + [ stamp( src ) for src in srcs ] + ( deps or [] )
+
+  # There may be many deps, so generate them on separate lines
+
+  for dep in sorted( set( deps ) ):
+    w.write( '{target}: {dep}\n'.format( target=target, dep=dep ) )
+
+  # $1 -- manifest
+
+  template_str  = '{target}:\n'
+  template_str += '	$(call collect-inputs,{manifest})\n'
+
+  w.write( template_str.format( target=target, manifest=manifest ) )
+
+  return target
+
 # make_execute
 #
 # Runs the execute rule
@@ -320,19 +354,37 @@ def make_alias( w, alias, deps ):
 
 def make_common_rules( w ):
 
+  scripts = get_top_dir() + '/mflowgen/scripts'
+
   w.write(
 '''
 SHELL=/usr/bin/env bash -euo pipefail
 
+MFLOWGEN_DIGEST={scripts}/mflowgen-digest
+MFLOWGEN_COLLECT_INPUTS={scripts}/mflowgen-collect-inputs
+'''.format( scripts = scripts ) )
+
+  # The directory rules only run when an upstream step has re-executed.
+  # Make cannot tell whether the upstream outputs actually changed, so
+  # the existing build directory is kept (and just re-stamped) if the
+  # inputs of the step still have the content digests recorded at its
+  # last execution.
+
+  w.write(
+'''
 # $1 -- $dst
 # $2 -- $src
 # $3 -- $stamp
 
 define cpdir
-	rm -rf ./$1
-	cp -aL $2 $1 || true
-	chmod -R +w $1
-	touch $3
+	if [[ -e $3 ]] && $(MFLOWGEN_DIGEST) check $1; then \\
+	  touch $3; \\
+	else \\
+	  rm -rf ./$1; \\
+	  cp -aL $2 $1 || true; \\
+	  chmod -R +w $1; \\
+	  touch $3; \\
+	fi
 endef
 
 # $1 -- $dst
@@ -340,11 +392,75 @@ endef
 # $3 -- $stamp
 
 define cpdir-and-parameterize
-	rm -rf ./$1
-	cp -aL $2 $1 || true
-	chmod -R +w $1
-	cp .mflowgen/$1/configure.yml $1
-	touch $3
+	if [[ -e $3 ]] && $(MFLOWGEN_DIGEST) check $1; then \\
+	  touch $3; \\
+	else \\
+	  rm -rf ./$1; \\
+	  cp -aL $2 $1 || true; \\
+	  chmod -R +w $1; \\
+	  cp .mflowgen/$1/configure.yml $1; \\
+	  touch $3; \\
+	fi
+endef
+
+# Hardlinks every file instead of copying (and copies if hardlinking
+# fails, e.g., across filesystems). The files are shared with the source,
+# so only the directories are made writable.
+
+# $1 -- $dst
+# $2 -- $src
+# $3 -- $stamp
+
+define hardlink-and-parameterize
+	if [[ -e $3 ]] && $(MFLOWGEN_DIGEST) check $1; then \\
+	  touch $3; \\
+	else \\
+	  rm -rf ./$1; \\
+	  cp -alL $2 $1 2>/dev/null || \\
+	    { rm -rf ./$1; cp -aL $2 $1 || true; }; \\
+	  find $1 -type d -exec chmod +w {} +; \\
+	  rm -f $1/configure.yml && cp .mflowgen/$1/configure.yml $1; \\
+	  touch $3; \\
+	fi
+endef
+
+# Clones every file copy-on-write where the filesystem supports it and
+# copies otherwise
+
+# $1 -- $dst
+# $2 -- $src
+# $3 -- $stamp
+
+define reflink-and-parameterize
+	if [[ -e $3 ]] && $(MFLOWGEN_DIGEST) check $1; then \\
+	  touch $3; \\
+	else \\
+	  rm -rf ./$1; \\
+	  cp -aL --reflink=auto $2 $1 || true; \\
+	  chmod -R +w $1; \\
+	  cp .mflowgen/$1/configure.yml $1; \\
+	  touch $3; \\
+	fi
+endef
+
+# Creates real directories with a symlink for every file, so that new
+# files (and files replaced by renaming over them) stay in the build
+# directory. Files written in place still modify the source.
+
+# $1 -- $dst
+# $2 -- $src
+# $3 -- $stamp
+
+define symlink-farm-and-parameterize
+	if [[ -e $3 ]] && $(MFLOWGEN_DIGEST) check $1; then \\
+	  touch $3; \\
+	else \\
+	  rm -rf ./$1; \\
+	  cp -sRL "$$(cd $2 && pwd)" $1 || true; \\
+	  find $1 -type d -exec chmod +w {} +; \\
+	  rm -f $1/configure.yml && cp .mflowgen/$1/configure.yml $1; \\
+	  touch $3; \\
+	fi
 endef
 
 # $1 -- $dst
@@ -352,11 +468,15 @@ endef
 # $3 -- $stamp
 
 define mkdir-and-symlink
-	rm -rf ./$1
-	mkdir -p $1
-	cd $1 && ln -sf ../$2/* . && cd ..
-	rm $1/configure.yml && cp .mflowgen/$1/configure.yml $1
-	touch $3
+	if [[ -e $3 ]] && $(MFLOWGEN_DIGEST) check $1; then \\
+	  touch $3; \\
+	else \\
+	  rm -rf ./$1; \\
+	  mkdir -p $1; \\
+	  cd $1 && ln -sf ../$2/* . && cd ..; \\
+	  rm $1/configure.yml && cp .mflowgen/$1/configure.yml $1; \\
+	  touch $3; \\
+	fi
 endef
 
 # $1 -- $dst_dir
@@ -369,6 +489,12 @@ define symlink
 	cd $1 && ln -sf $3 $2 && touch $4
 endef
 
+# $1 -- $manifest
+
+define collect-inputs
+	$(MFLOWGEN_COLLECT_INPUTS) $1
+endef
+
 # $1 -- $stamp
 
 define stamp
@@ -405,8 +531,9 @@ def make_diff( w, name, src, dst ):
 
   exclude_files = [
     'configure.yml',
-    '.time_end',
-    '.time_start',
+    '.telemetry.json',
+    '.digests.json',
+    '.cache.json',
     'mflowgen-run*',
     'mflowgen-debug',
     '.stamp',
@@ -12,11 +12,14 @@ import os
 
 from mflowgen.backends.ninja_syntax       import Writer as NinjaWriter
 from mflowgen.backends.ninja_syntax_extra import ninja_cpdir, ninja_symlink
-from mflowgen.backends.ninja_syntax_extra import ninja_execute, ninja_stamp, ninja_alias
+from mflowgen.backends.ninja_syntax_extra import ninja_shared_execute
+from mflowgen.backends.ninja_syntax_extra import ninja_stamp, ninja_alias
 from mflowgen.backends.ninja_syntax_extra import ninja_common_rules, ninja_clean
-from mflowgen.backends.ninja_syntax_extra import ninja_diff
+from mflowgen.backends.ninja_syntax_extra import ninja_diff, ninja_collect_inputs
 from mflowgen.backends.ninja_syntax_extra import ninja_runtimes, ninja_list
 from mflowgen.backends.ninja_syntax_extra import ninja_graph, ninja_status, ninja_info
+from mflowgen.core.resources              import get_pools
+from mflowgen.utils                       import get_top_dir
 
 class NinjaBackend:
 
@@ -25,6 +28,8 @@ class NinjaBackend:
     s.w = NinjaWriter( s.fd )
     # Track debug targets for list command
     s.debug_targets = {}
+    # Track the shared rules (see ninja_shared_execute)
+    s.shared_rules = {}
 
   def __del__( s ):
     s.fd.close()
@@ -35,6 +40,24 @@ class NinjaBackend:
     s.order      = order
     s.build_dirs = build_dirs
     s.step_dirs  = step_dirs
+    s.step_names = { v: k for k, v in build_dirs.items() }
+
+  # variables
+  #
+  # Per-edge variables that parameterize the shared rules for a step
+
+  def variables( s, build_dir ):
+    return { 'build_dir' : build_dir,
+             'step_name' : s.step_names.get( build_dir, '' ) }
+
+  # save_resources
+  #
+  # Steps that declare resources go into pools so that ninja never runs
+  # them together beyond the totals (see resources.get_pools)
+
+  def save_resources( s, limits, resources ):
+    s.pools, pool_of = get_pools( resources, limits )
+    s.pool_of = { s.build_dirs[ k ]: v for k, v in pool_of.items() }
 
   # gen_header
 
@@ -54,6 +77,9 @@ class NinjaBackend:
 
   def gen_prologue( s ):
     ninja_common_rules( s.w )
+    for name, depth in sorted( s.pools.items() ):
+      s.w.pool( name, depth )
+      s.w.newline()
 
   # gen_step_header
 
@@ -81,7 +107,7 @@ class NinjaBackend:
   # - Copy the {src} to the {dst}
   # - Parameterize using the saved YAML in the metadata directory
   # - This rule depends on {deps}
-  # - {sandbox} True (copies src dir), False (symlinks src contents)
+  # - {sandbox} mode (see Step.set_sandbox)
   #
   # Expected return
   #
@@ -118,7 +144,8 @@ class NinjaBackend:
   #
   # Expected semantics
   #
-  # - Symlink the {src} to the {dst}
+  # - Symlink every {inputs} dst to its src using the {manifest}
+  # - Touch the {stamp}
   # - This rule depends on {deps}
   #
   # Expected return
@@ -126,18 +153,19 @@ class NinjaBackend:
   # - Return a list that can pass to another backend call as extra_deps
   #
 
-  def gen_step_collect_inputs( s, dst, src, deps, extra_deps ):
+  def gen_step_collect_inputs( s, stamp, manifest, inputs, deps,
+                                                          extra_deps ):
 
     all_deps = deps + extra_deps
 
     # Rules
 
-    target = ninja_symlink(
-      w    = s.w,
-      dst  = dst,
-      src  = src,
-      deps = all_deps,
-      src_is_symlink = True,
+    target = ninja_collect_inputs(
+      w        = s.w,
+      target   = stamp,
+      manifest = manifest,
+      srcs     = [ x['src'] for x in inputs ],
+      deps     = all_deps,
     )
     s.w.newline()
 
@@ -166,26 +194,29 @@ class NinjaBackend:
   #
 
   def gen_step_execute( s, outputs, command, deps, extra_deps,
-                                                     phony=False ):
+                                         phony=False, resources=None ):
 
     all_deps = deps + extra_deps
 
-    # Extract the build directory from the command so we can create a
-    # unique rule name
+    # Extract the build directory from the command, which parameterizes
+    # the shared execute rule
 
     tokens    = command.split()
     cd_idx    = tokens.index( 'cd' )
     build_dir = tokens[ cd_idx + 1 ]
 
-    rule = build_dir + '-commands-rule'
-    rule = rule.replace( '-', '_' )
-
     description = build_dir + ': Executing...'
 
-    # Update timestamps for pre-existing outputs so timestamp-based
-    # dependency checking works
+    # Save the content digests of the outputs after executing. Outputs
+    # whose content did not change get their previous timestamps back, and
+    # the rule is marked restat, so downstream steps that only depend on
+    # unchanged outputs are not rebuilt (i.e., early cutoff).
 
-    command = command + ' && touch -c ' + build_dir + '/outputs/*'
+    digest = get_top_dir() + '/mflowgen/scripts/mflowgen-digest'
+
+    command = digest + ' invalidate ' + build_dir + ' && ' + \
+              command + ' && ' + \
+              digest + ' save ' + build_dir
 
     # Stamp the build directory
 
@@ -193,13 +224,17 @@ class NinjaBackend:
 
     # Rules
 
-    targets = ninja_execute(
+    targets = ninja_shared_execute(
       w           = s.w,
+      rules       = s.shared_rules,
       outputs     = outputs,
-      rule        = rule,
+      rule        = 'execute',
       command     = command,
+      variables   = s.variables( build_dir ),
       description = description,
       deps        = all_deps,
+      pool        = s.pool_of.get( build_dir, '' ),
+      restat      = True,
     )
 
     return targets
@@ -291,16 +326,13 @@ class NinjaBackend:
 
     all_deps = deps + extra_deps
 
-    # Extract the build directory from the command so we can create a
-    # unique rule name
+    # Extract the build directory from the command, which parameterizes
+    # the shared post-conditions rule
 
     tokens    = command.split()
     cd_idx    = tokens.index( 'cd' )
     build_dir = tokens[ cd_idx + 1 ]
 
-    rule = build_dir + '-post-conditions-commands-rule'
-    rule = rule.replace( '-', '_' )
-
     description = build_dir + ': Checking post-conditions...'
 
     # Stamp the build directory
@@ -312,11 +344,13 @@ class NinjaBackend:
 
     # Rules
 
-    targets = ninja_execute(
+    targets = ninja_shared_execute(
       w           = s.w,
+      rules       = s.shared_rules,
       outputs     = outputs,
-      rule        = rule,
+      rule        = 'post_conditions',
       command     = command,
+      variables   = s.variables( build_dir ),
       description = description,
       deps        = all_deps,
     )
@@ -384,15 +418,18 @@ class NinjaBackend:
 
     # Rules
 
-    debug_rule = build_id + '-debug-rule'
-    debug_rule = debug_rule.replace( '-', '_' )
+    tokens    = command.split()
+    cd_idx    = tokens.index( 'cd' )
+    build_dir = tokens[ cd_idx + 1 ]
 
-    ninja_execute(
-      w       = s.w,
-      outputs = [ target ],
-      rule    = debug_rule,
-      command = command,
-      pool    = 'console',
+    ninja_shared_execute(
+      w         = s.w,
+      rules     = s.shared_rules,
+      outputs   = [ target ],
+      rule      = 'debug',
+      command   = command,
+      variables = s.variables( build_dir ),
+      pool      = 'console',
     )
 
     # Track debug targets for list command
@@ -441,7 +478,7 @@ class NinjaBackend:
       dst     = s.build_dirs[ step_name ]
       idx     = dst.split('-')[0].lstrip('./')
       name    = 'diff-' + idx
-      ninja_diff( s.w, name=name, src=src, dst=dst )
+      ninja_diff( s.w, s.shared_rules, name=name, src=src, dst=dst )
 
     # Clean subtargets (e.g., clean-0, clean-1)
 
@@ -451,7 +488,8 @@ class NinjaBackend:
       name_n  = 'clean-' + idx
       name_s  = 'clean-' + step_name
       command = 'rm -rf ./' + d
-      ninja_clean( s.w, name=name_n, command=command )
+      ninja_clean( s.w, name=name_n, command=command,
+                   rules=s.shared_rules, variables=s.variables( d ) )
       # Named clean subtargets (e.g., clean-foo, clean-bar)
       ninja_alias( s.w, alias=name_s, deps=[name_n] )
 
@@ -461,7 +499,7 @@ class NinjaBackend:
     s.w.newline()
 
     for step_name in s.order:
-      ninja_info( s.w, build_dir=s.build_dirs[ step_name ] )
+      ninja_info( s.w, s.shared_rules, build_dir=s.build_dirs[ step_name ] )
 
     # Runtime target
 
@@ -7,6 +7,7 @@
 #
 
 import os
+import re
 
 from mflowgen.utils         import get_top_dir
 from mflowgen.utils.helpers import stamp
@@ -23,18 +24,23 @@ from mflowgen.utils.helpers import stamp
 # - dst     : path to copied directory
 # - src     : path to source directory
 # - deps    : list, additional dependencies for ninja build
-# - sandbox : bool, True (copies src dir), False (symlinks src contents)
+# - sandbox : sandbox mode (see Step.set_sandbox)
 #
 
-def ninja_cpdir( w, dst, src, deps=None, sandbox=True ):
+ninja_cpdir_rules = {
+  'copy'         : 'cpdir-and-parameterize',
+  'symlink'      : 'mkdir-and-symlink',
+  'hardlink'     : 'hardlink-and-parameterize',
+  'reflink'      : 'reflink-and-parameterize',
+  'symlink-farm' : 'symlink-farm-and-parameterize',
+}
+
+def ninja_cpdir( w, dst, src, deps=None, sandbox='copy' ):
 
   if deps:
     assert type( deps ) == list, 'Expecting deps to be of type list'
 
-  if sandbox:
-    rule = 'cpdir-and-parameterize'
-  else:
-    rule = 'mkdir-and-symlink'
+  rule = ninja_cpdir_rules[ sandbox ]
 
   target = dst + '/.stamp'
 
@@ -102,49 +108,128 @@ def ninja_symlink( w, dst, src, deps=None, src_is_symlink=False ):
 
   return target
 
-# ninja_execute
+# ninja_collect_inputs
 #
-# Runs the execute rule
+# Collects all inputs of a step from a manifest (see collect.py)
 #
-# - w       : instance of ninja_syntax Writer
-# - outputs : outputs of the execute rule
-# - rule    : name of the execute rule
-# - command : string, command for the rule
-# - deps    : additional dependencies for ninja build
+# - w        : instance of ninja_syntax Writer
+# - target   : stamp to touch
+# - manifest : path to the manifest
+# - srcs     : paths to the collected outputs (which have stamps)
+# - deps     : additional dependencies for ninja build
 #
 
-def ninja_execute( w, outputs, rule, command, description='', deps=None, pool='' ):
+def ninja_collect_inputs( w, target, manifest, srcs, deps=None ):
 
   if deps:
     assert type( deps ) == list, 'Expecting deps to be of type list'
 
-  rule_params = {
-    'name'        : rule,
-    'command'     : command,
-    'description' : description,
-    'pool'        : pool,
-  }
+  w.build(
+    outputs   = target,
+    implicit  = [ manifest ] + [ stamp( src ) for src in srcs ] + \
+                ( deps or [] ),
+    rule      = 'collect-inputs',
+    variables = { 'manifest' : manifest },
+  )
 
-  if not pool:
-    del( rule_params['pool'] )
+  return target
 
-  if not description:
-    del( rule_params['description'] )
+# ninja_shared_execute
+#
+# Runs a command through a rule that is shared with every other edge whose
+# command is the same up to its variables. The values of the variables
+# (e.g., build_dir and step_name) are replaced in the command with
+# references to per-edge variables, so most steps share one rule instead
+# of each writing out its own copy of the command.
+#
+# - w         : instance of ninja_syntax Writer
+# - rules     : dict, tracks the shared rules written so far
+# - outputs   : outputs of the execute rule
+# - rule      : base name of the shared rule
+# - command   : string, command for the rule
+# - variables : dict, per-edge variables to parameterize the command by
+# - deps      : additional dependencies for ninja build
+# - pool      : pool for this edge
+# - restat    : boolean, re-stat the outputs after the command
+#
 
-  w.rule( **rule_params )
+def ninja_shared_execute( w, rules, outputs, rule, command, variables,
+                          description='', deps=None, pool='', restat=False ):
 
-  w.newline()
+  if deps:
+    assert type( deps ) == list, 'Expecting deps to be of type list'
+
+  command     = ninja_parameterize( command,     variables )
+  description = ninja_parameterize( description, variables )
+
+  key = ( rule, command, description, restat )
+
+  # Write out the rule the first time it is used (commands that differ in
+  # more than the variables get their own numbered rule)
+
+  if key not in rules:
+
+    n    = sum( 1 for k in rules if k[0] == rule )
+    name = rule if n == 0 else rule + '_' + str( n + 1 )
+
+    rules[ key ] = name
+
+    rule_params = {
+      'name'        : name,
+      'command'     : command,
+      'description' : description,
+    }
+
+    if not description:
+      del( rule_params['description'] )
+
+    if restat:
+      rule_params['restat'] = True
+
+    w.rule( **rule_params )
+
+    w.newline()
 
   w.build(
-    outputs  = outputs,
-    implicit = deps,
-    rule     = rule,
+    outputs   = outputs,
+    implicit  = deps,
+    rule      = rules[ key ],
+    variables = variables,
+    pool      = pool or None,
   )
 
   w.newline()
 
   return outputs
 
+# ninja_parameterize
+#
+# Replaces whole-word occurrences of the variable values in the text with
+# references to the variables. Longer values are matched first, so that a
+# build_dir (e.g., "3-syn") wins over the step_name it contains ("syn").
+# Ninja escapes and variable references already in the text (e.g., "$$"
+# and "$out") are kept as they are, so that ninja expands the result to
+# exactly the original text.
+#
+
+def ninja_parameterize( text, variables ):
+
+  names = { v: k for k, v in ( variables or {} ).items() if v }
+
+  if not text or not names:
+    return text
+
+  values = sorted( names, key=len, reverse=True )
+
+  pattern = r'(\$(?:\{[\w.-]+\}|[\w-]+|[\s\S]))|' + \
+            r'(?<![\w.-])(' + '|'.join( map( re.escape, values ) ) + \
+            r')(?![\w-])'
+
+  def replace( m ):
+    return m.group(1) or '${' + names[ m.group(2) ] + '}'
+
+  return re.sub( pattern, replace, text )
+
 # ninja_stamp
 #
 # Stamps the given file with a '.stamp.' prefix
@@ -205,15 +290,52 @@ def ninja_alias( w, alias, deps ):
 
 def ninja_common_rules( w ):
 
+  # The directory rules only run when something upstream of the step has
+  # changed. The existing build directory is kept (and its stamp is left
+  # alone) if the inputs of the step still have the content digests
+  # recorded at its last execution. The rules are marked restat, so ninja
+  # then sees that the stamp did not change and does not rebuild anything
+  # downstream (i.e., early cutoff).
+  #
+  # Otherwise the directory is copied again. The digest manifest (marked
+  # incomplete) and the stamps of the outputs and post-conditions are kept
+  # across the copy, so outputs that come out the same after executing
+  # again keep their timestamps and do not rebuild anything downstream.
+  #
+  # Ninja runs commands with /bin/sh, so these stick to POSIX shell.
+
+  digest = get_top_dir() + '/mflowgen/scripts/mflowgen-digest'
+  keep   = '.mflowgen/$dst/.keep'
+
+  def unless_unchanged( command ):
+    return ' '.join( [
+      '[ -e $stamp ] && ' + digest + ' check $dst || {',
+      # Stash
+      '{ rm -rf ' + keep + ' && mkdir -p ' + keep + '/outputs &&',
+      'mv -f $dst/.digests.json $dst/.postconditions.stamp ' + keep + ';',
+      'mv -f $dst/outputs/.stamp.* ' + keep + '/outputs; } 2>/dev/null;',
+      # Copy
+      command + ' &&',
+      # Restore
+      '{ mkdir -p $dst/outputs;',
+      'mv -f ' + keep + '/outputs/.stamp.* $dst/outputs;',
+      'mv -f ' + keep + '/.postconditions.stamp $dst;',
+      'mv -f ' + keep + '/.digests.json $dst &&',
+      digest + ' invalidate $dst;',
+      'rm -rf ' + keep + '; } 2>/dev/null; }',
+    ] )
+
   # cpdir
 
   w.rule(
     name        = 'cpdir',
     description = 'cpdir: Copying $src to $dst',
-    command     = 'rm -rf ./$dst && ' +
-                  'cp -aL $src $dst || true && ' +
-                  'chmod -R +w $dst && ' +
-                  'touch $stamp',
+    command     = unless_unchanged(
+                    'rm -rf ./$dst && ' +
+                    'cp -aL $src $dst || true && ' +
+                    'chmod -R +w $dst && ' +
+                    'touch $stamp' ),
+    restat      = True,
   )
   w.newline()
 
@@ -224,11 +346,72 @@ def ninja_common_rules( w ):
   w.rule(
     name        = 'cpdir-and-parameterize',
     description = 'cpdir-and-parameterize: Copying $src to $dst',
-    command     = 'rm -rf ./$dst && ' +
-                  'cp -aL $src $dst || true && ' +
-                  'chmod -R +w $dst && ' +
-                  'cp .mflowgen/$dst/configure.yml $dst && ' +
-                  'touch $stamp',
+    command     = unless_unchanged(
+                    'rm -rf ./$dst && ' +
+                    'cp -aL $src $dst || true && ' +
+                    'chmod -R +w $dst && ' +
+                    'cp .mflowgen/$dst/configure.yml $dst && ' +
+                    'touch $stamp' ),
+    restat      = True,
+  )
+  w.newline()
+
+  # hardlink-and-parameterize
+  #
+  # Hardlinks every file instead of copying (and copies if hardlinking
+  # fails, e.g., across filesystems). The files are shared with the
+  # source, so only the directories are made writable.
+
+  w.rule(
+    name        = 'hardlink-and-parameterize',
+    description = 'hardlink-and-parameterize: Hardlinking $src to $dst',
+    command     = unless_unchanged(
+                    'rm -rf ./$dst && ' +
+                    '{ cp -alL $src $dst 2>/dev/null || ' +
+                    '{ rm -rf ./$dst; cp -aL $src $dst || true; }; } && ' +
+                    'find $dst -type d -exec chmod +w {} + && ' +
+                    'rm -f $dst/configure.yml && ' +
+                    'cp .mflowgen/$dst/configure.yml $dst && ' +
+                    'touch $stamp' ),
+    restat      = True,
+  )
+  w.newline()
+
+  # reflink-and-parameterize
+  #
+  # Clones every file copy-on-write where the filesystem supports it and
+  # copies otherwise
+
+  w.rule(
+    name        = 'reflink-and-parameterize',
+    description = 'reflink-and-parameterize: Cloning $src to $dst',
+    command     = unless_unchanged(
+                    'rm -rf ./$dst && ' +
+                    'cp -aL --reflink=auto $src $dst || true && ' +
+                    'chmod -R +w $dst && ' +
+                    'cp .mflowgen/$dst/configure.yml $dst && ' +
+                    'touch $stamp' ),
+    restat      = True,
+  )
+  w.newline()
+
+  # symlink-farm-and-parameterize
+  #
+  # Creates real directories with a symlink for every file, so that new
+  # files (and files replaced by renaming over them) stay in the build
+  # directory. Files written in place still modify the source.
+
+  w.rule(
+    name        = 'symlink-farm-and-parameterize',
+    description = 'symlink-farm-and-parameterize: Linking $src to $dst',
+    command     = unless_unchanged(
+                    'rm -rf ./$dst && ' +
+                    '{ cp -sRL "$$(cd $src && pwd)" $dst || true; } && ' +
+                    'find $dst -type d -exec chmod +w {} + && ' +
+                    'rm -f $dst/configure.yml && ' +
+                    'cp .mflowgen/$dst/configure.yml $dst && ' +
+                    'touch $stamp' ),
+    restat      = True,
   )
   w.newline()
 
@@ -239,12 +422,14 @@ def ninja_common_rules( w ):
   w.rule(
     name        = 'mkdir-and-symlink',
     description = 'mkdir-and-symlink: Shadowing $src to $dst',
-    command     = 'rm -rf ./$dst && ' +
-                  'mkdir -p $dst && ' +
-                  'cd $dst && ln -sf ../$src/* . && cd .. && ' +
-                  'rm $dst/configure.yml && ' +
-                  'cp .mflowgen/$dst/configure.yml $dst && ' +
-                  'touch $stamp',
+    command     = unless_unchanged(
+                    'rm -rf ./$dst && ' +
+                    'mkdir -p $dst && ' +
+                    'cd $dst && ln -sf ../$src/* . && cd .. && ' +
+                    'rm $dst/configure.yml && ' +
+                    'cp .mflowgen/$dst/configure.yml $dst && ' +
+                    'touch $stamp' ),
+    restat      = True,
   )
   w.newline()
 
@@ -257,6 +442,18 @@ def ninja_common_rules( w ):
   )
   w.newline()
 
+  # collect-inputs
+  #
+  # Symlinks all inputs of a step in one process (see collect.py)
+
+  w.rule(
+    name        = 'collect-inputs',
+    description = 'collect-inputs: Collecting inputs from $manifest',
+    command     = get_top_dir() + '/mflowgen/scripts/mflowgen-collect-inputs' +
+                  ' $manifest',
+  )
+  w.newline()
+
   # stamp
 
   w.rule(
@@ -270,10 +467,26 @@ def ninja_common_rules( w ):
 #
 # Write out ninja rules for cleaning
 #
-# - w : instance of ninja_syntax Writer
+# - w         : instance of ninja_syntax Writer
+# - rules     : dict, tracks the shared rules (see ninja_shared_execute)
+# - variables : dict, per-edge variables for the shared rule
 #
 
-def ninja_clean( w, name, command ):
+def ninja_clean( w, name, command, rules=None, variables=None ):
+
+  # Clean subtargets share one rule (see ninja_shared_execute)
+
+  if rules is not None:
+    ninja_shared_execute(
+      w           = w,
+      rules       = rules,
+      outputs     = name,
+      rule        = 'clean',
+      command     = command,
+      variables   = variables,
+      description = '$out: Clean build directories',
+    )
+    return
 
   w.rule(
     name        = name,
@@ -292,15 +505,17 @@ def ninja_clean( w, name, command ):
 #
 # Write out rules for diffs
 #
-# - w : instance of Writer
+# - w     : instance of Writer
+# - rules : dict, tracks the shared rules (see ninja_shared_execute)
 #
 
-def ninja_diff( w, name, src, dst ):
+def ninja_diff( w, rules, name, src, dst ):
 
   exclude_files = [
     'configure.yml',
-    '.time_end',
-    '.time_start',
+    '.telemetry.json',
+    '.digests.json',
+    '.cache.json',
     'mflowgen-run*',
     'mflowgen-debug',
     '.stamp',
@@ -328,17 +543,14 @@ def ninja_diff( w, name, src, dst ):
     '|| true',
   ] )
 
-  w.rule(
-    name    = name,
-    command = command,
-  )
-  w.newline()
-
-  w.build(
-    outputs = name,
-    rule    = name,
+  ninja_shared_execute(
+    w         = w,
+    rules     = rules,
+    outputs   = name,
+    rule      = 'diff',
+    command   = command,
+    variables = { 'src': src, 'dst': dst },
   )
-  w.newline()
 
 # ninja_runtimes
 #
@@ -535,10 +747,11 @@ def ninja_status( w, steps ):
 # Write out rules for printing step info
 #
 # - w         : instance of Writer
+# - rules     : dict, tracks the shared rules (see ninja_shared_execute)
 # - build_dir : build_dir for this info target
 #
 
-def ninja_info( w, build_dir ):
+def ninja_info( w, rules, build_dir ):
 
   build_id      = build_dir.split('-')[0]              # <- first number
   step_name     = '-'.join( build_dir.split('-')[1:])  # <- remainder
@@ -551,16 +764,13 @@ def ninja_info( w, build_dir ):
       + '/mflowgen/scripts/mflowgen-info'    \
       + ' -y .mflowgen/' + build_dir + '/configure.yml'
 
-  w.rule(
-    name        = target,
+  ninja_shared_execute(
+    w           = w,
+    rules       = rules,
+    outputs     = target,
+    rule        = 'info',
+    command     = command,
+    variables   = { 'build_dir': build_dir, 'step_name': step_name },
     description = 'List info for the step',
-    command     = command
   )
-  w.newline()
-
-  w.build(
-    outputs = target,
-    rule    = target,
-  )
-  w.newline()
 
@@ -0,0 +1,135 @@
+#=========================================================================
+# test_ninja_backend.py
+#=========================================================================
+
+import contextlib
+import io
+import re
+import shutil
+import subprocess
+
+import pytest
+
+from mflowgen.components import Graph, Step
+from mflowgen.core       import BuildOrchestrator
+from mflowgen.backends   import NinjaBackend
+
+from mflowgen.backends.ninja_syntax       import Writer
+from mflowgen.backends.ninja_syntax_extra import ninja_parameterize
+from mflowgen.backends.ninja_syntax_extra import ninja_shared_execute
+
+# ninja
+#
+# Generates build.ninja for the graph and runs ninja. Returns the output.
+#
+
+def ninja( g, prev_graph=None ):
+  b = BuildOrchestrator( g, NinjaBackend, prev_graph )
+  with contextlib.redirect_stdout( io.StringIO() ):
+    b.build()
+  del b # closes build.ninja
+  proc = subprocess.run( [ 'ninja' ], stdout=subprocess.PIPE,
+                         stderr=subprocess.STDOUT, universal_newlines=True )
+  assert proc.returncode == 0, proc.stdout
+  return proc.stdout
+
+@pytest.mark.skipif( not shutil.which( 'ninja' ), reason='needs ninja' )
+@pytest.mark.parametrize( 'mode', Step.sandbox_modes )
+def test_ninja_early_cutoff( tmpdir, make_step, build_env, mode ):
+
+  # The parameter of foo does not change its output
+
+  make_step( 'foo', outputs=[ 'a' ], parameters={ 'p': 0 },
+             commands=[ 'echo 1 > outputs/a' ] )
+  make_step( 'bar', inputs=[ 'a' ], outputs=[ 'b' ],
+             commands=[ 'cat inputs/a > outputs/b',
+                        'echo ran >> ../bar.runs' ] )
+
+  def graph( p ):
+    g   = Graph()
+    foo = Step( str( tmpdir.join( 'foo' ) ) )
+    bar = Step( str( tmpdir.join( 'bar' ) ) )
+    foo.set_param( 'p', p )
+    foo.set_sandbox( mode )
+    bar.set_sandbox( mode )
+    g.add_step( foo )
+    g.add_step( bar )
+    g.connect_by_name( 'foo', 'bar' )
+    return g
+
+  tmpdir.mkdir( 'build' ).chdir()
+
+  ninja( graph( 0 ) )
+  assert tmpdir.join( 'build', 'bar.runs' ).read() == 'ran\n'
+
+  # Only foo runs again, and it keeps running alone after each change
+
+  for p in [ 1, 2 ]:
+    out = ninja( graph( p ), graph( p - 1 ) )
+    assert '0-foo: Executing' in out
+    assert '1-bar: Executing' not in out
+    assert 'Copying' not in out.split( '0-foo: Executing' )[1]
+  assert tmpdir.join( 'build', 'bar.runs' ).read() == 'ran\n'
+  assert 'no work to do' in ninja( graph( 2 ), graph( 2 ) )
+
+#-------------------------------------------------------------------------
+# ninja_parameterize
+#-------------------------------------------------------------------------
+# Each edge of a shared rule must run exactly the command it had when it
+# had a rule of its own, including for steps whose names also appear as
+# words or path components elsewhere in the command
+
+commands = [
+  ( 'rtl',    'cp inputs/rtl.v outputs/rtl.v && echo rtl > 0-rtl/log' ),
+  ( 'inputs', 'ls inputs 1-inputs/inputs && touch 1-inputs/.execstamp' ),
+  ( 'syn',    'cd 2-syn && ./mflowgen-run syn-2 2-syn.log .syn syn' ),
+  ( 'out',    'echo $out $$out ${out} $$${out} $$syn $ 2-out/out' ),
+  ( 'a.b',    'cat 3-a.b/a.b a.b.c xa.b a.b > a.b-x && echo "a.b"' ),
+]
+
+# expand
+#
+# Expands the text of a ninja rule command the way ninja does for an edge
+# with the given variables (other variable references are kept as is)
+#
+
+def expand( text, variables ):
+  def replace( m ):
+    ref = m.group(1)
+    if ref == '$' : return '$'
+    if ref == ' ' : return ' '
+    name = ref.strip( '{}' )
+    return variables[ name ] if name in variables else m.group(0)
+  return re.sub( r'\$(\{[\w.-]+\}|[\w-]+|[\s\S])', replace, text )
+
+def test_ninja_parameterize():
+  for i, ( step_name, command ) in enumerate( commands ):
+    build_dir = str( i ) + '-' + step_name
+    variables = { 'build_dir': build_dir, 'step_name': step_name }
+    text      = ninja_parameterize( command, variables )
+    assert expand( text, variables ) == expand( command, {} )
+
+@pytest.mark.skipif( not shutil.which( 'ninja' ), reason='needs ninja' )
+def test_ninja_parameterize_commands( tmpdir ):
+
+  # Writes each command to the edges of one shared rule and to edges with
+  # rules of their own, and compares the commands ninja runs for both
+
+  def ninja_commands( shared ):
+    d = tmpdir.mkdir( 'shared' if shared else 'unshared' )
+    with open( str( d ) + '/build.ninja', 'w' ) as fd:
+      w, rules = Writer( fd ), {}
+      for i, ( step_name, command ) in enumerate( commands ):
+        build_dir = str( i ) + '-' + step_name
+        variables = { 'build_dir': build_dir, 'step_name': step_name }
+        if shared:
+          ninja_shared_execute( w, rules, build_dir + '/.execstamp',
+                                'execute', command, variables )
+        else:
+          w.rule( name = 'execute-' + build_dir, command = command )
+          w.build( outputs = build_dir + '/.execstamp',
+                   rule    = 'execute-' + build_dir )
+    return subprocess.check_output( [ 'ninja', '-t', 'commands' ],
+                                    cwd = str( d ) )
+
+  assert ninja_commands( True ) == ninja_commands( False )
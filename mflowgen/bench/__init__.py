@@ -0,0 +1,2 @@
+from mflowgen.bench.bench_handler import BenchHandler
+from mflowgen.bench.bench         import run_benchmark, compare_results
@@ -0,0 +1,356 @@
+#=========================================================================
+# bench.py
+#=========================================================================
+# Benchmarks for graph construction and build generation
+#
+# The benchmarks synthesize a layered graph of stub steps (no EDA tools)
+# and time each phase that runs when a graph is turned into build files:
+#
+# - construct         -- Graph.add_step and Graph.connect for every step
+# - param_space       -- Graph.param_space on a step near the end of the
+#                        graph (only if the sweep is wider than one)
+# - validate          -- Graph.validate
+# - expand_params     -- Graph.expand_params
+# - topological_sort  -- Graph.topological_sort
+# - setup             -- BuildOrchestrator.setup for each backend
+# - build             -- BuildOrchestrator.build for each backend (which
+#                        runs setup again in a fresh build directory)
+#
+# Each phase is timed with a fresh graph and the fastest of the repeats
+# is reported. The peak memory of constructing the graph and of building
+# with each backend is measured with tracemalloc in a separate pass (so
+# that tracing does not slow down the timed passes). The sizes of the
+# generated build files and metadata directories are reported as well.
+#
+# The shape of the graph:
+#
+# - steps   : number of steps before the parameter sweep
+# - depth   : number of layers (the steps are spread evenly)
+# - fan_in  : number of inputs of each step (except in the first layer),
+#             each connected to an output of a random step in the
+#             previous layer
+# - fan_out : number of outputs of each step
+# - sweep   : width of the parameter sweep
+# - seed    : seed for the random connections
+#
+
+import contextlib
+import gc
+import io
+import math
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+from mflowgen.core       import BuildOrchestrator
+from mflowgen.backends   import MakeBackend, NinjaBackend
+from mflowgen.components import Graph, Step
+from mflowgen.utils      import write_yaml
+from mflowgen.version    import __version__
+
+backends = {
+  'make'  : ( MakeBackend,  'Makefile'    ),
+  'ninja' : ( NinjaBackend, 'build.ninja' ),
+}
+
+#-------------------------------------------------------------------------
+# Graph synthesis
+#-------------------------------------------------------------------------
+
+# make_stub_steps
+#
+# Writes the configure.yml files of the stub steps into the given
+# directory and returns the paths of the step with no inputs (for the
+# first layer) and the step with inputs
+#
+
+def make_stub_steps( path, fan_in, fan_out ):
+
+  outputs  = [ 'out_{}'.format( k ) for k in range( fan_out ) ]
+  inputs   = [ 'in_{}'.format( k )  for k in range( fan_in )  ]
+  commands = [ 'echo {x}' ] + \
+             [ 'touch outputs/' + f for f in outputs ]
+
+  paths = []
+
+  for name, step_inputs in [ ( 'source', [] ), ( 'stub', inputs ) ]:
+    step_dir = path + '/' + name
+    os.makedirs( step_dir, exist_ok=True )
+    write_yaml( data = { 'name'       : name,
+                         'inputs'     : step_inputs,
+                         'outputs'    : outputs,
+                         'commands'   : commands,
+                         'parameters' : { 'x': 0 } },
+                path = step_dir + '/configure.yml' )
+    paths.append( step_dir )
+
+  return paths
+
+# make_graph
+#
+# Returns a layered graph of stub steps. The steps are clones of the
+# steps from make_stub_steps.
+#
+
+def make_graph( path, steps, depth, fan_in, fan_out, seed=0 ):
+
+  rng = random.Random( seed )
+
+  source_dir, stub_dir = make_stub_steps( path, fan_in, fan_out )
+  source, stub = Step( source_dir ), Step( stub_dir )
+
+  g      = Graph()
+  width  = int( math.ceil( steps / max( depth, 1 ) ) )
+  layers = []
+
+  for i in range( steps ):
+
+    layer = i // width
+
+    if layer == len( layers ):
+      layers.append( [] )
+
+    step = ( stub if layer else source ).clone()
+    step.set_name( 'step{}'.format( i ) )
+    g.add_step( step )
+
+    if layer:
+      for k in range( fan_in ):
+        src = rng.choice( layers[ layer - 1 ] )
+        out = 'out_{}'.format( rng.randrange( fan_out ) )
+        g.connect( src.o( out ), step.i( 'in_{}'.format( k ) ) )
+
+    layers[ layer ].append( step )
+
+  return g, layers
+
+# sweep_graph
+#
+# Sweeps the parameter of the first step in the next-to-last layer, so
+# that the step and everything downstream of it is copied once for each
+# point in the sweep
+#
+
+def sweep_graph( g, layers, sweep ):
+  step = layers[ max( len( layers ) - 2, 0 ) ][ 0 ]
+  g.param_space( step, 'x', list( range( sweep ) ) )
+
+#-------------------------------------------------------------------------
+# Measurements
+#-------------------------------------------------------------------------
+
+# timed
+#
+# Returns the result of calling func and the elapsed time in seconds
+#
+
+def timed( func, *args, **kwargs ):
+  gc.collect()
+  start  = time.perf_counter()
+  result = func( *args, **kwargs )
+  return result, time.perf_counter() - start
+
+# traced
+#
+# Returns the result of calling func and its peak memory in MB
+#
+
+def traced( func, *args, **kwargs ):
+  gc.collect()
+  tracemalloc.start()
+  try:
+    result = func( *args, **kwargs )
+    peak   = tracemalloc.get_traced_memory()[1]
+  finally:
+    tracemalloc.stop()
+  return result, peak / 2**20
+
+# dir_size
+#
+# Returns the number of files and the total bytes under a directory
+
+def dir_size( path ):
+  files, size = 0, 0
+  for root, dirs, names in os.walk( path ):
+    for name in names:
+      files += 1
+      size  += os.path.getsize( os.path.join( root, name ) )
+  return files, size
+
+# orchestrate
+#
+# Creates a BuildOrchestrator in a fresh build directory (where the
+# backend writes its build file) and calls the given method on it
+#
+
+def orchestrate( path, g, backend, method ):
+
+  backend_cls, _ = backends[ backend ]
+
+  shutil.rmtree( path, ignore_errors=True )
+  os.makedirs( path )
+
+  cwd = os.getcwd()
+  os.chdir( path )
+
+  try:
+    with contextlib.redirect_stdout( io.StringIO() ):
+      b = BuildOrchestrator( g, backend_cls )
+      getattr( b, method )()
+      # The backends close their build files when deleted
+      b.w.fd.close()
+  finally:
+    os.chdir( cwd )
+
+  return b
+
+#-------------------------------------------------------------------------
+# run_benchmark
+#-------------------------------------------------------------------------
+# Runs the benchmark for one graph shape and returns the results as a
+# dict that can be dumped as JSON
+#
+
+def run_benchmark( steps=100, depth=10, fan_in=2, fan_out=2, sweep=1,
+                   seed=0, repeat=1, backend_names=None, memory=True,
+                   tmp_dir=None ):
+
+  backend_names = backend_names or sorted( backends )
+
+  assert steps   > 0, 'bench -- steps must be positive'
+  assert depth   > 0, 'bench -- depth must be positive'
+  assert fan_out > 0, 'bench -- fan_out must be positive'
+  assert sweep   > 0, 'bench -- sweep must be positive'
+  assert repeat  > 0, 'bench -- repeat must be positive'
+
+  for name in backend_names:
+    assert name in backends, 'bench -- Unknown backend: ' + name
+
+  work = tempfile.mkdtemp( prefix='mflowgen-bench-', dir=tmp_dir )
+
+  # new_graph
+  #
+  # Returns a new graph after running the given phases on it, and the
+  # time each phase took
+
+  def new_graph( phases ):
+
+    elapsed = {}
+
+    ( g, layers ), elapsed[ 'construct' ] = \
+      timed( make_graph, work + '/steps', steps, depth, fan_in, fan_out,
+             seed )
+
+    if sweep > 1:
+      _, elapsed[ 'param_space' ] = timed( sweep_graph, g, layers, sweep )
+
+    for phase in phases:
+      _, elapsed[ phase ] = timed( getattr( g, phase ) )
+
+    return g, elapsed
+
+  times   = {}
+  results = { 'backends': {} }
+
+  def record( elapsed, into ):
+    for k, v in elapsed.items():
+      into[ k ] = min( into.get( k, v ), v )
+
+  try:
+
+    # Graph phases
+
+    phases = [ 'validate', 'expand_params', 'topological_sort' ]
+
+    for _ in range( repeat ):
+      g, elapsed = new_graph( phases )
+      record( elapsed, times )
+
+    results[ 'graph' ] = {
+      'steps' : len( g.all_steps() ),
+      'edges' : sum( len( g.get_edges_i( x ) ) for x in g.all_steps() ),
+    }
+
+    if memory:
+      _, results[ 'peak_mb' ] = traced( new_graph, [] )
+
+    # Orchestrator phases for each backend
+
+    for name in backend_names:
+
+      data      = {}
+      build_dir = work + '/build-' + name
+
+      for method in [ 'setup', 'build' ]:
+        for _ in range( repeat ):
+          g, _ = new_graph( [] )
+          _, elapsed = timed( orchestrate, build_dir, g, name, method )
+          record( { method: elapsed }, data )
+
+      build_file = build_dir + '/' + backends[ name ][1]
+
+      data[ 'build_file_bytes' ] = os.path.getsize( build_file )
+      data[ 'metadata_files' ], data[ 'metadata_bytes' ] = \
+        dir_size( build_dir + '/.mflowgen' )
+
+      if memory:
+        g, _ = new_graph( [] )
+        _, data[ 'peak_mb' ] = traced( orchestrate, build_dir, g, name,
+                                       'build' )
+
+      results[ 'backends' ][ name ] = data
+
+  finally:
+    shutil.rmtree( work, ignore_errors=True )
+
+  results[ 'time' ] = times
+
+  results[ 'config' ] = {
+    'steps'   : steps,
+    'depth'   : depth,
+    'fan_in'  : fan_in,
+    'fan_out' : fan_out,
+    'sweep'   : sweep,
+    'seed'    : seed,
+    'repeat'  : repeat,
+  }
+
+  results[ 'env' ] = {
+    'mflowgen' : __version__,
+    'python'   : platform.python_version(),
+    'platform' : platform.platform(),
+  }
+
+  return results
+
+#-------------------------------------------------------------------------
+# compare_results
+#-------------------------------------------------------------------------
+# Compares the times and sizes of two benchmark results and returns a
+# list of ( key, baseline, result ) for every measurement that grew by
+# more than the tolerance (e.g., 0.2 for 20%). Measurements that are
+# missing from either result are ignored.
+#
+
+def compare_results( baseline, result, tolerance=0.2 ):
+
+  def flatten( data, prefix='' ):
+    flat = {}
+    for k, v in data.items():
+      if isinstance( v, dict ):
+        flat.update( flatten( v, prefix + k + '.' ) )
+      elif isinstance( v, ( int, float ) ):
+        flat[ prefix + k ] = v
+    return flat
+
+  measured = [ 'time', 'backends', 'peak_mb' ]
+
+  old = flatten( { k: baseline[k] for k in measured if k in baseline } )
+  new = flatten( { k: result[k]   for k in measured if k in result   } )
+
+  return [ ( k, old[k], new[k] ) for k in sorted( old )
+           if k in new and new[k] > old[k] * ( 1 + tolerance ) ]
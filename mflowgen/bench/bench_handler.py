@@ -0,0 +1,145 @@
+#=========================================================================
+# bench_handler.py
+#=========================================================================
+# Handler for "mflowgen bench", which benchmarks graph construction and
+# build generation on synthesized graphs (see bench.py)
+#
+
+import json
+import sys
+
+from mflowgen.bench.bench import run_benchmark, compare_results
+from mflowgen.utils       import bold, red
+
+class BenchHandler:
+
+  def __init__( s ):
+
+    # Settings given as key=value and their defaults
+
+    s.settings = {
+      'steps'     : 100,
+      'depth'     : 10,
+      'fan_in'    : 2,
+      'fan_out'   : 2,
+      'sweep'     : 1,
+      'seed'      : 0,
+      'repeat'    : 1,
+      'memory'    : 1,
+      'backends'  : 'make,ninja',
+      'output'    : '',
+      'baseline'  : '',
+      'tolerance' : 0.2,
+    }
+
+  #-----------------------------------------------------------------------
+  # launch
+  #-----------------------------------------------------------------------
+  # Dispatch function for commands
+  #
+
+  def launch( s, args, help_ ):
+
+    if help_:
+      s.launch_help()
+      return
+
+    settings = dict( s.settings )
+
+    for arg in args:
+      key, _, value = arg.partition( '=' )
+      if key not in settings or not value:
+        print( 'bench: Unrecognized argument "{}"'.format( arg ),
+               '(see "mflowgen bench --help")' )
+        sys.exit( 1 )
+      try:
+        settings[ key ] = type( s.settings[ key ] )( value )
+      except ValueError:
+        print( 'bench: Invalid value for "{}": {}'.format( key, value ) )
+        sys.exit( 1 )
+
+    s.launch_bench( settings )
+
+  #-----------------------------------------------------------------------
+  # launch_help
+  #-----------------------------------------------------------------------
+
+  def launch_help( s ):
+    print()
+    print( bold( 'Usage:' ), 'mflowgen bench [<key>=<value> ...]' )
+    print()
+    print( 'Synthesizes a graph of stub steps and times constructing it,' )
+    print( 'expanding parameters, sorting it, and generating the build' )
+    print( 'files for each backend. The results are printed as JSON.' )
+    print()
+    print( '  steps=100         Number of steps before the sweep'         )
+    print( '  depth=10          Number of layers of steps'                )
+    print( '  fan_in=2          Number of inputs of each step'            )
+    print( '  fan_out=2         Number of outputs of each step'           )
+    print( '  sweep=1           Width of a parameter sweep (param_space)' )
+    print( '  seed=0            Seed for the random connections'          )
+    print( '  repeat=1          Report the fastest of this many runs'     )
+    print( '  memory=1          Measure peak memory (0 to skip)'          )
+    print( '  backends=make,ninja'                                        )
+    print( '  output=<file>     Write the results to a file'              )
+    print( '  baseline=<file>   Compare with earlier results and fail if' )
+    print( '                    any measurement grew beyond the tolerance')
+    print( '  tolerance=0.2     Allowed growth over the baseline'         )
+    print()
+    print( bold( 'Example:' ), 'mflowgen bench steps=10000 depth=100',
+                               'output=bench.json' )
+    print()
+
+  #-----------------------------------------------------------------------
+  # launch_bench
+  #-----------------------------------------------------------------------
+
+  def launch_bench( s, settings ):
+
+    try:
+      results = run_benchmark(
+        steps         = settings[ 'steps'   ],
+        depth         = settings[ 'depth'   ],
+        fan_in        = settings[ 'fan_in'  ],
+        fan_out       = settings[ 'fan_out' ],
+        sweep         = settings[ 'sweep'   ],
+        seed          = settings[ 'seed'    ],
+        repeat        = settings[ 'repeat'  ],
+        memory        = bool( settings[ 'memory' ] ),
+        backend_names = settings[ 'backends' ].split( ',' ),
+      )
+    except AssertionError as e:
+      print()
+      print( bold( 'Error:' ), e )
+      print()
+      sys.exit( 1 )
+
+    text = json.dumps( results, indent=2, sort_keys=True )
+
+    if settings[ 'output' ]:
+      with open( settings[ 'output' ], 'w' ) as fd:
+        fd.write( text + '\n' )
+    else:
+      print( text )
+
+    # Compare with the baseline
+
+    if not settings[ 'baseline' ]:
+      return
+
+    with open( settings[ 'baseline' ] ) as fd:
+      baseline = json.load( fd )
+
+    if baseline.get( 'config' ) != results[ 'config' ]:
+      print( bold( 'Warning:' ), 'The baseline was run with different',
+                                 'settings', file=sys.stderr )
+
+    regressions = compare_results( baseline, results,
+                                   settings[ 'tolerance' ] )
+
+    for key, old, new in regressions:
+      print( red( 'Regression: {} grew from {:.4g} to {:.4g}'.format(
+                    key, old, new ) ), file=sys.stderr )
+
+    if regressions:
+      sys.exit( 1 )
@@ -0,0 +1,27 @@
+#=========================================================================
+# test_bench.py
+#=========================================================================
+
+from mflowgen.bench import run_benchmark, compare_results
+
+def test_bench_results( tmpdir ):
+  results = run_benchmark( steps=12, depth=3, fan_in=2, fan_out=1,
+                           sweep=2, memory=False, tmp_dir=str( tmpdir ) )
+  # The sweep copies the first step of the middle layer and everything
+  # downstream of it
+  assert results[ 'graph' ][ 'steps' ] > 12
+  assert set( results[ 'time' ] ) == { 'construct', 'param_space',
+    'validate', 'expand_params', 'topological_sort' }
+  for backend in [ 'make', 'ninja' ]:
+    data = results[ 'backends' ][ backend ]
+    assert data[ 'build_file_bytes' ] > 0 and data[ 'metadata_files' ]
+  # The benchmark cleans up after itself
+  assert tmpdir.listdir() == []
+
+def test_bench_compare():
+  old = { 'time': { 'construct': 1.0 }, 'backends': { 'make': {
+          'build': 2.0, 'build_file_bytes': 100 } } }
+  new = { 'time': { 'construct': 1.1 }, 'backends': { 'make': {
+          'build': 3.0, 'build_file_bytes': 100 } } }
+  assert compare_results( old, new ) == [ ( 'backends.make.build',
+                                            2.0, 3.0 ) ]
@@ -11,6 +11,8 @@
 #     --design   string --  Path to design directory with build graph
 #     --update          --  Re-read the graph and update the build
 #     --backend  string --  Backend build system: make, ninja
+#     --profile         --  Print the time and memory of each phase
+#     --pstats   string --  Also dump cProfile stats to a file
 #
 # mflowgen stash (Stash-related options)
 #
@@ -25,6 +27,21 @@
 #
 #  -p --path     string --  Path to step directory
 #
+# mflowgen execute (Execute-related options)
+#
+#  -j --jobs       int    --  Number of stages to run in parallel
+#  -k --keep-going        --  Keep running other stages after a failure
+#     --events     string --  Append JSON events for every stage to a file
+#
+# mflowgen bench (Benchmark-related options)
+#
+#     <key>=<value> ... --  Graph shape and settings (see "bench --help")
+#
+# mflowgen monitor (Monitor-related options)
+#
+#     --host     string --  Address to serve on (default: 127.0.0.1)
+#     --port     int    --  Port to serve on (default: 8765)
+#
 
 #
 # Author : Christopher Torng
@@ -40,6 +57,9 @@ from mflowgen.demo      import DemoHandler
 from mflowgen.core      import RunHandler
 from mflowgen.stash     import StashHandler
 from mflowgen.mock      import MockHandler
+from mflowgen.execute   import ExecuteHandler
+from mflowgen.bench     import BenchHandler
+from mflowgen.monitor   import MonitorHandler
 
 # Path hack for now to find steps and adks
 
@@ -70,6 +90,8 @@ def parse_cmdline():
   p.add_argument(       "--update",  action="store_true"          )
   p.add_argument(       "--backend", default="make",
                                      choices=("make", "ninja")    )
+  p.add_argument(       "--profile", action="store_true"          )
+  p.add_argument(       "--pstats"                                )
 
   # Stash-related arguments
   p.add_argument(       "args", type=str, nargs='*' ) # positional
@@ -79,6 +101,15 @@ def parse_cmdline():
   p.add_argument(       "--hash"                                  )
   p.add_argument(       "--all",     action="store_true"          )
   p.add_argument(       "--verbose", action="store_true"          )
+
+  # Execute-related arguments
+  p.add_argument( "-j", "--jobs", type=int                        )
+  p.add_argument( "-k", "--keep-going", action="store_true"       )
+  p.add_argument(       "--events"                                )
+
+  # Monitor-related arguments
+  p.add_argument(       "--host"                                  )
+  p.add_argument(       "--port", type=int                        )
   opts = p.parse_args()
   if opts.help and not opts.args: p.error() # print help only if not stash
   return opts
@@ -131,6 +162,41 @@ def main():
     )
     return
 
+  # Dispatch to ExecuteHandler
+
+  if opts.args and opts.args[0] == 'execute':
+    ehandler = ExecuteHandler()
+    ehandler.launch(
+      args       = opts.args[1:],
+      help_      = opts.help,
+      jobs       = opts.jobs,
+      keep_going = opts.keep_going,
+      events     = opts.events,
+    )
+    return
+
+  # Dispatch to BenchHandler
+
+  if opts.args and opts.args[0] == 'bench':
+    bhandler = BenchHandler()
+    bhandler.launch(
+      args  = opts.args[1:],
+      help_ = opts.help,
+    )
+    return
+
+  # Dispatch to MonitorHandler
+
+  if opts.args and opts.args[0] == 'monitor':
+    mhandler = MonitorHandler()
+    mhandler.launch(
+      args  = opts.args[1:],
+      help_ = opts.help,
+      host  = opts.host,
+      port  = opts.port,
+    )
+    return
+
   # Dispatch to RunHandler
 
   legacy = \
@@ -143,13 +209,17 @@ def main():
       design  = opts.design,
       update  = opts.update,
       backend = opts.backend,
+      profile = opts.profile,
+      pstats  = opts.pstats,
     )
     return
 
   # Need arguments
 
   ArgumentParserWithCustomError().error(
-    'Command can be "mflowgen run" or "mflowgen stash" or "mflowgen mock"'
+    'Command can be "mflowgen run" or "mflowgen execute" or'
+    ' "mflowgen stash" or "mflowgen mock" or "mflowgen bench" or'
+    ' "mflowgen monitor"'
   )
 
 
@@ -5,11 +5,19 @@
 # Date   : June 2, 2019
 #
 
+import sys
+
 class Edge:
 
+  # Graphs can have many edges, so avoid a per-edge __dict__. The step
+  # and file names in the handles repeat across many edges, so they are
+  # interned to share a single copy of each string.
+
+  __slots__ = ( 'src', 'dst' )
+
   def __init__( s, src, dst ):
-    s.src = src
-    s.dst = dst
+    s.src = tuple( sys.intern( x ) for x in src )
+    s.dst = tuple( sys.intern( x ) for x in dst )
 
   def get_src( s ):
     return s.src
@@ -17,4 +25,40 @@ class Edge:
   def get_dst( s ):
     return s.dst
 
+#-------------------------------------------------------------------------
+# EdgeSet
+#-------------------------------------------------------------------------
+# Adjacency set of edges for one step in the graph.
+#
+# - Adding and removing an edge is O(1)
+# - Iterating returns the edges in insertion order
+# - The sorted view (by dst, ties kept in insertion order) is computed
+#   once and reused until the next add or remove
+#
+
+class EdgeSet:
+
+  __slots__ = ( '_edges', '_sorted' )
+
+  def __init__( s ):
+    s._edges  = {} # dicts are insertion-ordered sets with O(1) removal
+    s._sorted = None
+
+  def add( s, e ):
+    s._edges[ e ] = None
+    s._sorted     = None
+
+  def remove( s, e ):
+    del( s._edges[ e ] )
+    s._sorted = None
+
+  def sorted( s ):
+    if s._sorted is None:
+      s._sorted = sorted( s._edges, key=lambda x: x.dst )
+    return s._sorted
+
+  def __iter__( s ):
+    return iter( s._edges )
 
+  def __len__( s ):
+    return len( s._edges )
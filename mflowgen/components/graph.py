@@ -5,21 +5,32 @@
 # Date   : June 2, 2019
 #
 
+import itertools
 import os
+import random
 
 from mflowgen.components.step import Step
-from mflowgen.components.edge import Edge
-from mflowgen.utils           import get_top_dir
+from mflowgen.components.edge import Edge, EdgeSet
+from mflowgen.utils           import get_top_dir, write_if_changed
 
 class Graph:
   """Graph of nodes and edges (i.e., :py:mod:`Step` and :py:mod:`Edge`)."""
 
   def __init__( s ):
 
-    s._edges_i = {}
-    s._edges_o = {}
+    s._edges_i = {} # step name -> EdgeSet of incoming edges
+    s._edges_o = {} # step name -> EdgeSet of outgoing edges
     s._steps   = {}
 
+    # Cached topological order of all steps (None if invalidated)
+
+    s._order   = None
+
+    # Totals of resources that concurrent steps may use (see
+    # set_resource_limits)
+
+    s._resource_limits = {}
+
     # System paths to search for ADKs (i.e., analogous to python sys.path)
     #
     # The contents of the environment variable "MFLOWGEN_PATH" are
@@ -80,6 +91,37 @@ class Graph:
     """
     return s.adk_step
 
+  # set_resource_limits
+
+  def set_resource_limits( s, cpus=None, mem_gb=None, licenses=None ):
+    """Sets the totals of resources that concurrently executing steps
+    may use.
+
+    Steps declare what they need with "resources" in their configure.yml
+    (or with Step.set_resources), and the build never runs steps together
+    whose needs add up to more than these totals.
+
+    Args:
+      cpus: Number of cores (defaults to the cores of the host)
+      mem_gb: Memory in GB (defaults to the memory of the host)
+      licenses: A dict of license names to the number of licenses (any
+        license that is not in the dict is not limited)
+    """
+    if cpus     is not None : s._resource_limits['cpus']     = int( cpus )
+    if mem_gb   is not None : s._resource_limits['mem_gb']   = mem_gb
+    if licenses is not None : s._resource_limits['licenses'] = \
+                                { k: int( v ) for k, v in licenses.items() }
+
+  # get_resource_limits
+
+  def get_resource_limits( s ):
+    """Gets the totals of resources set with set_resource_limits.
+
+    Returns:
+      A dict with the keys that were set (cpus, mem_gb, licenses).
+    """
+    return dict( s._resource_limits )
+
   # add_step
 
   def add_step( s, step ):
@@ -97,6 +139,7 @@ class Graph:
       'add_step -- Duplicate step "{}", ' \
       'if this is intentional, first change the step name'.format( key )
     s._steps[ key ] = step
+    s._order = None
 
   def get_step( s, step_name ):
     """Gets the Step object with the given name.
@@ -109,8 +152,11 @@ class Graph:
   def all_steps( s ):
     return sorted( s._steps.keys() )
 
-  # Edges -- incoming and outgoing adjacency lists
+  # Edges -- incoming and outgoing adjacency sets
   # Sort them for better debuggability / repeatability / causality
+  #
+  # The adjacency sets cache their sorted view, so repeated queries do not
+  # re-sort the edges.
 
   def sort_edges( s, edge_list ):
     edge_list.sort(key=lambda x: x.dst)
@@ -118,13 +164,13 @@ class Graph:
 
   def get_edges_i( s, step_name ):
     try:
-      return s.sort_edges(s._edges_i[ step_name ])
+      return list( s._edges_i[ step_name ].sorted() )
     except KeyError:
       return []
 
   def get_edges_o( s, step_name ):
     try:
-      return s.sort_edges(s._edges_o[ step_name ])
+      return list( s._edges_o[ step_name ].sorted() )
     except KeyError:
       return []
 
@@ -132,19 +178,7 @@ class Graph:
 
   def dangling_inputs( s ):
 
-    dangling = []
-
-    for step_name in s.all_steps():
-
-      incoming_edges        = s.get_edges_i( step_name )
-      incoming_edge_f_names = [ e.get_dst()[1] for e in incoming_edges ]
-
-      inputs = s.get_step( step_name ).all_inputs()
-
-      if inputs:
-        for x in inputs:
-          if x not in incoming_edge_f_names:
-            dangling.append( ( step_name, x ) )
+    dangling = s.validate()['dangling_inputs']
 
     if dangling:
       for step_name, f_name in dangling:
@@ -185,9 +219,9 @@ class Graph:
     dst_step_name, dst_direction, dst_f = dst_handle
 
     if dst_step_name not in s._edges_i.keys():
-      s._edges_i[ dst_step_name ] = []
+      s._edges_i[ dst_step_name ] = EdgeSet()
     if src_step_name not in s._edges_o.keys():
-      s._edges_o[ src_step_name ] = []
+      s._edges_o[ src_step_name ] = EdgeSet()
 
     src = ( src_step_name, src_f )
     dst = ( dst_step_name, dst_f )
@@ -195,8 +229,10 @@ class Graph:
 
     # Add this edge to tracking
 
-    s._edges_i[ dst_step_name ].append( e )
-    s._edges_o[ src_step_name ].append( e )
+    s._edges_i[ dst_step_name ].add( e )
+    s._edges_o[ src_step_name ].add( e )
+
+    s._order = None
 
   def connect_by_name( s, src, dst ):
 
@@ -207,7 +243,7 @@ class Graph:
     else:
       src_step = src
     src_step_name = src_step.get_name()
-    assert src_step_name in s.all_steps(), \
+    assert src_step_name in s._steps, \
       'connect_by_name -- ' \
       'Step "{}" not found in graph'.format( src_step_name )
 
@@ -216,7 +252,7 @@ class Graph:
     else:
       dst_step = dst
     dst_step_name = dst_step.get_name()
-    assert dst_step_name in s.all_steps(), \
+    assert dst_step_name in s._steps, \
       'connect_by_name -- ' \
       'Step "{}" not found in graph'.format( dst_step_name )
 
@@ -227,13 +263,129 @@ class Graph:
 
     overlap = set( src_outputs ).intersection( set( dst_inputs ) )
 
-    # For all overlaps, connect src to dst
+    # For all overlaps, connect src to dst (the handles are built directly
+    # since the overlap is already known to be valid)
 
     for name in overlap:
-      l_handle = src_step.o( name )
-      r_handle = dst_step.i( name )
+      l_handle = ( src_step_name, 'outputs', name )
+      r_handle = ( dst_step_name, 'inputs',  name )
       s.connect( l_handle, r_handle )
 
+  # connect_all_by_name
+
+  def connect_all_by_name( s, overrides=None, exclude=None ):
+    """Connects all unambiguous same-name matches across the whole graph.
+
+    Every step input that is not yet connected is looked up in an index
+    of output names to the steps producing them. If exactly one other
+    step produces a file with that name, the output is connected to the
+    input. Inputs with several possible producers are ambiguous and are
+    left unconnected unless an override names the producer, so that
+    chains of steps passing along the same file (e.g.,
+    "design.checkpoint") can still be connected explicitly with
+    :py:meth:`Graph.connect_by_name`. For example:
+
+    .. code-block:: python
+
+        g.connect_all_by_name(
+          overrides = { ( 'cts', 'design.checkpoint' ) : 'place' },
+          exclude   = [ 'debugcalibre', ( 'drc', 'design.gds.gz' ) ],
+        )
+
+    The cost is linear in the total number of inputs and outputs in the
+    graph.
+
+    Args:
+      overrides : A dict mapping consumers to the producer to use when a
+                  name is ambiguous. Keys are either a step or a
+                  ( step, input name ) tuple, and values are a step.
+                  A step-wide override applies to the inputs that its
+                  producer has outputs for. Steps may be given as Step
+                  objects or step names.
+      exclude   : A list of steps and ( step, input name ) tuples. An
+                  excluded step is neither connected as a producer nor
+                  as a consumer. An excluded tuple leaves just that
+                  input unconnected.
+
+    Returns:
+      A list of ( step name, input name, producer names ) tuples for the
+      ambiguous inputs that were left unconnected.
+    """
+
+    # Normalize the overrides and exclusions to names
+
+    def _name( x ):
+      return x.get_name() if type( x ) == Step else x
+
+    def _key( x ):
+      if type( x ) == tuple:
+        return ( _name( x[0] ), x[1] )
+      return _name( x )
+
+    overrides = { _key( k ): _name( v ) for k, v in \
+                                          ( overrides or {} ).items() }
+    exclude   = set( _key( x ) for x in ( exclude or [] ) )
+
+    for k in list( overrides.keys() ) + list( exclude ):
+      step_name = k[0] if type( k ) == tuple else k
+      assert step_name in s._steps, \
+        'connect_all_by_name -- ' \
+        'Step "{}" not found in graph'.format( step_name )
+
+    # Index of output names -> producer step names
+
+    producers = {}
+
+    for step_name in s.all_steps():
+      if step_name in exclude:
+        continue
+      for f in s._steps[ step_name ].all_outputs():
+        producers.setdefault( f, [] ).append( step_name )
+
+    # Connect each unconnected input to its producer
+
+    ambiguous = []
+
+    for step_name in s.all_steps():
+
+      if step_name in exclude:
+        continue
+
+      try:
+        connected = set( e.get_dst()[1] for e in s._edges_i[ step_name ] )
+      except KeyError:
+        connected = set()
+
+      for f in s._steps[ step_name ].all_inputs():
+
+        if f in connected or ( step_name, f ) in exclude:
+          continue
+
+        candidates = [ x for x in producers.get( f, [] ) if x != step_name ]
+
+        # An input-specific override must name a producer of this file. A
+        # step-wide override only applies if it produces this file.
+
+        src_step_name = overrides.get( ( step_name, f ) )
+
+        if src_step_name:
+          assert src_step_name in candidates, \
+            'connect_all_by_name -- Override step "{}" has no output "{}" ' \
+            'for step "{}"'.format( src_step_name, f, step_name )
+        elif overrides.get( step_name ) in candidates:
+          src_step_name = overrides[ step_name ]
+        elif len( candidates ) == 1:
+          src_step_name = candidates[0]
+        elif len( candidates ) > 1:
+          ambiguous.append( ( step_name, f, candidates ) )
+
+        if src_step_name:
+          s.connect( ( src_step_name, 'outputs', f ),
+                     ( step_name,     'inputs',  f ) )
+          connected.add( f )
+
+    return ambiguous
+
   #-----------------------------------------------------------------------
   # Parameter system
   #-----------------------------------------------------------------------
@@ -348,6 +500,150 @@ class Graph:
       'bar-p-3').
     """
 
+    return s._param_expand( step        = step,
+                            param_names = [ param_name ],
+                            points      = [ ( p, ) for p in param_space ] )
+
+  # param_grid
+
+  def param_grid( s, step, params ):
+    """Spins out new copies of the step across the Cartesian product of
+    several parameter spaces at once.
+
+    This is equivalent to calling :py:meth:`Graph.param_space` for the
+    first parameter and then again on each of the new steps for the next
+    parameter (and so on), producing the same step names and edges. For
+    example, this call:
+
+    .. code-block:: python
+
+        g.param_grid( 'bar', { 'p': [ 1, 2 ], 'q': [ 'a', 'b' ] } )
+
+    produces the steps 'bar-p-1-q-a', 'bar-p-1-q-b', 'bar-p-2-q-a', and
+    'bar-p-2-q-b' (and similarly named copies of all downstream steps).
+
+    Unlike repeated calls to :py:meth:`Graph.param_space`, the graph is
+    traversed only once, so the cost scales with the size of the final
+    expanded graph rather than with the number of sweep dimensions.
+
+    Args:
+      step   : A string for the step name targeted for expansion
+      params : A dict of parameter names (strings) and lists of values to
+               expand to. The sweep dimensions are ordered as in the dict.
+
+    Returns:
+      A list of (parameterized) steps, one for each point in the grid.
+    """
+
+    assert params, \
+      'param_grid -- ' \
+      'No parameters given to expand step "{}"'.format(
+        step if type( step ) == str else step.get_name() )
+
+    param_names = list( params.keys() )
+    points      = list( itertools.product( *params.values() ) )
+
+    return s._param_expand( step, param_names, points )
+
+  # param_zip
+
+  def param_zip( s, step, params ):
+    """Spins out new copies of the step for parameter values taken in
+    lockstep (i.e., zipped) instead of as a Cartesian product.
+
+    For example, this call:
+
+    .. code-block:: python
+
+        g.param_zip( 'bar', { 'p': [ 1, 2 ], 'q': [ 'a', 'b' ] } )
+
+    produces only the steps 'bar-p-1-q-a' and 'bar-p-2-q-b'.
+
+    Args:
+      step   : A string for the step name targeted for expansion
+      params : A dict of parameter names (strings) and lists of values.
+               All lists must have the same length.
+
+    Returns:
+      A list of (parameterized) steps, one for each set of values.
+    """
+
+    assert params, \
+      'param_zip -- ' \
+      'No parameters given to expand step "{}"'.format(
+        step if type( step ) == str else step.get_name() )
+
+    lengths = set( len( v ) for v in params.values() )
+
+    assert len( lengths ) <= 1, \
+      'param_zip -- ' \
+      'All parameter lists must have the same length: {}'.format(
+        { k: len( v ) for k, v in params.items() } )
+
+    param_names = list( params.keys() )
+    points      = list( zip( *params.values() ) )
+
+    return s._param_expand( step, param_names, points )
+
+  # param_sample
+
+  def param_sample( s, step, params, n, seed=None ):
+    """Spins out new copies of the step for a random sample of points
+    from the Cartesian product of several parameter spaces.
+
+    The sampled points keep the same order (and naming) that they would
+    have in :py:meth:`Graph.param_grid`. The full grid is never
+    materialized, so sampling a few points from a very large space is
+    cheap.
+
+    Args:
+      step   : A string for the step name targeted for expansion
+      params : A dict of parameter names (strings) and lists of values
+      n      : The number of points to sample (at most the grid size)
+      seed   : An optional seed for repeatable sampling
+
+    Returns:
+      A list of (parameterized) steps, one for each sampled point.
+    """
+
+    param_names = list( params.keys() )
+    spaces      = list( params.values() )
+
+    grid_size = 1
+    for space in spaces:
+      grid_size *= len( space )
+
+    assert n <= grid_size, \
+      'param_sample -- ' \
+      'Cannot sample {} points from a grid of {} points'.format(
+        n, grid_size )
+
+    # Sample flat indices into the grid and then decode each index into
+    # one value per dimension (the last dimension varies fastest, as in
+    # itertools.product)
+
+    indices = sorted( random.Random( seed ).sample( range( grid_size ), n ) )
+
+    points = []
+    for idx in indices:
+      point = []
+      for space in reversed( spaces ):
+        idx, i = divmod( idx, len( space ) )
+        point.append( space[i] )
+      points.append( tuple( reversed( point ) ) )
+
+    return s._param_expand( step, param_names, points )
+
+  # _param_expand
+  #
+  # Spins out one copy of the step (and all of its downstream steps) for
+  # each point, where each point is a tuple of values for the parameters
+  # in param_names. Each copy is named with the base name followed by a
+  # "-<param_name>-<value>" suffix for each parameter.
+  #
+
+  def _param_expand( s, step, param_names, points ):
+
     # Get the step name (in case the user provided a step object instead)
 
     if type( step ) != str:
@@ -356,15 +652,45 @@ class Graph:
       step_name = step
       step      = s.get_step( step_name )
 
-    assert step_name in s.all_steps(), \
+    assert step_name in s._steps, \
       'param_space -- ' \
       'Step "{}" not found in graph'.format( step_name )
 
-    # Remove the step and its incoming edges from the graph
+    # An empty parameter space would remove the step and all of its
+    # downstream steps without any copies to replace them
 
-    del( s._steps[ step_name ] )
+    assert points, \
+      'param_space -- ' \
+      'No parameter values given to expand step "{}"'.format( step_name )
 
-    elist_i = s._param_space_helper_remove_incoming_edges( step_name )
+    suffixes = []
+    for point in points:
+      suffix = ''
+      for param_name, p in zip( param_names, point ):
+        suffix += '-' + param_name + '-' + str(p)
+      suffixes.append( suffix )
+
+    # Find all downstream steps before modifying the graph, and sort them
+    # in _topological_ sort order.
+    #
+    # Expanding in topological order handles cases where downstream nodes
+    # depend on multiple previous nodes. For example:
+    #
+    #         +---+    +---+    +---+
+    #         | A | -> | B | -> | C |
+    #         +---+    +---+    +---+
+    #           |               ^
+    #            \_____________/
+    #
+    # On each node expansion, we are breaking the incoming edges of that
+    # node, removing the node from the graph, stamping out parameterized
+    # versions of the node, and reconnecting the incoming edges. By the
+    # time we reach a node, all of its expanded upstream nodes have
+    # already been stamped out, so each copy can be wired up directly.
+    #
+
+    dep_steps = s._param_space_helper_get_downstream_steps( step_name )
+    dep_steps = s.topological_sort( seed_steps=dep_steps )
 
     # Now spin out new copies of the step across the parameter space
     #
@@ -391,112 +717,59 @@ class Graph:
     #                 +-----------+
     #
 
-    new_steps = []
+    new_src_map = {}
 
-    for p in param_space:
-      p_step = step.clone()
-      p_step.set_param( param_name, p )
-      p_step.set_name( step_name + '-' + param_name + '-' + str(p) )
-      s.add_step( p_step )
-      for e in elist_i:
-        src_step_name, src_f = e.get_src()
-        dst_step_name, dst_f = e.get_dst()
-        src_step = s.get_step( src_step_name )
-        s.connect( src_step.o( src_f ), p_step.i( dst_f ) )
-      new_steps.append( p_step )
+    new_steps = s._param_space_helper( step_name, new_src_map,
+                                       param_names, points, suffixes,
+                                       strict = True )
 
-    # Build a dict to map (removed) base steps to their expanded steps
-
-    new_src_map = { step_name : new_steps }
-
-    # Recurse on downstream nodes
+    # Then take each dependent step (i.e., baz), replicate the step across
+    # the parameter space, and connect to the frontier of new srcs (i.e.,
+    # bar-p-1, bar-p-2, bar-p-3).
     #
-    # We traverse down the graph in _topological_ sort order to handle
-    # cases where downstream nodes depend on multiple previous nodes. For
-    # example:
-    #
-    #         +---+    +---+    +---+
-    #         | A | -> | B | -> | C |
-    #         +---+    +---+    +---+
-    #           |               ^
-    #            \_____________/
-    #
-    # On each node expansion, we are breaking the incoming edges of that
-    # node, removing the node from the graph, stamping out three
-    # parameterized versions of the node, and reconnecting the incoming
-    # edges.
+    # End like this:
     #
-    # The natural expansion order is A, B, C (i.e., topological sort
-    # order). If we use non-topological sort order, then the solution is
-    # less clean.
+    #                 +-----------+    +-----------+
+    #             +-> |  bar-p-1  | -> |  baz-p-1  |
+    #             |   | ( p = 1 ) |    |           |
+    #             |   +-----------+    +-----------+
+    #     +-----+ |   +-----------+    +-----------+
+    #     | foo | --> |  bar-p-2  | -> |  baz-p-2  |
+    #     |     | |   | ( p = 2 ) |    |           |
+    #     +-----+ |   +-----------+    +-----------+
+    #             |   +-----------+    +-----------+
+    #             +-> |  bar-p-3  | -> |  baz-p-3  |
+    #                 | ( p = 3 ) |    |           |
+    #                 +-----------+    +-----------+
     #
 
-    dep_steps = s._param_space_helper_get_dependent_steps( step_name )
-    dep_steps = s.topological_sort( seed_steps=dep_steps )
-
-    # For each dependent step, replicate and connect to the graph
-
-    visited = set()
-
     for dep_step in dep_steps:
-      s._param_space_helper( step_name   = dep_step,
-                             new_src_map = new_src_map,
-                             visited     = visited,
-                             param_name  = param_name,
-                             param_space = param_space )
+      s._param_space_helper( dep_step, new_src_map,
+                             param_names, points, suffixes,
+                             strict = False )
 
     return new_steps
 
   # _param_space_helper
   #
-  # Take the dependent step (i.e., baz), replicate the step across the
-  # parameter space, and then connect to the frontier of new_srcs (i.e.,
-  # bar-p-1, bar-p-2, bar-p-3).
-  #
-  # Start from this:
-  #
-  #                 +-----------+
-  #             +-> |  bar-p-1  |
-  #             |   | ( p = 1 ) |        +-----------+
-  #             |   +-----------+     -- |    baz    |
-  #     +-----+ |   +-----------+        |           |
-  #     | foo | --> |  bar-p-2  |        +-----------+
-  #     |     | |   | ( p = 2 ) |
-  #     +-----+ |   +-----------+
-  #             |   +-----------+
-  #             +-> |  bar-p-3  |
-  #                 | ( p = 3 ) |
-  #                 +-----------+
-  #
-  # End like this:
+  # Removes the step and its incoming edges from the graph, replaces it
+  # with one copy per point, and reconnects the incoming edges to each
+  # copy. Edges from steps that were already expanded (i.e., in
+  # new_src_map) connect to the copy for the same point.
   #
-  #                 +-----------+    +-----------+
-  #             +-> |  bar-p-1  | -> |  baz-p-1  |
-  #             |   | ( p = 1 ) |    |           |
-  #             |   +-----------+    +-----------+
-  #     +-----+ |   +-----------+    +-----------+
-  #     | foo | --> |  bar-p-2  | -> |  baz-p-2  |
-  #     |     | |   | ( p = 2 ) |    |           |
-  #     +-----+ |   +-----------+    +-----------+
-  #             |   +-----------+    +-----------+
-  #             +-> |  bar-p-3  | -> |  baz-p-3  |
-  #                 | ( p = 3 ) |    |           |
-  #                 +-----------+    +-----------+
+  # - strict : if True, every parameter must exist in the step, otherwise
+  #            parameters that cannot be accessed are left alone
   #
 
-  def _param_space_helper( s, step_name, new_src_map, visited,
-                                         param_name,  param_space ):
-
-    if step_name in visited:
-      return
-    else:
-      visited.add( step_name )
+  def _param_space_helper( s, step_name, new_src_map, param_names,
+                                         points, suffixes, strict ):
 
     step = s.get_step( step_name )
 
     # Remove the step and its incoming edges from the graph
 
     del( s._steps[ step_name ] )
+    s._order = None
 
     elist_i = s._param_space_helper_remove_incoming_edges( step_name )
 
@@ -504,72 +777,68 @@ class Graph:
 
     new_steps = []
 
-    for i, p in enumerate( param_space ):
+    for i, ( point, suffix ) in enumerate( zip( points, suffixes ) ):
       p_step = step.clone()
-      p_step.set_name( step_name + '-' + param_name + '-' + str(p) )
-      # Propagate the new parameter value to downstream nodes
-      try:
-        p_step.set_param( param_name, p )
-      # If the parameter cannot be accessed, do nothing to the parameter
-      except KeyError:
-        pass
+      p_step.set_name( step_name + suffix )
+      # Propagate the new parameter values to downstream nodes
+      for param_name, p in zip( param_names, point ):
+        try:
+          p_step.set_param( param_name, p )
+        # If the parameter cannot be accessed, do nothing to the parameter
+        except KeyError:
+          if strict:
+            raise
       s.add_step( p_step )
       for e in elist_i:
         src_step_name, src_f = e.get_src()
         dst_step_name, dst_f = e.get_dst()
-        if src_step_name in new_src_map.keys():
+        if src_step_name in new_src_map:
           src_step = new_src_map[src_step_name][i]
         else:
           src_step = s.get_step( src_step_name )
         s.connect( src_step.o( src_f ), p_step.i( dst_f ) )
       new_steps.append( p_step )
 
-    # Build a dict to map (removed) base steps to their expanded steps
-
-    new_src_map.update( { step_name : new_steps } )
-
-    # Recurse on downstream nodes
-
-    dep_steps = s._param_space_helper_get_dependent_steps( step_name )
-    dep_steps = s.topological_sort( seed_steps=dep_steps )
+    # Map the (removed) base step to its expanded steps
 
-    # For each dependent step, replicate and connect to the new steps
-
-    for dep_step in dep_steps:
-      s._param_space_helper( step_name   = dep_step,
-                             new_src_map = new_src_map,
-                             visited     = visited,
-                             param_name  = param_name,
-                             param_space = param_space )
+    new_src_map[ step_name ] = new_steps
 
     return new_steps
 
   def _param_space_helper_remove_incoming_edges( s, step_name ):
 
     try:
-      elist_i = s._edges_i[ step_name ]
-      del( s._edges_i[ step_name ] ) # Delete edges in incoming edge list
-      for e in elist_i: # Also delete these edges in outgoing edge lists
+      elist_i = list( s._edges_i[ step_name ] )
+      del( s._edges_i[ step_name ] ) # Delete edges in incoming edge set
+      for e in elist_i: # Also delete these edges in outgoing edge sets
         src_step_name, src_f = e.get_src()
-        src_elist_o = s._edges_o[src_step_name]
-        del( src_elist_o[ src_elist_o.index( e ) ] )
+        s._edges_o[src_step_name].remove( e )
     except KeyError:
       elist_i = []
 
     return elist_i
 
-  def _param_space_helper_get_dependent_steps( s, step_name ):
+  # _param_space_helper_get_downstream_steps
+  #
+  # Returns the set of all steps reachable from the given step (not
+  # including the step itself)
+  #
 
-    dep_steps = set()
+  def _param_space_helper_get_downstream_steps( s, step_name ):
 
-    try:
-      elist_o = s._edges_o[ step_name ]
-    except KeyError:
-      elist_o = []
+    dep_steps = set()
+    frontier  = [ step_name ]
 
-    for e in elist_o:
-      dst_step_name, dst_f = e.get_dst()
-      dep_steps.add( dst_step_name )
+    while frontier:
+      try:
+        elist_o = s._edges_o[ frontier.pop() ]
+      except KeyError:
+        continue
+      for e in elist_o:
+        dst_step_name, dst_f = e.get_dst()
+        if dst_step_name not in dep_steps and dst_step_name != step_name:
+          dep_steps.add( dst_step_name )
+          frontier.append( dst_step_name )
 
     return dep_steps
 
@@ -678,7 +947,7 @@ ranksep=0.8;
 
     elist = []
     for edges in s._edges_i.values():
-      elist = elist + edges
+      elist.extend( edges )
     s.sort_edges(elist)
 
     # Build dot-graph edges
@@ -696,85 +965,374 @@ ranksep=0.8;
 
         dot_edges.append( edge_template.format( **e_cfg ) )
 
-    # Write out the graphviz dot graph file
+    # Write out the graphviz dot graph file (if it changed)
 
-    with open( dot_f, 'w' ) as fd:
-      graph_cfg = {}
-      graph_cfg['title'] = dot_title
-      graph_cfg['nodes'] = '\n'.join( dot_nodes )
-      graph_cfg['edges'] = '\n'.join( dot_edges )
-      fd.write( graph_template.format( **graph_cfg ) )
+    graph_cfg = {}
+    graph_cfg['title'] = dot_title
+    graph_cfg['nodes'] = '\n'.join( dot_nodes )
+    graph_cfg['edges'] = '\n'.join( dot_edges )
+    write_if_changed( dot_f, graph_template.format( **graph_cfg ) )
 
   #-----------------------------------------------------------------------
-  # Graph traversal order
+  # Validation
   #-----------------------------------------------------------------------
 
-  def topological_sort( s, seed_steps=False ):
+  # validate
+  #
+  # Checks the connectivity of the whole graph in a single pass that is
+  # linear in the number of steps, ports, and edges. Returns a report:
+  #
+  #     {
+  #       'cycles'              : [ [ 'step-a', 'step-b' ], ... ],
+  #       'invalid_edges'       : [ ( ( src, f ), ( dst, f ) ), ... ],
+  #       'duplicate_producers' : [ ( dst, f, [ ( src, f ), ... ] ), ... ],
+  #       'dangling_inputs'     : [ ( step, f ), ... ],
+  #       'unused_outputs'      : [ ( step, f ), ... ],
+  #     }
+  #
+  # - cycles              : strongly connected components (see check_cycles)
+  # - invalid_edges       : edges whose src or dst step is not in the graph
+  #                         or whose file is not an output or input of that
+  #                         step
+  # - duplicate_producers : inputs that more than one edge connects to
+  # - dangling_inputs     : inputs that no edge connects to
+  # - unused_outputs      : outputs that no edge connects from
+  #
+  # The first three make the graph unbuildable. Dangling inputs and unused
+  # outputs are common in practice (e.g., optional inputs and reports), so
+  # they are reported for information only.
+  #
 
-    order = []
+  def validate( s ):
+
+    report = {
+      'cycles'              : s.check_cycles() or [],
+      'invalid_edges'       : [],
+      'duplicate_producers' : [],
+      'dangling_inputs'     : [],
+      'unused_outputs'      : [],
+    }
+
+    # Index the declared ports of each step
+
+    inputs  = {}
+    outputs = {}
+
+    for step_name, step in s._steps.items():
+      inputs[ step_name ]  = set( step.all_inputs()  )
+      outputs[ step_name ] = set( step.all_outputs() )
+
+    # Edges into steps that are not in the graph
+
+    for step_name in sorted( s._edges_i.keys() ):
+      if step_name not in s._steps:
+        for e in s._edges_i[ step_name ].sorted():
+          report['invalid_edges'].append( ( e.get_src(), e.get_dst() ) )
+
+    # Check each input against its incoming edges
+
+    consumed = set()
+
+    for step_name in s.all_steps():
+
+      producers = {}
+
+      try:
+        elist = s._edges_i[ step_name ].sorted()
+      except KeyError:
+        elist = []
+
+      for e in elist:
+        src_step_name, src_f = e.get_src()
+        dst_f                = e.get_dst()[1]
+        if dst_f not in inputs[ step_name ] or \
+            src_f not in outputs.get( src_step_name, () ):
+          report['invalid_edges'].append( ( e.get_src(), e.get_dst() ) )
+          continue
+        producers.setdefault( dst_f, [] ).append( e.get_src() )
+        consumed.add( e.get_src() )
+
+      for f in s._steps[ step_name ].all_inputs():
+        if f not in producers:
+          report['dangling_inputs'].append( ( step_name, f ) )
+        elif len( producers[ f ] ) > 1:
+          report['duplicate_producers'].append(
+            ( step_name, f, producers[ f ] ) )
+
+    # Outputs that no edge consumes
+
+    for step_name in s.all_steps():
+      for f in s._steps[ step_name ].all_outputs():
+        if ( step_name, f ) not in consumed:
+          report['unused_outputs'].append( ( step_name, f ) )
+
+    return report
+
+  # check_cycles
+  #
+  # Returns None if the graph has no cycles, otherwise returns the list of
+  # cycles, each as a sorted list of the step names in a strongly
+  # connected component (including steps connected to themselves).
+  #
+  # This is Tarjan's algorithm, written iteratively so that long chains
+  # of steps do not hit the recursion limit.
+  #
+
+  def check_cycles( s ):
+
+    # Successors of each step
+
+    succs = {}
+
+    for step_name in s.all_steps():
+      try:
+        elist = s._edges_o[ step_name ].sorted()
+      except KeyError:
+        elist = []
+      succs[ step_name ] = [ e.get_dst()[0] for e in elist
+                                            if e.get_dst()[0] in s._steps ]
+
+    index   = {}
+    lowlink = {}
+    stack   = []
+    onstack = set()
+    cycles  = []
+
+    for root in s.all_steps():
+
+      if root in index:
+        continue
+
+      index[ root ] = lowlink[ root ] = len( index )
+      stack.append( root )
+      onstack.add( root )
+      work = [ ( root, iter( succs[ root ] ) ) ]
+
+      while work:
+
+        step_name, it = work[-1]
+
+        # Visit the next successor of the step on top of the work stack
+
+        for succ in it:
+          if succ not in index:
+            index[ succ ] = lowlink[ succ ] = len( index )
+            stack.append( succ )
+            onstack.add( succ )
+            work.append( ( succ, iter( succs[ succ ] ) ) )
+            break
+          elif succ in onstack:
+            lowlink[ step_name ] = min( lowlink[ step_name ], index[ succ ] )
+
+        else:
+
+          # All successors are done, so pop the step and its component
+
+          work.pop()
+
+          if work:
+            parent = work[-1][0]
+            lowlink[ parent ] = min( lowlink[ parent ], lowlink[ step_name ] )
+
+          if lowlink[ step_name ] == index[ step_name ]:
+            scc = []
+            while True:
+              x = stack.pop()
+              onstack.discard( x )
+              scc.append( x )
+              if x == step_name:
+                break
+            if len( scc ) > 1 or step_name in succs[ step_name ]:
+              cycles.append( sorted( scc ) )
+
+    return sorted( cycles ) or None
+
+  #-----------------------------------------------------------------------
+  # Graph diff
+  #-----------------------------------------------------------------------
+
+  # diff
+  #
+  # Structural diff from the given (previous) graph to this graph. Returns
+  # a report:
+  #
+  #     {
+  #       'added'           : [ 'step-a', ... ],
+  #       'removed'         : [ 'step-b', ... ],
+  #       'reparameterized' : [ 'step-c', ... ],
+  #       'modified'        : [ 'step-d', ... ],
+  #       'rewired'         : [ 'step-e', ... ],
+  #       'rebuild'         : [ 'step-a', 'step-c', ... ],
+  #     }
+  #
+  # - added           : steps only in this graph
+  # - removed         : steps only in the previous graph
+  # - reparameterized : steps whose parameters changed
+  # - modified        : steps whose configuration changed otherwise (e.g.,
+  #                     commands, inputs, outputs, step directory, sandbox)
+  # - rewired         : steps whose incoming edges changed
+  # - rebuild         : all changed steps in this graph and everything
+  #                     transitively downstream of them, in topological
+  #                     order
+  #
+  # The steps are compared as constructed, so both graphs should be
+  # diffed before expanding parameters.
+  #
+
+  def diff( s, prev ):
+
+    report = {
+      'added'           : [],
+      'removed'         : [],
+      'reparameterized' : [],
+      'modified'        : [],
+      'rewired'         : [],
+      'rebuild'         : [],
+    }
+
+    report['added']   = sorted( set( s._steps ) - set( prev._steps ) )
+    report['removed'] = sorted( set( prev._steps ) - set( s._steps ) )
+
+    def _edges( g, step_name ):
+      try:
+        return set( ( e.get_src(), e.get_dst() )
+                    for e in g._edges_i[ step_name ] )
+      except KeyError:
+        return set()
+
+    for step_name in s.all_steps():
+
+      if step_name not in prev._steps:
+        continue
 
-    # Make a deep copy of the edges (destructive algorithm)
+      step      = s._steps[ step_name ]
+      prev_step = prev._steps[ step_name ]
 
-    edges_deep_copy = {}
-    for step_name, elist in s._edges_i.items():
-      edges_deep_copy[ step_name ] = list(elist)
-    edges = edges_deep_copy
+      config      = dict( step._config )
+      prev_config = dict( prev_step._config )
+
+      if config.pop( 'parameters', {} ) != \
+          prev_config.pop( 'parameters', {} ):
+        report['reparameterized'].append( step_name )
+
+      if config != prev_config or step.get_dir() != prev_step.get_dir():
+        report['modified'].append( step_name )
+
+      if _edges( s, step_name ) != _edges( prev, step_name ):
+        report['rewired'].append( step_name )
+
+    # Everything downstream of a changed step must rebuild too
+
+    changed = set( report['added'] )           \
+            | set( report['reparameterized'] ) \
+            | set( report['modified'] )        \
+            | set( report['rewired'] )
+
+    rebuild  = set( changed )
+    frontier = list( changed )
+
+    while frontier:
+      try:
+        elist_o = s._edges_o[ frontier.pop() ]
+      except KeyError:
+        continue
+      for e in elist_o:
+        dst_step_name = e.get_dst()[0]
+        if dst_step_name not in rebuild and dst_step_name in s._steps:
+          rebuild.add( dst_step_name )
+          frontier.append( dst_step_name )
+
+    report['rebuild'] = s.topological_sort( seed_steps=rebuild )
+
+    return report
+
+  #-----------------------------------------------------------------------
+  # Graph traversal order
+  #-----------------------------------------------------------------------
+
+  # topological_sort
+  #
+  # Returns the steps in topological order. Steps are released level by
+  # level (i.e., all steps whose dependencies are satisfied at the same
+  # time are released together), and each level is sorted by name for
+  # determinacy.
+  #
+  # This is Kahn's algorithm with an in-degree counter per step, so the
+  # cost is linear in the number of steps and edges considered. The order
+  # for the full graph is cached and invalidated whenever steps or edges
+  # are added or removed (i.e., add_step, connect, param_space).
+  #
+  # - seed_steps : a set of step names to only consider that subgraph
+  #                (with incoming dangling edges removed)
+  #
+
+  def topological_sort( s, seed_steps=False ):
 
     # Consider all steps in the graph, or if there are seed steps then
     # only consider that subgraph (with incoming dangling edges removed)
 
     if type( seed_steps ) != set:
-      steps = set( s.all_steps() )
+      if s._order is None:
+        s._order = s._topological_sort( set( s._steps.keys() ),
+                                        subgraph = False )
+      return list( s._order )
     else:
-      steps = set( seed_steps )
       # If there are no steps, just return an empty list
-      if not steps:
+      if not seed_steps:
         return []
-      # Delete any edges directed to nodes not in the subgraph
-      steps_with_edges_i = list( edges.keys() )
-      for k in steps_with_edges_i:
-        if k not in seed_steps:
-          del( edges[k] )
-      # Delete any incoming edges from src nodes not in the subgraph
-      keys_to_delete = []
-      for step_name, elist in edges.items():
-        idx_to_delete = []
-        for i, e in enumerate( elist ):
-          if e.get_src()[0] not in seed_steps:
-            idx_to_delete.append( i )
-        for i in reversed( idx_to_delete ):
-          del( elist[i] )
-        if elist == []:
-          keys_to_delete.append( step_name )
-      for k in keys_to_delete:
-        del( edges[k] )
-
-    # Topological sort
-
-    while( steps ):
-
-      steps_with_deps    = set( edges.keys() )
-      steps_without_deps = steps.difference( steps_with_deps )
-
-      assert steps_without_deps, \
-        'topological_sort -- Could not find a valid sort for ' \
-        '{}'.format( steps )
-
-      order.extend( sorted( steps_without_deps ) ) # sort for determinacy
-      steps = steps_with_deps
-
-      keys_to_delete = []
-      for step_name, elist in edges.items():
-        idx_to_delete = []
-        for i, e in enumerate( elist ):
-          if e.get_src()[0] in order:
-            idx_to_delete.append( i )
-        for i in reversed( idx_to_delete ):
-          del( elist[i] )
-        if elist == []:
-          keys_to_delete.append( step_name )
-
-      for k in keys_to_delete:
-        del( edges[k] )
+      return s._topological_sort( seed_steps, subgraph = True )
+
+  # _topological_sort
+  #
+  # Kahn's algorithm over the given steps
+  #
+  # - steps    : set of step names to sort
+  # - subgraph : if True, ignore incoming edges from steps not in "steps"
+  #              (otherwise these edges can never be satisfied)
+  #
+
+  def _topological_sort( s, steps, subgraph ):
+
+    # Count the incoming edges of each step and index the outgoing edges
+    # of each src step
+
+    n_deps    = {}
+    dependent = {}
+
+    for step_name in steps:
+      n_deps[ step_name ] = 0
+      try:
+        elist = s._edges_i[ step_name ]
+      except KeyError:
+        continue
+      for e in elist:
+        src_step_name = e.get_src()[0]
+        if subgraph and src_step_name not in steps:
+          continue
+        n_deps[ step_name ] += 1
+        try:
+          dependent[ src_step_name ].append( step_name )
+        except KeyError:
+          dependent[ src_step_name ] = [ step_name ]
+
+    # Release steps level by level
+
+    order = []
+    level = sorted( [ x for x in steps if n_deps[x] == 0 ] )
+
+    while level:
+      order.extend( level ) # each level is sorted for determinacy
+      next_level = []
+      for src_step_name in level:
+        for step_name in dependent.get( src_step_name, [] ):
+          n_deps[ step_name ] -= 1
+          if n_deps[ step_name ] == 0:
+            next_level.append( step_name )
+      level = sorted( next_level )
+
+    assert len( order ) == len( steps ), \
+      'topological_sort -- Could not find a valid sort, the graph has ' \
+      'cycles: {}'.format( s.check_cycles() )
 
     return order
+
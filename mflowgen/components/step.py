@@ -9,7 +9,10 @@ import copy
 import os
 import yaml
 
-from mflowgen.utils import get_top_dir, read_yaml, write_yaml
+from mflowgen.core.resources import normalize_resources
+from mflowgen.utils          import get_top_dir, read_yaml_cached
+from mflowgen.utils          import write_if_changed
+from mflowgen.utils.helpers  import YamlDumper
 
 class Step:
 
@@ -21,6 +24,10 @@ class Step:
 
     s._config = {}
 
+    # Config fields whose values are shared with other steps (see clone)
+
+    s._shared = set()
+
     if default:
       yaml_path = '/'.join([
         get_top_dir(),
@@ -34,9 +41,9 @@ class Step:
         'configure.yml'
       ])
 
-    # Read the YAML data
+    # Read the YAML data (cached across all steps in this process)
 
-    data = read_yaml( yaml_path )
+    data = read_yaml_cached( yaml_path )
 
     # Check that this is a valid step configuration
 
@@ -128,12 +135,46 @@ class Step:
   # Clone
   #-----------------------------------------------------------------------
 
+  # clone
+  #
+  # Clones are copy-on-write. The new step gets a shallow copy of the
+  # config, so both steps share the values of every field (e.g., the
+  # lists of commands and postconditions). A field is only deep-copied
+  # the first time either step modifies it or hands it out to a caller
+  # that may modify it (see _own). Cloning is therefore proportional to
+  # the number of fields rather than to their contents, and fields that
+  # no clone ever modifies are never copied.
+  #
+
   def clone( s ):
     new_step = Step.__new__( Step )
-    new_step._config = copy.deepcopy( s._config )
-    new_step.step_dir  = s.step_dir
+    new_step._config  = dict( s._config )
+    new_step._shared  = set( s._config.keys() )
+    new_step.step_dir = s.step_dir
+    s._shared         = set( s._config.keys() )
     return new_step
 
+  # _own
+  #
+  # Makes sure this step has a private copy of the given config field
+  # before it is modified
+  #
+
+  def _own( s, key ):
+    if key in s._shared:
+      s._shared.discard( key )
+      if key in s._config:
+        s._config[ key ] = copy.deepcopy( s._config[ key ] )
+
+  # _set
+  #
+  # Replaces the given config field (no copy needed)
+  #
+
+  def _set( s, key, value ):
+    s._shared.discard( key )
+    s._config[ key ] = value
+
   #-----------------------------------------------------------------------
   # API to help build graphs interactively
   #-----------------------------------------------------------------------
@@ -193,6 +234,7 @@ class Step:
   # API to extend inputs and outputs
 
   def extend_inputs( s, new_list ):
+    s._own( 'inputs' )
     try:
       s._config['inputs']
     except KeyError:
@@ -200,6 +242,7 @@ class Step:
     s._config['inputs'].extend( new_list )
 
   def extend_outputs( s, new_list ):
+    s._own( 'outputs' )
     try:
       s._config['outputs']
     except KeyError:
@@ -209,6 +252,7 @@ class Step:
   # API to pre/post extend commands
 
   def pre_extend_commands( s, new_list ):
+    s._own( 'commands' )
     try:
       s._config['commands']
     except KeyError:
@@ -216,6 +260,7 @@ class Step:
     s._config['commands'][:0] = new_list
 
   def extend_commands( s, new_list ):
+    s._own( 'commands' )
     try:
       s._config['commands']
     except KeyError:
@@ -225,6 +270,7 @@ class Step:
   # API to extend preconditions and postconditions
 
   def extend_preconditions( s, new_list ):
+    s._own( 'preconditions' )
     try:
       s._config['preconditions']
     except KeyError:
@@ -232,6 +278,7 @@ class Step:
     s._config['preconditions'].extend( new_list )
 
   def extend_postconditions( s, new_list ):
+    s._own( 'postconditions' )
     try:
       s._config['postconditions']
     except KeyError:
@@ -239,15 +286,17 @@ class Step:
     s._config['postconditions'].extend( new_list )
 
   def set_preconditions( s, new_list ):
-    s._config['preconditions'] = new_list
+    s._set( 'preconditions', new_list )
 
   def set_postconditions( s, new_list ):
-    s._config['postconditions'] = new_list
+    s._set( 'postconditions', new_list )
 
   def get_preconditions( s ):
+    s._own( 'preconditions' )
     return s._config['preconditions']
 
   def get_postconditions( s ):
+    s._own( 'postconditions' )
     return s._config['postconditions']
 
   #-----------------------------------------------------------------------
@@ -255,12 +304,13 @@ class Step:
   #-----------------------------------------------------------------------
 
   def set_name( s, name ):
-    s._config['name'] = name
+    s._set( 'name', name )
 
   def get_name( s ):
     return s._config['name']
 
   def set_param( s, param, value ):
+    s._own( 'parameters' )
     try:
       step_params = s._config['parameters']
     except KeyError:
@@ -275,6 +325,7 @@ class Step:
           ( param, s.get_name(), step_params.keys() ) )
 
   def get_param( s, param ):
+    s._own( 'parameters' )
     assert 'parameters' in s._config.keys(), \
       'get_param -- ' \
       'No parameter "%s" in step "%s"' % ( param, s.get_name() )
@@ -297,6 +348,8 @@ class Step:
       'update_param -- ' \
       'Expecting argument of type dictionary to update parameters'
 
+    s._own( 'parameters' )
+
     # Update all parameters and add new parameters
 
     if allow_new:
@@ -317,6 +370,7 @@ class Step:
         pass
 
   def params( s ):
+    s._own( 'parameters' )
     if 'parameters' not in s._config.keys():
       return {}
     return s._config['parameters']
@@ -327,6 +381,10 @@ class Step:
 
   def expand_params( s ):
 
+    s._own( 'outputs'  )
+    s._own( 'commands' )
+    s._own( 'debug'    )
+
     # Expand outputs
 
     if 'outputs' in s._config.keys():
@@ -364,6 +422,14 @@ class Step:
       for idx, c in enumerate( s._config['debug'] ):
         s._config['debug'][idx] = c.format( **s.params() )
 
+    # Expand resources (e.g., "cpus: '{nthreads}'")
+
+    if 'resources' in s._config.keys():
+      s._own( 'resources' )
+      for k, v in s._config['resources'].items():
+        if type(v) == str:
+          s._config['resources'][k] = v.format( **s.params() )
+
   #-----------------------------------------------------------------------
   # Metadata
   #-----------------------------------------------------------------------
@@ -374,6 +440,7 @@ class Step:
   # input dictionary.
 
   def update_metadata( s, data ):
+    s._shared.difference_update( data.keys() )
     s._config.update( data )
 
   #-----------------------------------------------------------------------
@@ -386,6 +453,10 @@ class Step:
 
   def escape_dollars( s ):
 
+    s._own( 'outputs'  )
+    s._own( 'commands' )
+    s._own( 'debug'    )
+
     # Escape outputs
 
     if 'outputs' in s._config.keys():
@@ -423,6 +494,7 @@ class Step:
   def all_inputs( s ):
     if 'inputs' not in s._config.keys():
       return []
+    s._own( 'inputs' )
     return s._config['inputs']
 
   # all_outputs -- normal version
@@ -537,16 +609,32 @@ class Step:
   def get_dir( s ):
     return s.step_dir
 
+  def get_source( s ):
+    try:
+      return s._config['source']
+    except KeyError:
+      return ''
+
   def get_commands( s ):
+    s._own( 'commands' )
     return s._config['commands']
 
   def get_debug_commands( s ):
     if 'debug' in s._config.keys():
+      s._own( 'debug' )
       return s._config['debug']
     else:
       return []
 
   def dump_yaml( s, build_dir ):
+    write_if_changed( build_dir + '/configure.yml', s.render_yaml() )
+
+  # render_yaml
+  #
+  # Returns the configuration data as YAML text
+  #
+
+  def render_yaml( s ):
 
     # Enable dumping multiline strings as block literals
     #
@@ -570,20 +658,46 @@ class Step:
       if len( data.splitlines() ) > 1:
         tmp.update( { 'style' : '|' } )
       return dumper.represent_scalar( **tmp )
-    yaml.add_representer( str, str_representer )
+    yaml.add_representer( str, str_representer, Dumper=YamlDumper )
 
     # Dump the content
 
-    write_yaml(
-      data = s._config,
-      path = build_dir + '/configure.yml',
-    )
+    return yaml.dump( s._config, default_flow_style=False,
+                      Dumper=YamlDumper )
 
-  # The sandbox flag will copy the source step directory if true (default)
-  # or symlink the source files into the build directory if false
+  # The sandbox mode sets how the build directory is instantiated from the
+  # source step directory:
+  #
+  # - 'copy' (or True, the default) : copy the directory
+  # - 'symlink' (or False)          : symlink the top-level source files
+  # - 'hardlink'                    : hardlink every file (falls back to
+  #                                   copying across filesystems). Files
+  #                                   are shared with the source, so
+  #                                   commands must not modify them in
+  #                                   place.
+  # - 'reflink'                     : copy-on-write clone of every file
+  #                                   where the filesystem supports it
+  #                                   (e.g., btrfs, xfs), else copy
+  # - 'symlink-farm'                : real directories with a symlink for
+  #                                   every file, so new files (and files
+  #                                   replaced by renaming over them) stay
+  #                                   in the build directory. Writing to
+  #                                   a linked file in place (e.g., with
+  #                                   ">>") modifies the source file, so
+  #                                   commands must not do that.
+  #
+  # In every mode, the configure.yml of the build directory is a private
+  # copy of the parameterized configuration.
+
+  sandbox_modes = [ 'copy', 'symlink', 'hardlink', 'reflink',
+                    'symlink-farm' ]
 
   def set_sandbox( s, val ):
-    s._config['sandbox'] = val
+    if type( val ) != bool:
+      assert val in s.sandbox_modes, \
+        'set_sandbox -- Unknown sandbox mode "{}" (expected {})'.format(
+          val, ', '.join( s.sandbox_modes ) )
+    s._set( 'sandbox', val )
 
   def get_sandbox( s ):
     try:
@@ -591,4 +705,27 @@ class Step:
     except KeyError:
       return True
 
+  def get_sandbox_mode( s ):
+    val = s.get_sandbox()
+    if type( val ) == bool:
+      return 'copy' if val else 'symlink'
+    assert val in s.sandbox_modes, \
+      'Step "{}" -- Unknown sandbox mode "{}" (expected {})'.format(
+        s.get_name(), val, ', '.join( s.sandbox_modes ) )
+    return val
+
+  # The resources the step needs while executing (cpus, mem_gb, and a
+  # dict of licenses) so that concurrent steps never oversubscribe the
+  # host. See mflowgen/core/resources.py.
+
+  def set_resources( s, cpus=None, mem_gb=None, licenses=None ):
+    resources = dict( s._config.get( 'resources' ) or {} )
+    if cpus     is not None : resources['cpus']     = cpus
+    if mem_gb   is not None : resources['mem_gb']   = mem_gb
+    if licenses is not None : resources['licenses'] = dict( licenses )
+    s._set( 'resources', resources )
+
+  def get_resources( s ):
+    return normalize_resources( s._config.get( 'resources' ) )
+
 
@@ -0,0 +1,262 @@
+#=========================================================================
+# test_graph.py
+#=========================================================================
+
+import pytest
+
+from mflowgen.components import Graph
+
+#-------------------------------------------------------------------------
+# Helpers
+#-------------------------------------------------------------------------
+
+# make_chain
+#
+# foo -> bar -> baz, with foo also feeding baz directly
+#
+
+def make_chain( make_step, parent=None ):
+  g   = Graph()
+  foo = make_step( 'foo', parent, outputs=[ 'a', 'b' ] )
+  bar = make_step( 'bar', parent, inputs=[ 'a' ], outputs=[ 'c' ],
+                                 parameters={ 'p' : 0 } )
+  baz = make_step( 'baz', parent, inputs=[ 'b', 'c' ],
+                                 parameters={ 'p' : 0 } )
+  for step in [ foo, bar, baz ]:
+    g.add_step( step )
+  g.connect_by_name( foo, bar )
+  g.connect_by_name( foo, baz )
+  g.connect_by_name( bar, baz )
+  return g
+
+# edge_set
+#
+# Sorted list of all ( src, dst ) handle pairs for comparing graphs
+#
+
+def edge_set( g ):
+  return sorted( ( e.get_src(), e.get_dst() )
+                 for step_name in g.all_steps()
+                 for e in g.get_edges_i( step_name ) )
+
+#-------------------------------------------------------------------------
+# Topological sort
+#-------------------------------------------------------------------------
+
+def test_topological_sort_levels( make_step ):
+  g = make_chain( make_step )
+  g.add_step( make_step( 'aaa' ) ) # no deps, sorts into level 0
+  assert g.topological_sort() == [ 'aaa', 'foo', 'bar', 'baz' ]
+
+def test_topological_sort_seed_steps( make_step ):
+  g = make_chain( make_step )
+  assert g.topological_sort( seed_steps={ 'bar', 'baz' } ) == \
+    [ 'bar', 'baz' ]
+  assert g.topological_sort( seed_steps=set() ) == []
+
+def test_topological_sort_cache_invalidation( make_step ):
+  g = make_chain( make_step )
+  assert g.topological_sort() == [ 'foo', 'bar', 'baz' ]
+  qux = make_step( 'qux', inputs=[ 'c' ] )
+  g.add_step( qux )
+  assert g.topological_sort() == [ 'foo', 'qux', 'bar', 'baz' ]
+  g.connect_by_name( 'bar', qux )
+  assert g.topological_sort() == [ 'foo', 'bar', 'baz', 'qux' ]
+
+def test_topological_sort_cycle( make_step ):
+  g = Graph()
+  foo = make_step( 'foo', inputs=[ 'y' ], outputs=[ 'x' ] )
+  bar = make_step( 'bar', inputs=[ 'x' ], outputs=[ 'y' ] )
+  g.add_step( foo )
+  g.add_step( bar )
+  g.connect_by_name( foo, bar )
+  g.connect_by_name( bar, foo )
+  with pytest.raises( AssertionError ):
+    g.topological_sort()
+
+#-------------------------------------------------------------------------
+# Connect
+#-------------------------------------------------------------------------
+
+def make_unconnected( make_step, parent=None ):
+  g = Graph()
+  g.add_step( make_step( 'foo', parent, outputs=[ 'a', 'b' ] ) )
+  g.add_step( make_step( 'bar', parent, inputs=[ 'a' ], outputs=[ 'c' ] ) )
+  g.add_step( make_step( 'baz', parent, inputs=[ 'b', 'c' ] ) )
+  g.add_step( make_step( 'qux', parent, inputs=[ 'c' ], outputs=[ 'c' ] ) )
+  return g
+
+def test_connect_all_by_name( make_step ):
+  g = make_unconnected( make_step )
+  assert g.connect_all_by_name() == [ ( 'baz', 'c', [ 'bar', 'qux' ] ) ]
+  assert edge_set( g ) == [ ( ( 'bar', 'c' ), ( 'qux', 'c' ) ),
+                            ( ( 'foo', 'a' ), ( 'bar', 'a' ) ),
+                            ( ( 'foo', 'b' ), ( 'baz', 'b' ) ) ]
+  # Connected inputs are skipped on later passes
+  g.connect_by_name( 'qux', 'baz' )
+  assert g.connect_all_by_name() == []
+  assert len( edge_set( g ) ) == 4
+
+def test_connect_all_by_name_overrides( tmpdir, make_step ):
+  g = make_unconnected( make_step )
+  assert g.connect_all_by_name( overrides = { 'baz' : 'qux' },
+                                exclude   = [ ( 'qux', 'c' ) ] ) == []
+  assert edge_set( g ) == [ ( ( 'foo', 'a' ), ( 'bar', 'a' ) ),
+                            ( ( 'foo', 'b' ), ( 'baz', 'b' ) ),
+                            ( ( 'qux', 'c' ), ( 'baz', 'c' ) ) ]
+  h = make_unconnected( make_step, tmpdir.mkdir( 'h' ) )
+  h.connect_all_by_name( exclude = [ 'qux' ] )
+  assert ( ( 'bar', 'c' ), ( 'baz', 'c' ) ) in edge_set( h )
+  k = make_unconnected( make_step, tmpdir.mkdir( 'k' ) )
+  with pytest.raises( AssertionError ):
+    k.connect_all_by_name( overrides = { ( 'bar', 'a' ) : 'qux' } )
+
+#-------------------------------------------------------------------------
+# Validation
+#-------------------------------------------------------------------------
+
+def test_validate( make_step ):
+  g = make_unconnected( make_step )
+  g.connect_all_by_name()
+  g.connect_by_name( 'qux', 'baz' )
+  g.connect_by_name( 'bar', 'baz' )
+  g.connect_by_name( 'qux', 'qux' )
+  g.connect( ( 'foo', 'outputs', 'x' ), ( 'bar', 'inputs', 'a' ) )
+  report = g.validate()
+  assert report['cycles'] == [ [ 'qux' ] ]
+  assert report['invalid_edges'] == [ ( ( 'foo', 'x' ), ( 'bar', 'a' ) ) ]
+  assert report['duplicate_producers'] == \
+    [ ( 'baz', 'c', [ ( 'qux', 'c' ), ( 'bar', 'c' ) ] ),
+      ( 'qux', 'c', [ ( 'bar', 'c' ), ( 'qux', 'c' ) ] ) ]
+  assert report['dangling_inputs'] == []
+  assert report['unused_outputs'] == []
+
+def test_check_cycles( make_step ):
+  g = make_chain( make_step )
+  assert g.check_cycles() is None
+  # A long chain must not hit the recursion limit
+  step = g.get_step( 'baz' )
+  for i in range( 2000 ):
+    x = step.clone()
+    x.set_name( 'x{:04d}'.format( i ) )
+    g.add_step( x )
+    if i > 0:
+      g.connect( ( 'x{:04d}'.format( i-1 ), 'outputs', 'c' ),
+                 ( x.get_name(), 'inputs', 'c' ) )
+  assert g.check_cycles() is None
+  g.connect( ( 'x1999', 'outputs', 'c' ), ( 'x0000', 'inputs', 'c' ) )
+  g.connect( ( 'baz', 'outputs', 'c' ), ( 'bar', 'inputs', 'a' ) )
+  g.connect( ( 'bar', 'outputs', 'c' ), ( 'baz', 'inputs', 'c' ) )
+  cycles = g.check_cycles()
+  assert cycles[0] == [ 'bar', 'baz' ]
+  assert len( cycles[1] ) == 2000
+
+#-------------------------------------------------------------------------
+# Graph diff
+#-------------------------------------------------------------------------
+
+def test_diff( make_step ):
+  prev = make_chain( make_step )
+  assert prev.diff( prev )['rebuild'] == []
+  g = Graph()
+  for step_name in prev.all_steps():
+    g.add_step( prev.get_step( step_name ).clone() )
+  g.connect_by_name( 'foo', 'bar' )
+  g.connect_by_name( 'foo', 'baz' )
+  g.add_step( make_step( 'qux', outputs=[ 'c' ] ) )
+  g.connect_by_name( 'qux', 'baz' )
+  g.get_step( 'bar' ).set_param( 'p', 1 )
+  report = g.diff( prev )
+  assert report['added']           == [ 'qux' ]
+  assert report['removed']         == []
+  assert report['reparameterized'] == [ 'bar' ]
+  assert report['modified']        == []
+  assert report['rewired']         == [ 'baz' ]
+  assert report['rebuild']         == [ 'bar', 'qux', 'baz' ]
+  assert prev.diff( g )['removed'] == [ 'qux' ]
+
+#-------------------------------------------------------------------------
+# Parameter space
+#-------------------------------------------------------------------------
+
+def test_param_space( make_step ):
+  g = make_chain( make_step )
+  g.param_space( 'bar', 'p', [ 1, 2 ] )
+  assert g.topological_sort() == \
+    [ 'foo', 'bar-p-1', 'bar-p-2', 'baz-p-1', 'baz-p-2' ]
+  assert g.get_step( 'baz-p-2' ).get_param( 'p' ) == 2
+  srcs = sorted( e.get_src() for e in g.get_edges_i( 'baz-p-2' ) )
+  assert srcs == [ ( 'bar-p-2', 'c' ), ( 'foo', 'b' ) ]
+
+def test_param_grid_matches_param_space( tmpdir, make_step ):
+  g1 = make_chain( make_step, tmpdir.mkdir( 'g1' ) )
+  g1.get_step( 'bar' ).update_params( { 'q' : 0 }, allow_new=True )
+  for bar in g1.param_space( 'bar', 'p', [ 1, 2 ] ):
+    g1.param_space( bar, 'q', [ 'x', 'y' ] )
+  g2 = make_chain( make_step, tmpdir.mkdir( 'g2' ) )
+  g2.get_step( 'bar' ).update_params( { 'q' : 0 }, allow_new=True )
+  new_steps = g2.param_grid( 'bar', { 'p' : [ 1, 2 ], 'q' : [ 'x', 'y' ] } )
+  assert [ x.get_name() for x in new_steps ] == \
+    [ 'bar-p-1-q-x', 'bar-p-1-q-y', 'bar-p-2-q-x', 'bar-p-2-q-y' ]
+  assert g1.topological_sort() == g2.topological_sort()
+  assert edge_set( g1 ) == edge_set( g2 )
+  assert g2.get_step( 'baz-p-2-q-y' ).params() == { 'p' : 2 }
+  assert g2.get_step( 'bar-p-2-q-y' ).params() == { 'p' : 2, 'q' : 'y' }
+
+def test_param_zip( make_step ):
+  g = make_chain( make_step )
+  g.get_step( 'bar' ).update_params( { 'q' : 0 }, allow_new=True )
+  new_steps = g.param_zip( 'bar', { 'p' : [ 1, 2 ], 'q' : [ 'x', 'y' ] } )
+  assert [ x.get_name() for x in new_steps ] == [ 'bar-p-1-q-x',
+                                                  'bar-p-2-q-y' ]
+  with pytest.raises( AssertionError ):
+    g.param_zip( 'foo', { 'p' : [ 1, 2 ], 'q' : [ 'x' ] } )
+
+def test_param_empty( make_step ):
+  g = make_chain( make_step )
+  # Empty parameter spaces and empty sweeps leave the graph as it was
+  for sweep in [ lambda: g.param_space( 'bar', 'p', [] ),
+                 lambda: g.param_grid( 'bar', { 'p' : [] } ),
+                 lambda: g.param_zip( 'bar', { 'p' : [], 'q' : [] } ),
+                 lambda: g.param_sample( 'bar', { 'p' : [ 1 ] }, n=0 ),
+                 lambda: g.param_grid( 'bar', {} ),
+                 lambda: g.param_zip( 'bar', {} ) ]:
+    with pytest.raises( AssertionError, match='"bar"' ):
+      sweep()
+    assert g.topological_sort() == [ 'foo', 'bar', 'baz' ]
+
+def test_param_sample( make_step ):
+  g = make_chain( make_step )
+  g.get_step( 'bar' ).update_params( { 'q' : 0 }, allow_new=True )
+  params    = { 'p' : [ 1, 2, 3 ], 'q' : [ 'x', 'y', 'z' ] }
+  new_steps = g.param_sample( 'bar', params, n=4, seed=0 )
+  names     = [ x.get_name() for x in new_steps ]
+  grid      = [ 'bar-p-{}-q-{}'.format( p, q ) for p in params['p']
+                                               for q in params['q'] ]
+  assert len( set( names ) ) == 4
+  assert names == [ x for x in grid if x in names ] # grid order
+  assert len( g.all_steps() ) == 1 + 4 + 4
+
+#-------------------------------------------------------------------------
+# Clone
+#-------------------------------------------------------------------------
+
+def test_clone_copy_on_write( make_step ):
+  foo = make_step( 'foo', inputs=[ 'a' ],
+                          parameters={ 'order' : [ 'x.tcl' ] } )
+  foo.extend_postconditions( [ 'assert True' ] )
+  bar = foo.clone()
+  bar.set_name( 'bar' )
+  bar.extend_inputs( [ 'b' ] )
+  bar.get_param( 'order' ).append( 'y.tcl' )
+  bar.get_postconditions().append( 'assert 1' )
+  foo.extend_commands( [ 'echo foo' ] )
+  assert foo.get_name() == 'foo'
+  assert foo.all_inputs() == [ 'a' ]
+  assert foo.get_param( 'order' ) == [ 'x.tcl' ]
+  assert foo.get_postconditions() == [ 'assert True' ]
+  assert bar.all_inputs() == [ 'a', 'b' ]
+  assert bar.get_param( 'order' ) == [ 'x.tcl', 'y.tcl' ]
+  assert bar.get_postconditions() == [ 'assert True', 'assert 1' ]
+  assert bar.get_commands() == [ 'true' ]
+  assert foo.get_commands() == [ 'true', 'echo foo' ]
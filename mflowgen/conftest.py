@@ -0,0 +1,55 @@
+#=========================================================================
+# conftest.py
+#=========================================================================
+# Shared pytest fixtures for the tests next to each module
+#
+
+import os
+import sys
+
+import pytest
+
+from mflowgen.components import Step
+from mflowgen.utils      import write_yaml
+
+# make_step
+#
+# Returns a function that writes a configure.yml with the given name and
+# fields (leaving out empty ones) into a new directory and returns the
+# Step constructed from it. The directory is made in the tmpdir of the
+# test unless another parent directory is given.
+#
+
+@pytest.fixture
+def make_step( tmpdir ):
+  def make( name, parent=None, **config ):
+    d    = ( parent or tmpdir ).mkdir( name )
+    data = { 'name' : name }
+    data.update( ( k, v ) for k, v in config.items() if v )
+    write_yaml( data = data, path = str( d ) + '/configure.yml' )
+    return Step( str( d ) )
+  return make
+
+# build_env
+#
+# Sets up the environment for tests that run generated build scripts,
+# which use "mflowgen-python" from the PATH and the mflowgen package in
+# this tree. The step result cache is disabled, and the test starts in
+# its tmpdir (the working directory is restored afterwards, even if the
+# test changes it). Returns the directory of the "mflowgen-python" shim.
+#
+
+@pytest.fixture
+def build_env( tmpdir, monkeypatch ):
+  bin_dir = tmpdir.mkdir( 'bin' )
+  shim    = str( bin_dir ) + '/mflowgen-python'
+  with open( shim, 'w' ) as fd:
+    fd.write( '#! /bin/sh\nexec {} "$@"\n'.format( sys.executable ) )
+  os.chmod( shim, 0o755 )
+  top = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+  monkeypatch.setenv( 'PATH', str( bin_dir ) + ':' + os.environ['PATH'] )
+  monkeypatch.setenv( 'PYTHONPATH', top )
+  monkeypatch.setenv( 'MFLOWGEN_HOME', top )
+  monkeypatch.delenv( 'MFLOWGEN_CACHE', raising=False )
+  monkeypatch.chdir( tmpdir )
+  return bin_dir
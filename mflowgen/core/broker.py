@@ -0,0 +1,311 @@
+#=========================================================================
+# broker.py
+#=========================================================================
+# License token broker shared by all builds on a host
+#
+# Resource limits (see resources.py) only apply within one build. When
+# many builds run on the same host against a fixed number of licenses,
+# a broker daemon hands out license tokens across all of them:
+#
+#   % mflowgen-broker serve dc=4 innovus=2 pt=1
+#
+# Steps that declare licenses in their resources hold tokens from the
+# broker (if it is running) while their commands run. The generated
+# mflowgen-run script starts a "mflowgen-broker hold" client that waits
+# until the tokens are granted and then keeps its connection open until
+# the script exits. The broker releases the tokens when the connection
+# closes, so tokens are never leaked by steps that fail or are killed.
+#
+# Scheduling:
+#
+# - Higher priority requests are granted first (clients take the
+#   priority from MFLOWGEN_BROKER_PRIORITY, default 0)
+# - Among equal priorities, requests from the build that currently holds
+#   the fewest tokens go first (so that one build cannot take every
+#   token), and then requests are granted in arrival order
+# - A request that does not fit reserves its tool classes, so requests
+#   behind it cannot starve it by taking tokens as they are released
+#
+# Tool classes without a declared total are not limited.
+#
+# The protocol is one JSON line per request on a Unix socket:
+#
+#   { 'op': 'acquire', 'need': { 'dc': 1 }, 'owner': <step dir>,
+#     'priority': 0 }             -> { 'granted': true } once granted
+#   { 'op': 'status' }            -> see Broker.status
+#
+
+import itertools
+import json
+import os
+import socket
+import socketserver
+import threading
+import time
+
+#-------------------------------------------------------------------------
+# Settings
+#-------------------------------------------------------------------------
+
+# get_socket_path
+#
+# Path of the broker socket (MFLOWGEN_BROKER or a per-user default). All
+# builds that should share tokens must use the same path.
+#
+
+def get_socket_path():
+  return os.environ.get( 'MFLOWGEN_BROKER' ) or \
+           '/tmp/mflowgen-broker-{}.sock'.format( os.getuid() )
+
+def get_priority():
+  return int( os.environ.get( 'MFLOWGEN_BROKER_PRIORITY', 0 ) )
+
+#-------------------------------------------------------------------------
+# Broker
+#-------------------------------------------------------------------------
+
+class Broker:
+
+  def __init__( s, tokens ):
+    s.tokens  = dict( tokens )
+    s.cond    = threading.Condition()
+    s.seq     = itertools.count()
+    s.waiting = []
+    s.holding = []
+
+  # request
+  #
+  # Queues a request for the tokens in the need dict and grants what it
+  # can. Returns the request, which has "granted" set once granted.
+  #
+
+  def request( s, need, owner, priority=0 ):
+
+    need = { k: min( v, s.tokens[k] ) if k in s.tokens else v
+             for k, v in need.items() if v > 0 }
+
+    req = {
+      'need'     : need,
+      'owner'    : owner,
+      'group'    : os.path.dirname( owner.rstrip( '/' ) ),
+      'priority' : priority,
+      'seq'      : next( s.seq ),
+      'time'     : time.time(),
+      'granted'  : False,
+    }
+
+    with s.cond:
+      s.waiting.append( req )
+      s.schedule()
+
+    return req
+
+  # wait
+  #
+  # Blocks until the request is granted
+  #
+
+  def wait( s, req ):
+    with s.cond:
+      s.cond.wait_for( lambda: req['granted'] )
+
+  # release
+  #
+  # Returns the tokens of the request (or cancels it if still waiting)
+  #
+
+  def release( s, req ):
+    with s.cond:
+      if req in s.holding:
+        s.holding.remove( req )
+      if req in s.waiting:
+        s.waiting.remove( req )
+      s.schedule()
+
+  # used
+
+  def used( s, cls ):
+    return sum( r['need'].get( cls, 0 ) for r in s.holding )
+
+  # held_by_group
+  #
+  # Returns the number of tokens that the build of the owner holds
+
+  def held_by_group( s, group ):
+    return sum( sum( r['need'].values() ) for r in s.holding
+                if r['group'] == group )
+
+  # fits
+
+  def fits( s, need ):
+    return all( s.used( k ) + v <= s.tokens[k]
+                for k, v in need.items() if k in s.tokens )
+
+  # schedule
+  #
+  # Grants waiting requests one at a time in order of priority, share,
+  # and arrival (the shares change with every grant). Must be called with
+  # the condition held.
+  #
+
+  def schedule( s ):
+
+    granted = True
+
+    while granted:
+
+      granted  = False
+      reserved = set()
+
+      order = sorted( s.waiting, key=lambda r: ( -r['priority'],
+                      s.held_by_group( r['group'] ), r['seq'] ) )
+
+      for req in order:
+        classes = set( req['need'] )
+        if classes & reserved:
+          continue
+        if s.fits( req['need'] ):
+          s.waiting.remove( req )
+          s.holding.append( req )
+          req['granted'] = True
+          req['time']    = time.time()
+          granted        = True
+          break
+        reserved |= classes
+
+    s.cond.notify_all()
+
+  # status
+  #
+  # Returns a dict with the totals, tokens in use, and the holding and
+  # waiting requests (e.g., for mflowgen-status)
+  #
+
+  def status( s ):
+
+    def public( r ):
+      return { k: r[k] for k in [ 'need', 'owner', 'priority', 'time' ] }
+
+    with s.cond:
+      classes = sorted( set( s.tokens ) |
+                        { k for r in s.holding + s.waiting
+                            for k in r['need'] } )
+      return {
+        'tokens'  : { k: s.tokens.get( k ) for k in classes },
+        'used'    : { k: s.used( k ) for k in classes },
+        'holding' : [ public( r ) for r in s.holding ],
+        'waiting' : [ public( r ) for r in sorted( s.waiting,
+                                          key=lambda r: r['seq'] ) ],
+      }
+
+#-------------------------------------------------------------------------
+# Server
+#-------------------------------------------------------------------------
+
+class BrokerHandler( socketserver.StreamRequestHandler ):
+
+  def handle( s ):
+
+    broker = s.server.broker
+
+    try:
+      msg = json.loads( s.rfile.readline() )
+    except ValueError:
+      return
+
+    if msg.get( 'op' ) == 'status':
+      s.reply( broker.status() )
+
+    elif msg.get( 'op' ) == 'acquire':
+      req = broker.request( msg.get( 'need', {} ), msg.get( 'owner', '' ),
+                            msg.get( 'priority', 0 ) )
+      try:
+        broker.wait( req )
+        s.reply( { 'granted': True } )
+        # Hold until the client closes the connection
+        while s.rfile.readline():
+          pass
+      except OSError:
+        pass
+      finally:
+        broker.release( req )
+
+  def reply( s, data ):
+    s.wfile.write( ( json.dumps( data ) + '\n' ).encode() )
+    s.wfile.flush()
+
+class BrokerServer( socketserver.ThreadingMixIn,
+                    socketserver.UnixStreamServer ):
+  daemon_threads = True
+
+# serve
+#
+# Runs the broker on the socket until interrupted
+#
+
+def serve( tokens, path=None ):
+
+  path = path or get_socket_path()
+
+  # Remove a stale socket, but never steal the socket of a live broker
+
+  if os.path.exists( path ):
+    assert connect( path ) is None, \
+      'A broker is already running on ' + path
+    os.remove( path )
+
+  server = BrokerServer( path, BrokerHandler )
+  server.broker = Broker( tokens )
+
+  try:
+    server.serve_forever()
+  finally:
+    server.server_close()
+    os.remove( path )
+
+#-------------------------------------------------------------------------
+# Client
+#-------------------------------------------------------------------------
+
+# connect
+#
+# Returns a socket connected to the broker, or None if no broker runs
+#
+
+def connect( path=None ):
+  sock = socket.socket( socket.AF_UNIX, socket.SOCK_STREAM )
+  try:
+    sock.connect( path or get_socket_path() )
+  except OSError:
+    sock.close()
+    return None
+  return sock
+
+def _call( sock, data ):
+  sock.sendall( ( json.dumps( data ) + '\n' ).encode() )
+  return json.loads( sock.makefile().readline() or 'null' )
+
+# acquire
+#
+# Blocks until the broker grants the tokens and returns the connection,
+# which holds the tokens until closed. Returns None if no broker runs.
+#
+
+def acquire( need, owner, priority=0, path=None ):
+  sock = connect( path )
+  if sock:
+    reply = _call( sock, { 'op': 'acquire', 'need': need, 'owner': owner,
+                           'priority': priority } )
+    assert reply and reply.get( 'granted' ), 'Broker did not grant tokens'
+  return sock
+
+# query_status
+#
+# Returns the status of the broker, or None if no broker runs
+
+def query_status( path=None ):
+  sock = connect( path )
+  if not sock:
+    return None
+  with sock:
+    return _call( sock, { 'op': 'status' } )
@@ -7,20 +7,34 @@
 # Date   : June 11, 2019
 #
 
+import io
 import os
 import re
 import shutil
+import stat
+import yaml
 
-from mflowgen.assertions.assertion_helpers import dump_assertion_check_scripts
+from concurrent.futures import ThreadPoolExecutor
+
+from mflowgen.assertions.assertion_helpers import render_assertion_check_scripts
+from mflowgen.core.collect import manifest_name, render_manifest
+from mflowgen.core.resources import get_host_limits, limits_name
 from mflowgen.utils import get_top_dir, get_files_in_dir
+from mflowgen.utils import write_if_changed
 
 class BuildOrchestrator:
 
-  def __init__( s, graph, backend_writer_cls ):
+  def __init__( s, graph, backend_writer_cls, prev_graph=None ):
 
     s.g = graph
     s.w = backend_writer_cls()
 
+    # The graph from the previous run (if any) is diffed against this
+    # graph to find the steps that must rebuild
+
+    s.prev_graph = prev_graph
+    s.diff       = None
+
     # The 'build' method analyzes the user's step dependency graph in
     # order to populate the rules and high-level dependencies (e.g., this
     # step depends on that step) of the build system graph
@@ -40,13 +54,19 @@ class BuildOrchestrator:
 
     # Hidden metadata directory that saves parameterized YAMLs and
     # commands for each step
+    #
+    # The directory is kept across runs and only files whose content
+    # changed are rewritten (see dump_metadata)
 
     s.metadata_dir = '.mflowgen'
 
-    if os.path.exists( s.metadata_dir ):
-      shutil.rmtree( s.metadata_dir )
+    if not os.path.exists( s.metadata_dir ):
+      os.mkdir( s.metadata_dir )
 
-    os.mkdir( s.metadata_dir )
+    # Number of threads for generating metadata (None picks a default
+    # based on the number of CPUs)
+
+    s.metadata_jobs = None
 
     # Names for the generated run and debug scripts for each step
 
@@ -55,182 +75,309 @@ class BuildOrchestrator:
     s.mflowgen_precond  = 'mflowgen-check-preconditions.py'
     s.mflowgen_postcond = 'mflowgen-check-postconditions.py'
 
-  #-----------------------------------------------------------------------
-  # dump_yamls
-  #-----------------------------------------------------------------------
-  # For the parameter system, we will dump each step's (parameterized)
-  # configuration data into a hidden metadata directory.
-  #
+    # Script that fetches and stores step results in the step result cache
+    # (see mflowgen/core/cache.py)
 
-  def dump_yamls( s, step_name, build_dir ):
-    inner_dir = s.metadata_dir + '/' + build_dir
-    if not os.path.exists( inner_dir ):
-      os.mkdir( inner_dir )
-    step = s.g.get_step( step_name )
-    step.dump_yaml( inner_dir )
+    s.mflowgen_cache = get_top_dir() + '/mflowgen/scripts/mflowgen-cache'
 
-  #-----------------------------------------------------------------------
-  # dump_commands
-  #-----------------------------------------------------------------------
-  # Each step's command script goes into the hidden metadata directory.
-  # When executing a step, we just copy the commands to the build dir and
-  # run it there. This also makes it easy for the user to run the step in
-  # isolation for debug purposes.
-  #
+    # Shell test for whether the step result cache is enabled, so that
+    # builds without a cache do not start the script at all. The build
+    # commands are shared by make, ninja, and the native executor, which
+    # each treat "$" differently, so this avoids variable references.
 
-  def dump_commands( s, commands, step_name, build_dir ):
+    s.cache_enabled = 'printenv MFLOWGEN_CACHE >/dev/null'
 
-    # Directories
+    # Client of the license token broker (see mflowgen/core/broker.py)
 
-    inner_dir = s.metadata_dir + '/' + build_dir
-    if not os.path.exists( inner_dir ):
-      os.mkdir( inner_dir )
+    s.mflowgen_broker = get_top_dir() + '/mflowgen/scripts/mflowgen-broker'
 
-    # Generate the command script
+    # Recorder for the telemetry of each step (see
+    # mflowgen/core/telemetry.py)
 
-    gen = os.path.abspath( __file__ ).rstrip('c')
+    s.mflowgen_telemetry = \
+      get_top_dir() + '/mflowgen/scripts/mflowgen-telemetry'
 
-    with open( inner_dir + '/' + s.mflowgen_run, 'w' ) as fd:
+  #-----------------------------------------------------------------------
+  # render_commands
+  #-----------------------------------------------------------------------
+  # Returns the text of the command script for the step. Each step's
+  # command script goes into the hidden metadata directory (see
+  # dump_step_metadata). When executing a step, we just copy the commands
+  # to the build dir and run it there. This also makes it easy for the
+  # user to run the step in isolation for debug purposes.
+  #
 
-      # Shebang
-      #
-      # - Enforce bash since we will be exporting
-      # - Use error propagation flags so that builds will stop for errors
+  def render_commands( s, commands, step_name ):
 
-      fd.write( '#! /usr/bin/env bash\n' )
-      fd.write( 'set -euo pipefail\n' )
+    gen = os.path.abspath( __file__ ).rstrip('c')
 
-      # Header
+    fd = io.StringIO()
+
+    # Shebang
+    #
+    # - Enforce bash since we will be exporting
+    # - Use error propagation flags so that builds will stop for errors
+
+    fd.write( '#! /usr/bin/env bash\n' )
+    fd.write( 'set -euo pipefail\n' )
+
+    # Header
+
+    fd.write( '#' + '='*73 + '\n' )
+    fd.write( '# ' + s.mflowgen_run + '\n' )
+    fd.write( '#' + '='*73 + '\n' )
+    fd.write( '# Generator : ' + gen + '\n' )
+    fd.write( '\n' )
+
+    # Telemetry
+    #
+    # - Re-run this script under the telemetry recorder, which saves the
+    #   runtime, memory, I/O, and exit status of the step to a record in
+    #   the build directory (see mflowgen/core/telemetry.py)
+    #
+
+    fd.write( '# Telemetry\n' )
+    fd.write( '\n' )
+    fd.write( 'if [[ "${MFLOWGEN_TELEMETRY:-}" != "$PWD" ]]; then\n' )
+    fd.write( '  export MFLOWGEN_TELEMETRY="$PWD"\n' )
+    fd.write( '  exec ' + s.mflowgen_telemetry + ' "$0" "$@"\n' )
+    fd.write( 'fi\n' )
+    fd.write( '\n' )
+
+    # Pre
+    #
+    # - Dump all parameters into the script
+    #
+
+    params          = s.g.get_step( step_name ).params()
+    params_str      = 'export {}={}'
+    params_commands = []
+    for k, v in params.items():
+      if type(v) is list: # can't export a list in bash, so need to serialize it
+        serialized_value = ",".join(v)
+        params_commands.append( params_str.format(k,serialized_value) )
+      else:
+        params_commands.append( params_str.format(k,v) )
 
-      fd.write( '#' + '='*73 + '\n' )
-      fd.write( '# ' + s.mflowgen_run + '\n' )
-      fd.write( '#' + '='*73 + '\n' )
-      fd.write( '# Generator : ' + gen + '\n' )
-      fd.write( '\n' )
+    pre = [
+      'MFLOWGEN_STEP_HOME=$PWD',             # save build directory
+    ]
 
-      # Pre
-      #
-      # - Starting timestamp
-      # - Dump all parameters into the script
-      #
+    pre = pre + params_commands
 
-      params          = s.g.get_step( step_name ).params()
-      params_str      = 'export {}={}'
-      params_commands = []
-      for k, v in params.items():
-        if type(v) is list: # can't export a list in bash, so need to serialize it
-          serialized_value = ",".join(v)
-          params_commands.append( params_str.format(k,serialized_value) )
-        else:
-          params_commands.append( params_str.format(k,v) )
-
-      pre = [
-        'rm -f .time_end',                     # clear end timestamp
-        'date +%Y-%m%d-%H%M-%S > .time_start', # start timestamp
-        'MFLOWGEN_STEP_HOME=$PWD',             # save build directory
-      ]
-
-      pre = pre + params_commands
-
-      fd.write( '# Pre\n' )
+    fd.write( '# Pre\n' )
+    fd.write( '\n' )
+    for c in pre:
+      fd.write( c )
+      fd.write( '\n' )
+    fd.write( '\n' )
+
+    # License tokens
+    #
+    # - Hold the license tokens of the step from the broker shared by all
+    #   builds on the host (see mflowgen/core/broker.py) until the script
+    #   exits. The client returns right away if no broker is running.
+    #
+
+    licenses = s.g.get_step( step_name ).get_resources()[ 'licenses' ]
+
+    if licenses:
+      hold = s.mflowgen_broker + ' hold --owner "$PWD" ' + \
+             ' '.join( '{}={}'.format( k, v )
+                       for k, v in sorted( licenses.items() ) )
+      fd.write( '# License tokens\n' )
       fd.write( '\n' )
-      for c in pre:
-        fd.write( c )
-        fd.write( '\n' )
+      fd.write( 'coproc MFLOWGEN_TOKENS { ' + hold + '; }\n' )
+      fd.write( 'read -r -u "${MFLOWGEN_TOKENS[0]}" MFLOWGEN_TOKENS_REPLY\n' )
       fd.write( '\n' )
 
-      # Commands
+    # Commands
 
-      fd.write( '# Commands\n' )
+    fd.write( '# Commands\n' )
+    fd.write( '\n' )
+    for c in commands:
+      fd.write( c )
       fd.write( '\n' )
-      for c in commands:
-        fd.write( c )
-        fd.write( '\n' )
+    fd.write( '\n' )
+
+    # Post
+
+    post = [
+      'cd $MFLOWGEN_STEP_HOME',            # return to known location
+    ]
+
+    fd.write( '# Post\n' )
+    fd.write( '\n' )
+    for c in post:
+      fd.write( c )
       fd.write( '\n' )
+    fd.write( '\n' )
 
-      # Post
-      #
-      # - Ending timestamp
-      #
+    return fd.getvalue()
+
+  #-----------------------------------------------------------------------
+  # render_debug_commands
+  #-----------------------------------------------------------------------
+  # Returns the text of the debug command script for the step, which also
+  # goes into the hidden metadata directory. When executing debug for a
+  # step, we just copy the commands to the build dir and run it there.
+  # This also makes it easy for the user to launch debug on their own.
+  #
+
+  def render_debug_commands( s, commands, step_name ):
+
+    gen = os.path.abspath( __file__ ).rstrip('c')
+
+    fd = io.StringIO()
+
+    # Shebang
+    #
+    # - Enforce bash since we will be exporting
+    # - Use error propagation flags so the build will stop for errors
+
+    fd.write( '#! /usr/bin/env bash\n' )
+    fd.write( 'set -euo pipefail\n' )
+
+    # Header
 
-      post = [
-        'cd $MFLOWGEN_STEP_HOME',            # return to known location
-        'date +%Y-%m%d-%H%M-%S > .time_end', # end timestamp
-      ]
+    fd.write( '#' + '='*73 + '\n' )
+    fd.write( '# ' + s.mflowgen_debug + '\n' )
+    fd.write( '#' + '='*73 + '\n' )
+    fd.write( '# Generator : ' + gen + '\n' )
+    fd.write( '\n' )
 
-      fd.write( '# Post\n' )
+    # Params
+
+    params          = s.g.get_step( step_name ).params()
+    params_str      = 'export {}={}'
+    params_commands = []
+    for k, v in params.items():
+      if type(v) is list: # can't export a list in bash, so need to serialize it
+        serialized_value = ",".join(v)
+        params_commands.append( params_str.format(k,serialized_value) )
+      else:
+        params_commands.append( params_str.format(k,v) )
+
+    fd.write( '# Pre\n' )
+    fd.write( '\n' )
+    for c in params_commands:
+      fd.write( c )
       fd.write( '\n' )
-      for c in post:
-        fd.write( c )
-        fd.write( '\n' )
+    fd.write( '\n' )
+
+    # Commands
+
+    fd.write( '# Debug\n' )
+    fd.write( '\n' )
+    for c in commands:
+      fd.write( c )
       fd.write( '\n' )
+    fd.write( '\n' )
+
+    return fd.getvalue()
 
   #-----------------------------------------------------------------------
-  # dump_debug_commands
+  # dump_metadata
   #-----------------------------------------------------------------------
-  # Each step's debug command script goes into the hidden metadata
-  # directory. When executing debug for a step, we just copy the commands
-  # to the build dir and run it there. This also makes it easy for the
-  # user to launch debug on their own.
+  # Renders all per-step metadata in memory and writes only the files
+  # whose content changed, so that regenerating an unchanged graph does
+  # not touch any file. Steps are independent of each other, so they are
+  # rendered and written in a thread pool. Metadata for steps that are no
+  # longer in the graph is removed afterwards.
   #
 
-  def dump_debug_commands( s, commands, step_name, build_dir ):
+  def dump_metadata( s ):
+
+    with ThreadPoolExecutor( max_workers = s.metadata_jobs ) as pool:
+      futures = [ pool.submit( s.dump_step_metadata, step_name, build_dir )
+                  for step_name, build_dir in sorted( s.build_dirs.items() ) ]
+      for f in futures:
+        f.result() # re-raise any exception from the worker
+
+    s.prune_metadata()
+
+  # dump_step_metadata
+  #
+  # Writes the metadata files for one step and removes previously
+  # generated files that the step no longer has (e.g., a debug script
+  # after the debug commands were removed)
+  #
+  # Returns the list of file names that were written
+  #
 
-    # Directories
+  def dump_step_metadata( s, step_name, build_dir ):
 
     inner_dir = s.metadata_dir + '/' + build_dir
     if not os.path.exists( inner_dir ):
       os.mkdir( inner_dir )
 
-    # Generate the debug command script
+    step  = s.g.get_step( step_name )
+    files = {}
 
-    gen = os.path.abspath( __file__ ).rstrip('c')
+    # Parameterized YAML
 
-    with open( inner_dir + '/' + s.mflowgen_debug, 'w' ) as fd:
+    files[ 'configure.yml' ] = step.render_yaml()
 
-      # Shebang
-      #
-      # - Enforce bash since we will be exporting
-      # - Use error propagation flags so the build will stop for errors
+    # Commands and debug commands
 
-      fd.write( '#! /usr/bin/env bash\n' )
-      fd.write( 'set -euo pipefail\n' )
+    step_commands = step.get_commands()
+    if step_commands:
+      files[ s.mflowgen_run ] = \
+        s.render_commands( step_commands, step_name )
 
-      # Header
+    debug_commands = step.get_debug_commands()
+    if debug_commands:
+      files[ s.mflowgen_debug ] = \
+        s.render_debug_commands( debug_commands, step_name )
 
-      fd.write( '#' + '='*73 + '\n' )
-      fd.write( '# ' + s.mflowgen_debug + '\n' )
-      fd.write( '#' + '='*73 + '\n' )
-      fd.write( '# Generator : ' + gen + '\n' )
-      fd.write( '\n' )
+    # Assertion check scripts (from the configuration data in memory)
 
-      # Params
+    data = {}
+    for t in [ 'preconditions', 'postconditions' ]:
+      try:
+        data[ t ] = getattr( step, 'get_' + t )()
+      except KeyError:
+        pass
 
-      params          = s.g.get_step( step_name ).params()
-      params_str      = 'export {}={}'
-      params_commands = []
-      for k, v in params.items():
-        if type(v) is list: # can't export a list in bash, so need to serialize it
-          serialized_value = ",".join(v)
-          params_commands.append( params_str.format(k,serialized_value) )
-        else:
-          params_commands.append( params_str.format(k,v) )
+    files.update( render_assertion_check_scripts( step_name, data ) )
 
-      fd.write( '# Pre\n' )
-      fd.write( '\n' )
-      for c in params_commands:
-        fd.write( c )
-        fd.write( '\n' )
-      fd.write( '\n' )
+    # Write the files whose content changed
 
-      # Commands
+    written = [ f for f, text in files.items()
+                  if write_if_changed( inner_dir + '/' + f, text ) ]
 
-      fd.write( '# Debug\n' )
-      fd.write( '\n' )
-      for c in commands:
-        fd.write( c )
-        fd.write( '\n' )
-      fd.write( '\n' )
+    for f in [ s.mflowgen_precond, s.mflowgen_postcond ]:
+      if f in written:
+        path = inner_dir + '/' + f
+        os.chmod( path, os.stat( path ).st_mode | stat.S_IEXEC )
+
+    # Remove stale generated files
+
+    generated = [ 'configure.yml', s.mflowgen_run, s.mflowgen_debug,
+                  s.mflowgen_precond, s.mflowgen_postcond ]
+
+    for f in generated:
+      if f not in files and os.path.exists( inner_dir + '/' + f ):
+        os.remove( inner_dir + '/' + f )
+
+    return written
+
+  # prune_metadata
+  #
+  # Removes the metadata of build directories that are no longer in the
+  # graph
+  #
+
+  def prune_metadata( s ):
+
+    build_dirs = set( s.build_dirs.values() )
+
+    for dir_name in os.listdir( s.metadata_dir ):
+      path = s.metadata_dir + '/' + dir_name
+      if dir_name in build_dirs or not os.path.isdir( path ):
+        continue
+      if re.match( r'\d+-', dir_name ):
+        shutil.rmtree( path )
 
   #-----------------------------------------------------------------------
   # dump_graphviz
@@ -330,15 +477,121 @@ N. For a completely clean build, run the "clean-all" target.\n''' )
 
     return existing_build_ids
 
+  #-----------------------------------------------------------------------
+  # invalidate_steps
+  #-----------------------------------------------------------------------
+  # Removes the directory stamp (i.e., the target of the "directory" rule)
+  # from the existing build directories of all steps that changed in the
+  # graph diff, so both backends rebuild these steps from scratch. Steps
+  # downstream of a changed step are not invalidated here. They rebuild
+  # only if their inputs change by content (see digests.py). Pre-built
+  # steps are never invalidated.
+  #
+
+  def invalidate_steps( s ):
+
+    if not s.diff:
+      return
+
+    reasons = {}
+
+    for key in [ 'reparameterized', 'modified', 'rewired' ]:
+      for step_name in s.diff[ key ]:
+        reasons.setdefault( step_name, [] ).append( key )
+
+    invalidated = []
+
+    for step_name in s.diff['rebuild']:
+      if step_name not in reasons:
+        continue
+      build_dir = s.build_dirs[ step_name ]
+      stamp     = build_dir + '/.stamp'
+      if os.path.exists( build_dir + '/.prebuilt' ):
+        continue
+      if os.path.lexists( stamp ):
+        os.remove( stamp )
+        invalidated.append( step_name )
+
+    # Print a help message
+
+    if invalidated:
+
+      print( '''
+The following existing steps changed since the last run. Their build
+directories were invalidated so that they will rebuild. Downstream steps
+will rebuild if their inputs change.\n''' )
+
+      for step_name in invalidated:
+        reason = ', '.join( reasons[ step_name ] )
+        print( '- {: >3} : {} ({})'.format( s.build_ids[ step_name ],
+                                            s.build_dirs[ step_name ],
+                                            reason ) )
+      print()
+
+  #-----------------------------------------------------------------------
+  # collect_resources
+  #-----------------------------------------------------------------------
+  # Collects the resources each step needs while executing and the
+  # totals declared for the graph. The declared totals are saved to the
+  # metadata directory for the build system wrappers (see resources.py).
+  #
+
+  def collect_resources( s ):
+
+    s.resources = { step_name: s.g.get_step( step_name ).get_resources()
+                      for step_name in s.order }
+
+    s.resource_limits = s.g.get_resource_limits()
+
+    write_if_changed( s.metadata_dir + '/' + limits_name,
+                      yaml.dump( s.resource_limits,
+                                 default_flow_style=False ) )
+
+  #-----------------------------------------------------------------------
+  # check_graph
+  #-----------------------------------------------------------------------
+  # Runs the graph validation pass and fails with a summary of all
+  # problems that would make the graph unbuildable (see Graph.validate)
+  #
+
+  def check_graph( s ):
+
+    report = s.g.validate()
+    errors = []
+
+    for cycle in report['cycles']:
+      errors.append( 'Cycle between steps: ' + ', '.join( cycle ) )
+
+    for src, dst in report['invalid_edges']:
+      errors.append( 'Edge from "{}" output "{}" to "{}" input "{}" does '
+        'not match the steps in the graph'.format( *( src + dst ) ) )
+
+    for step_name, f, srcs in report['duplicate_producers']:
+      errors.append( 'Step "{}" input "{}" is connected to multiple '
+        'outputs: {}'.format( step_name, f,
+          ', '.join( '"{}" output "{}"'.format( *x ) for x in srcs ) ) )
+
+    assert not errors, \
+      'check_graph -- Invalid graph:\n  ' + '\n  '.join( errors )
+
+    return report
+
   #-----------------------------------------------------------------------
   # Setup
   #-----------------------------------------------------------------------
 
   def setup( s ):
 
-    # Check the validity of this graph (no cycles)
+    # Check the validity of this graph (no cycles, no invalid or ambiguous
+    # edges) before any metadata is written
 
-    #assert s.g.check_cycles() == None
+    s.check_graph()
+
+    # Diff against the graph from the previous run before expanding
+    # parameters (the previous graph is saved before expansion)
+
+    if s.prev_graph:
+      s.diff = s.g.diff( s.prev_graph )
 
     # Expand parameters in the graph
 
@@ -354,6 +607,11 @@ N. For a completely clean build, run the "clean-all" target.\n''' )
     s.build_dirs = { step_name: build_id + '-' + step_name \
                        for step_name, build_id in s.build_ids.items() }
 
+    # Invalidate existing build directories of steps that changed since
+    # the previous run
+
+    s.invalidate_steps()
+
     # Get step directories
 
     for step_name in s.order:
@@ -364,34 +622,15 @@ N. For a completely clean build, run the "clean-all" target.\n''' )
     s.g.dump_metadata_to_steps( build_dirs = s.build_dirs,
                                 build_ids  = s.build_ids  )
 
-    # Dump parameterized YAMLs for each step to the metadata directory
-
-    for step_name, build_dir in s.build_dirs.items():
-      s.dump_yamls( step_name, build_dir )
+    # Dump the metadata for each step (i.e., the parameterized YAML,
+    # commands, debug commands, and assertion check scripts) to the
+    # metadata directory
 
-    # Dump commands for each step to the metadata directory
+    s.dump_metadata()
 
-    for step_name, build_dir in s.build_dirs.items():
-      step          = s.g.get_step( step_name )
-      step_commands = step.get_commands()
-      if step_commands:
-        s.dump_commands( step_commands, step_name, build_dir )
+    # Collect the resources that each step needs and the totals
 
-    # Dump debug commands for each step to the metadata directory
-
-    for step_name, build_dir in s.build_dirs.items():
-      step           = s.g.get_step( step_name )
-      debug_commands = step.get_debug_commands()
-      if debug_commands:
-        s.dump_debug_commands( debug_commands, step_name, build_dir )
-
-    # Dump assertion check scripts for each step to the metadata directory
-
-    for step_name, build_dir in s.build_dirs.items():
-      inner_dir = s.metadata_dir + '/' + build_dir
-      if not os.path.exists( inner_dir ):
-        os.mkdir( inner_dir )
-      dump_assertion_check_scripts( step_name, inner_dir )
+    s.collect_resources()
 
     # Dump graphviz dot file to the metadata directory
 
@@ -499,6 +738,7 @@ N. For a completely clean build, run the "clean-all" target.\n''' )
     # Pass useful data to the backend writer
 
     s.w.save( s.order, s.build_dirs, s.step_dirs )
+    s.w.save_resources( get_host_limits( s.resource_limits ), s.resources )
 
     # Backend writer prologue
 
@@ -549,16 +789,17 @@ N. For a completely clean build, run the "clean-all" target.\n''' )
           pass
       deps = deps_filtered
 
-      # Check if we are going to sandbox this step or symlink it
+      # Check how we are going to instantiate the build directory (e.g.,
+      # copy or symlink)
 
-      sandbox = step.get_sandbox()
+      sandbox = step.get_sandbox_mode()
 
       # Rule
       #
       # - Remove the {dst}
       # - Copy the {src} to the {dst}
       # - This rule depends on {deps}
-      # - {sandbox} True (copies src dir), False (symlinks src contents)
+      # - {sandbox} mode (see Step.set_sandbox)
       #
 
       rule = {
@@ -602,7 +843,9 @@ N. For a completely clean build, run the "clean-all" target.\n''' )
       # collect-inputs
       #...................................................................
       # For each incoming edge, trace back and collect the input (i.e.,
-      # symlink the src step's output to this step's input).
+      # symlink the src step's output to this step's input). All inputs of
+      # the step are collected at once from a manifest in the metadata
+      # directory (see mflowgen/core/collect.py).
 
       s.w.gen_step_collect_inputs_pre()
 
@@ -610,14 +853,9 @@ N. For a completely clean build, run the "clean-all" target.\n''' )
 
       extra_deps = backend_outputs[step_name]['directory']
 
-      # Metadata for customized backends
-
-      s.build_system_rules[step_name]['collect-inputs'] = []
-
-      # Use the backend writer to generate rules for each input, and then
-      # grab any backend dependencies
+      # Inputs
 
-      backend_outputs[step_name]['collect-inputs'] = []
+      inputs = []
 
       for edge in s.g.get_edges_i( step_name ):
 
@@ -627,23 +865,44 @@ N. For a completely clean build, run the "clean-all" target.\n''' )
         link_src = s.build_dirs[ src_step_name ] + '/outputs/' + src_f
         link_dst = s.build_dirs[ dst_step_name ] + '/inputs/'  + dst_f
 
-        # Rule
-        #
-        # - Symlink the {src} to the {dst}
-        # - This rule depends on {deps}
-        #
+        inputs.append( { 'dst': link_dst, 'src': link_src } )
 
-        rule = {
-          'dst'  : link_dst,
-          'src'  : link_src,
-          'deps' : [],
-        }
+      inputs.sort( key=lambda x: x['dst'] )
+
+      manifest = s.metadata_dir + '/' + build_dir + '/' + manifest_name
+      stamp    = build_dir + '/inputs/.stamp'
+
+      if inputs:
+        write_if_changed( manifest, render_manifest( stamp, inputs ) )
+      elif os.path.exists( manifest ):
+        os.remove( manifest )
+
+      # Rule
+      #
+      # - Symlink every {inputs} dst to its src using the {manifest}
+      # - Touch the {stamp}
+      # - This rule depends on {deps}
+      #
 
+      rule = {
+        'stamp'    : stamp,
+        'manifest' : manifest,
+        'inputs'   : inputs,
+        'deps'     : [],
+      }
+
+      # Use the backend writer to generate the rule, and then grab any
+      # backend dependencies
+
+      backend_outputs[step_name]['collect-inputs'] = []
+
+      if inputs:
         t = s.w.gen_step_collect_inputs( extra_deps = extra_deps, **rule )
+        backend_outputs[step_name]['collect-inputs'] = t
 
-        backend_outputs[step_name]['collect-inputs'] += t
+      # Metadata for customized backends
 
-        s.build_system_rules[step_name]['collect-inputs'].append( rule )
+      s.build_system_rules[step_name]['collect-inputs'] = rule
 
       # Metadata for customized backends
 
@@ -703,8 +962,10 @@ N. For a completely clean build, run the "clean-all" target.\n''' )
         # Run the precondition checker if it exists
         'if [[ -e ' + s.mflowgen_precond + ' ]]; then' \
             + ' ./{x} || exit 1; fi'.format( x=s.mflowgen_precond ),
-        # Run the commands
-        './{x} 2>&1 | tee {x}.log || exit 1'.format( x=s.mflowgen_run ),
+        # Run the commands unless the step result cache has the outputs
+        '{{ {c} && {f} fetch . || '
+          './{x} 2>&1 | tee {x}.log || exit 1; }}'.format(
+            c=s.cache_enabled, f=s.mflowgen_cache, x=s.mflowgen_run ),
         # Return to top so backends can assume we never changed directory
         'cd ..',
       ])
@@ -714,13 +975,16 @@ N. For a completely clean build, run the "clean-all" target.\n''' )
       # - Run the {command}
       # - Generate the {outputs}
       # - This rule depends on {deps}
+      # - Never run together with other steps beyond the limits of the
+      #   {resources} (see resources.py)
       #
 
       rule = {
-        'outputs' : outputs,
-        'command' : commands,
-        'deps'    : [],
-        'phony'   : phony,
+        'outputs'   : outputs,
+        'command'   : commands,
+        'deps'      : [],
+        'phony'     : phony,
+        'resources' : s.resources[ step_name ],
       }
 
       # Pull in any backend dependencies
@@ -865,6 +1129,9 @@ N. For a completely clean build, run the "clean-all" target.\n''' )
         # Run the postcondition checker if it exists
         'if [[ -e ' + s.mflowgen_postcond + ' ]]; then' \
             + ' ./{x} || exit 1; fi'.format( x=s.mflowgen_postcond ),
+        # Store the outputs in the step result cache if it is enabled
+        'if ' + s.cache_enabled + '; then' \
+            + ' {} store .; fi'.format( s.mflowgen_cache ),
         # Return to top so backends can assume we never changed directory
         'cd ..',
       ])
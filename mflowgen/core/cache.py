@@ -0,0 +1,428 @@
+#=========================================================================
+# cache.py
+#=========================================================================
+# Local content-addressed cache of step results
+#
+# The cache is enabled by pointing the MFLOWGEN_CACHE environment variable
+# at a directory, which may be shared by everyone working on the same
+# machine. Each entry holds the outputs (and the log) of one execution of
+# a step and is keyed by a fingerprint of:
+#
+# - The parameterized configure.yml of the step (i.e., commands and
+#   parameters), without anything that only depends on where the step is
+#   placed in a build (e.g., build_dir and build_id)
+# - The contents of the step template directory
+# - The content digests of every collected input (see digests.py)
+# - The mflowgen version
+#
+# On a hit, the step does not execute and the cached outputs are
+# materialized into the build directory (reflinked if the filesystem
+# supports it, else hardlinked, else copied). On a miss, the step executes
+# as usual and its outputs are stored once the postconditions pass.
+#
+# The size of the cache is bounded by MFLOWGEN_CACHE_SIZE_GB (default 50)
+# and the least recently used entries are evicted first. Steps can opt
+# out with "cache: False" in their configure.yml (e.g., steps that are
+# not deterministic or that have side effects outside the build dir).
+#
+
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import stat
+import time
+
+from mflowgen.core.digests   import read_digests, input_digests, hash_path
+from mflowgen.core.telemetry import write_cached_telemetry
+from mflowgen.utils          import read_yaml
+from mflowgen.version        import __version__
+
+# Bump this if the cache layout or keys change in an incompatible way
+
+cache_format = 1
+
+# Name of the file in the build directory that records the cache key of
+# the last execution, which is needed to store the outputs later
+
+cache_state_name = '.cache.json'
+
+# Keys in the parameterized configure.yml that do not affect the results
+
+cache_ignore_keys = [ 'build_dir', 'build_id', 'source',
+                      'edges_i', 'edges_o' ]
+
+# Logs that are cached together with the outputs
+
+cache_logs = [ 'mflowgen-run.log' ]
+
+# Linux ioctl for cloning a file (i.e., a reflink)
+
+FICLONE = 0x40049409
+
+#-------------------------------------------------------------------------
+# Configuration
+#-------------------------------------------------------------------------
+
+# get_cache_dir
+#
+# Returns the cache directory, or None if the cache is disabled
+#
+
+def get_cache_dir():
+  return os.environ.get( 'MFLOWGEN_CACHE' ) or None
+
+# get_cache_size
+#
+# Returns the size limit of the cache in bytes
+#
+
+def get_cache_size():
+  return int( float( os.environ.get( 'MFLOWGEN_CACHE_SIZE_GB', 50 ) )
+                * 2**30 )
+
+#-------------------------------------------------------------------------
+# Keys
+#-------------------------------------------------------------------------
+
+# step_key
+#
+# Returns the cache key for the step in the build directory with its
+# currently collected inputs, or None if the step opted out of caching.
+# The hash cache maps real paths to [ size, mtime, digest ] and is
+# consulted and updated (see digests.hash_file).
+#
+
+def step_key( build_dir, cache ):
+
+  config = read_yaml( build_dir + '/configure.yml' )
+
+  if config.get( 'cache' ) is False:
+    return None
+
+  source = config.get( 'source', '' )
+
+  for k in cache_ignore_keys:
+    config.pop( k, None )
+
+  digests = read_digests( build_dir ) or {}
+  cache.update( digests.get( 'cache', {} ) )
+
+  h = hashlib.sha1()
+  h.update( json.dumps( [ cache_format, __version__, config ],
+                        sort_keys=True, default=str ).encode() )
+  h.update( ( hash_path( source, cache ) or '<missing>' ).encode() )
+  h.update( json.dumps( input_digests( build_dir, cache ),
+                        sort_keys=True ).encode() )
+
+  return h.hexdigest()
+
+# entry_path
+
+def entry_path( cache_dir, key ):
+  return cache_dir + '/' + key[:2] + '/' + key
+
+#-------------------------------------------------------------------------
+# Materializing files
+#-------------------------------------------------------------------------
+
+# reflink
+#
+# Clones the file if the filesystem supports it (e.g., btrfs, xfs)
+#
+
+def reflink( src, dst ):
+  with open( src, 'rb' ) as fd_src, open( dst, 'wb' ) as fd_dst:
+    fcntl.ioctl( fd_dst.fileno(), FICLONE, fd_src.fileno() )
+  shutil.copymode( src, dst )
+
+# materialize_file
+#
+# Returns the method used ('reflink', 'hardlink', or 'copy'). Only files
+# owned by the current user are hardlinked, since these links share their
+# timestamps and permissions with the cached file.
+#
+
+def materialize_file( src, dst ):
+
+  try:
+    reflink( src, dst )
+    return 'reflink'
+  except OSError:
+    if os.path.lexists( dst ):
+      os.remove( dst )
+
+  if os.stat( src ).st_uid == os.getuid():
+    try:
+      os.link( src, dst )
+      return 'hardlink'
+    except OSError:
+      pass
+
+  shutil.copy2( src, dst )
+  return 'copy'
+
+# materialize
+#
+# Materializes the file or directory tree at src into dst and returns
+# the set of methods used
+#
+
+def materialize( src, dst ):
+
+  if not os.path.isdir( src ):
+    return { materialize_file( src, dst ) }
+
+  methods = set()
+
+  os.makedirs( dst, exist_ok=True )
+  for f in sorted( os.listdir( src ) ):
+    methods |= materialize( src + '/' + f, dst + '/' + f )
+
+  return methods
+
+# remove_path
+
+def remove_path( path ):
+  if os.path.isdir( path ) and not os.path.islink( path ):
+    shutil.rmtree( path )
+  elif os.path.lexists( path ):
+    os.remove( path )
+
+# make_read_only
+#
+# Removes write permissions from all files in the tree so that nothing
+# can modify the cached files through a hardlink by accident
+#
+
+def make_read_only( path ):
+  for root, dirs, files in os.walk( path ):
+    for f in files:
+      p  = os.path.join( root, f )
+      st = os.stat( p )
+      os.chmod( p, st.st_mode & ~( stat.S_IWUSR | stat.S_IWGRP |
+                                   stat.S_IWOTH ) )
+
+#-------------------------------------------------------------------------
+# State
+#-------------------------------------------------------------------------
+
+# read_state
+
+def read_state( build_dir ):
+  try:
+    with open( build_dir + '/' + cache_state_name ) as fd:
+      return json.load( fd )
+  except ( OSError, ValueError ):
+    return {}
+
+# write_state
+
+def write_state( build_dir, data ):
+  with open( build_dir + '/' + cache_state_name, 'w' ) as fd:
+    json.dump( data, fd, indent=2, sort_keys=True )
+
+#-------------------------------------------------------------------------
+# Fetch, store, and evict
+#-------------------------------------------------------------------------
+
+# fetch
+#
+# Looks up the step in the build directory in the cache. On a hit, the
+# cached outputs are materialized and the cache key is returned. On a
+# miss, None is returned and the step should execute.
+#
+
+def fetch( build_dir ):
+
+  cache_dir = get_cache_dir()
+
+  if not cache_dir:
+    return None
+
+  prev   = read_state( build_dir )
+  hashes = prev.get( 'hashes', {} )
+  key    = step_key( build_dir, hashes )
+
+  # Outputs materialized by an earlier hit may be hardlinks into the
+  # cache, so remove them before the step writes new ones
+
+  if prev.get( 'hit' ):
+    for name in prev.get( 'outputs', [] ):
+      remove_path( build_dir + '/outputs/' + name )
+
+  write_state( build_dir, { 'key' : key, 'hit' : False,
+                            'hashes' : hashes } )
+
+  if not key:
+    return None
+
+  entry = entry_path( cache_dir, key )
+
+  try:
+    with open( entry + '/meta.json' ) as fd:
+      meta = json.load( fd )
+  except ( OSError, ValueError ):
+    return None
+
+  # Materialize the outputs and the logs
+
+  methods = set()
+
+  os.makedirs( build_dir + '/outputs', exist_ok=True )
+
+  for name in meta['outputs']:
+    dst = build_dir + '/outputs/' + name
+    remove_path( dst )
+    methods |= materialize( entry + '/outputs/' + name, dst )
+
+  for name in meta['logs']:
+    dst = build_dir + '/' + name
+    remove_path( dst )
+    shutil.copy2( entry + '/' + name, dst )
+    os.chmod( dst, os.stat( dst ).st_mode | stat.S_IWUSR )
+
+  # Telemetry for the runtimes (the step took no time to execute)
+
+  write_cached_telemetry( build_dir )
+
+  # Mark the entry as recently used
+
+  os.utime( entry + '/meta.json', None )
+
+  write_state( build_dir, { 'key'     : key,
+                            'hit'     : True,
+                            'outputs' : meta['outputs'],
+                            'methods' : sorted( methods ),
+                            'hashes'  : hashes } )
+
+  return key
+
+# store
+#
+# Stores the outputs of the step in the build directory in the cache
+# under the key recorded by the last fetch. Returns True if a new entry
+# was stored.
+#
+
+def store( build_dir ):
+
+  cache_dir = get_cache_dir()
+  state     = read_state( build_dir )
+  key       = state.get( 'key' )
+
+  if not cache_dir or not key:
+    return False
+
+  entry = entry_path( cache_dir, key )
+
+  if os.path.exists( entry ):
+    os.utime( entry + '/meta.json', None )
+    return False
+
+  outputs = sorted( x for x in os.listdir( build_dir + '/outputs' )
+                      if not x.startswith( '.' ) )
+  logs    = [ x for x in cache_logs
+                if os.path.isfile( build_dir + '/' + x ) ]
+
+  # Do not cache incomplete results (e.g., broken output symlinks)
+
+  for name in outputs:
+    if not os.path.exists( build_dir + '/outputs/' + name ):
+      return False
+
+  # Copy everything into a temporary directory first, then move it into
+  # place so that other builds never see a partial entry
+
+  tmp = '{}/tmp/{}.{}'.format( cache_dir, key, os.getpid() )
+  os.makedirs( tmp + '/outputs' )
+
+  try:
+    for name in outputs:
+      src = build_dir + '/outputs/' + name
+      if os.path.isdir( src ):
+        shutil.copytree( src, tmp + '/outputs/' + name )
+      else:
+        shutil.copy2( src, tmp + '/outputs/' + name )
+    for name in logs:
+      shutil.copy2( build_dir + '/' + name, tmp + '/' + name )
+    make_read_only( tmp )
+    size = sum( os.path.getsize( os.path.join( root, f ) )
+                  for root, dirs, files in os.walk( tmp ) for f in files )
+    with open( tmp + '/meta.json', 'w' ) as fd:
+      json.dump( { 'key'     : key,
+                   'step'    : os.path.basename(
+                                 os.path.abspath( build_dir ) ),
+                   'created' : time.time(),
+                   'size'    : size,
+                   'outputs' : outputs,
+                   'logs'    : logs }, fd, indent=2, sort_keys=True )
+    os.makedirs( os.path.dirname( entry ), exist_ok=True )
+    os.rename( tmp, entry )
+  except OSError:
+    shutil.rmtree( tmp, ignore_errors=True ) # e.g., stored concurrently
+    return False
+
+  evict( cache_dir, get_cache_size() )
+
+  return True
+
+# list_entries
+#
+# Returns a list of ( last_used, size, path ) for all entries in the cache
+# with the least recently used first
+#
+
+def list_entries( cache_dir ):
+
+  entries = []
+
+  try:
+    prefixes = os.listdir( cache_dir )
+  except OSError:
+    return entries
+
+  for prefix in prefixes:
+    if len( prefix ) != 2:
+      continue
+    for key in os.listdir( cache_dir + '/' + prefix ):
+      path = cache_dir + '/' + prefix + '/' + key
+      try:
+        with open( path + '/meta.json' ) as fd:
+          size = json.load( fd )['size']
+        last_used = os.stat( path + '/meta.json' ).st_mtime
+      except ( OSError, ValueError, KeyError ):
+        continue
+      entries.append( ( last_used, size, path ) )
+
+  return sorted( entries )
+
+# evict
+#
+# Removes the least recently used entries until the cache fits the size
+# limit. Returns the list of removed entries.
+#
+
+def evict( cache_dir, max_size ):
+
+  entries = list_entries( cache_dir )
+  total   = sum( size for _, size, _ in entries )
+  removed = []
+
+  for last_used, size, path in entries:
+    if total <= max_size:
+      break
+    # Move the entry out of the way first so that it disappears atomically
+    tmp = '{}/tmp/evict.{}.{}'.format( cache_dir, os.path.basename( path ),
+                                       os.getpid() )
+    try:
+      os.makedirs( cache_dir + '/tmp', exist_ok=True )
+      os.rename( path, tmp )
+    except OSError:
+      continue
+    shutil.rmtree( tmp, ignore_errors=True )
+    total -= size
+    removed.append( path )
+
+  return removed
@@ -0,0 +1,70 @@
+#=========================================================================
+# collect.py
+#=========================================================================
+# Batched input collection
+#
+# Each step collects its inputs (i.e., symlinks the outputs of other
+# steps into its inputs directory) with one build edge that runs
+# mflowgen-collect-inputs on a manifest generated in the metadata
+# directory:
+#
+#   {
+#     'stamp'  : '3-bar/inputs/.stamp',
+#     'inputs' : [
+#       { 'dst': '3-bar/inputs/design.v', 'src': '1-foo/outputs/design.v' },
+#       ...
+#     ]
+#   }
+#
+# All paths are relative to the build directory. This runs in a single
+# process instead of spawning a shell for every input.
+#
+
+import json
+import os
+
+# Name of the manifest in the metadata directory of each step
+
+manifest_name = 'inputs.json'
+
+# render_manifest
+#
+# Returns the text of the manifest
+#
+
+def render_manifest( stamp, inputs ):
+  return json.dumps( { 'stamp': stamp, 'inputs': inputs },
+                     indent=2, sort_keys=True ) + '\n'
+
+# collect_inputs
+#
+# Symlinks every input in the manifest (with paths relative to the
+# directory of the link) and then touches the stamp
+#
+
+def collect_inputs( manifest ):
+
+  if type( manifest ) == str:
+    with open( manifest ) as fd:
+      manifest = json.load( fd )
+
+  for x in manifest[ 'inputs' ]:
+
+    dst_dir = os.path.dirname( x['dst'] )
+    target  = os.path.relpath( x['src'], dst_dir )
+
+    os.makedirs( dst_dir, exist_ok=True )
+
+    if os.path.islink( x['dst'] ) and os.readlink( x['dst'] ) == target:
+      continue
+    if os.path.lexists( x['dst'] ):
+      os.remove( x['dst'] )
+
+    os.symlink( target, x['dst'] )
+
+  stamp = manifest[ 'stamp' ]
+
+  os.makedirs( os.path.dirname( stamp ), exist_ok=True )
+
+  with open( stamp, 'a' ):
+    os.utime( stamp, None )
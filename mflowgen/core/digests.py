@@ -0,0 +1,322 @@
+#=========================================================================
+# digests.py
+#=========================================================================
+# Content-hash staleness model for step outputs
+#
+# After a step executes, a digest manifest is saved in its build
+# directory with a content hash of every output, every input, and the
+# step's generated metadata (i.e., the parameterized configure.yml and the
+# command script). The manifest is then used in two ways:
+#
+# - Early cutoff (ninja): Outputs whose content did not change get their
+#   previous timestamps back. The execute rule is marked "restat", so
+#   ninja sees that these outputs did not change and does not rebuild the
+#   downstream steps that only depend on them.
+#
+# - Stamp compare (make): Make has no restat, so before a step copies its
+#   build directory or executes, it checks whether its inputs and metadata
+#   still have the digests that were recorded at its last execution. If
+#   so, the work is skipped and only the stamps are updated.
+#
+# Digests of inputs are looked up in the manifest of the step that
+# produced them whenever the output still has the recorded size and
+# timestamp, so large files are hashed once by the producer only. Files
+# that do need hashing are cached by real path, size, and timestamp.
+#
+
+import hashlib
+import json
+import os
+
+# Name of the digest manifest inside each build directory
+
+digest_name = '.digests.json'
+
+# Bump this if the manifest contents change in an incompatible way
+
+digest_format = 1
+
+#-------------------------------------------------------------------------
+# Hashing
+#-------------------------------------------------------------------------
+
+# stat_key
+#
+# Returns the ( size, mtime ) of the path (following symlinks), or None if
+# the path does not exist
+#
+
+def stat_key( path ):
+  try:
+    st = os.stat( path )
+  except OSError:
+    return None
+  return [ st.st_size, st.st_mtime_ns ]
+
+# hash_file
+#
+# Returns the hex digest of the file contents. The cache maps real paths
+# to [ size, mtime, digest ] and is consulted and updated.
+#
+
+def hash_file( path, cache ):
+
+  real = os.path.realpath( path )
+  key  = stat_key( real )
+
+  try:
+    size, mtime, digest = cache[ real ]
+    if [ size, mtime ] == key:
+      return digest
+  except KeyError:
+    pass
+
+  h = hashlib.sha1()
+  with open( real, 'rb' ) as fd:
+    for chunk in iter( lambda: fd.read( 1 << 20 ), b'' ):
+      h.update( chunk )
+
+  digest = h.hexdigest()
+  cache[ real ] = key + [ digest ]
+
+  return digest
+
+# hash_path
+#
+# Returns the hex digest of a file or of a directory tree (i.e., over the
+# relative paths and contents of all files inside), or None if the path
+# does not exist
+#
+
+def hash_path( path, cache ):
+
+  if not os.path.exists( path ):
+    return None
+
+  if not os.path.isdir( path ):
+    return hash_file( path, cache )
+
+  h = hashlib.sha1()
+
+  for root, dirs, files in os.walk( path, followlinks=True ):
+    dirs.sort()
+    for f in sorted( files ):
+      p = os.path.join( root, f )
+      h.update( os.path.relpath( p, path ).encode() + b'\0' )
+      if os.path.exists( p ):
+        h.update( hash_file( p, cache ).encode() )
+
+  return h.hexdigest()
+
+#-------------------------------------------------------------------------
+# Manifests
+#-------------------------------------------------------------------------
+
+# read_digests
+#
+# Returns the digest manifest in the build directory, or None if there is
+# no readable manifest
+#
+
+def read_digests( build_dir ):
+  try:
+    with open( build_dir + '/' + digest_name ) as fd:
+      data = json.load( fd )
+  except ( OSError, ValueError ):
+    return None
+  if type( data ) != dict or data.get( 'format' ) != digest_format:
+    return None
+  return data
+
+# write_digests
+
+def write_digests( build_dir, data ):
+  path     = build_dir + '/' + digest_name
+  path_tmp = path + '.tmp'
+  with open( path_tmp, 'w' ) as fd:
+    json.dump( data, fd, indent=2, sort_keys=True )
+  os.replace( path_tmp, path )
+
+# list_ports
+#
+# Returns the names in the inputs/ or outputs/ directory of the build
+# directory, skipping hidden files (i.e., the build system stamps)
+#
+
+def list_ports( build_dir, direction ):
+  try:
+    names = os.listdir( build_dir + '/' + direction )
+  except OSError:
+    return []
+  return sorted( x for x in names if not x.startswith( '.' ) )
+
+# metadata_digest
+#
+# Returns the digest of the generated metadata for the build directory
+# (i.e., anything in the metadata directory that affects how the step
+# runs, such as parameters and commands)
+#
+
+def metadata_digest( build_dir, metadata_dir='.mflowgen' ):
+  h = hashlib.sha1()
+  d = metadata_dir + '/' + os.path.basename( os.path.normpath( build_dir ) )
+  for f in [ 'configure.yml', 'mflowgen-run' ]:
+    try:
+      with open( d + '/' + f, 'rb' ) as fd:
+        h.update( hashlib.sha1( fd.read() ).digest() )
+    except OSError:
+      h.update( b'<missing>' )
+  return h.hexdigest()
+
+# input_digests
+#
+# Returns a dict of input names to digests for the build directory. Each
+# input is a symlink to an output of another step, so the digest comes
+# from the manifest of that step if the output has not been touched
+# since. Otherwise the input is hashed.
+#
+
+def input_digests( build_dir, cache ):
+
+  digests   = {}
+  manifests = {}
+
+  for name in list_ports( build_dir, 'inputs' ):
+
+    path   = build_dir + '/inputs/' + name
+    digest = None
+
+    # Find the producer's manifest
+
+    try:
+      target = os.path.join( build_dir + '/inputs', os.readlink( path ) )
+      target = os.path.normpath( target )
+    except OSError:
+      target = None
+
+    if target and os.path.basename( os.path.dirname( target ) ) == 'outputs':
+      src_dir = os.path.dirname( os.path.dirname( target ) )
+      if src_dir not in manifests:
+        manifests[ src_dir ] = read_digests( src_dir ) or {}
+      entry = manifests[ src_dir ].get( 'outputs', {} ).get(
+                os.path.basename( target ) )
+      if entry and entry['stat'] == stat_key( target ):
+        digest = entry['digest']
+
+    if digest is None:
+      digest = hash_path( path, cache )
+
+    digests[ name ] = digest
+
+  return digests
+
+#-------------------------------------------------------------------------
+# Save and check
+#-------------------------------------------------------------------------
+
+# save_digests
+#
+# Saves the digest manifest after the step in the build directory has
+# executed. Outputs whose digest did not change since the previous
+# manifest get their previous timestamp back, and all other outputs are
+# touched (i.e., they are newer than anything that existed before).
+#
+# Returns the list of output names whose content changed
+#
+
+def save_digests( build_dir ):
+
+  prev  = read_digests( build_dir ) or {}
+  cache = prev.get( 'cache', {} )
+
+  prev_outputs = prev.get( 'outputs', {} )
+
+  outputs = {}
+  changed = []
+
+  for name in list_ports( build_dir, 'outputs' ):
+
+    path   = build_dir + '/outputs/' + name
+    digest = hash_path( path, cache )
+
+    if digest is None: # e.g., a broken symlink
+      continue
+
+    entry = prev_outputs.get( name )
+
+    if entry and entry['digest'] == digest:
+      st = os.stat( path )
+      os.utime( path, ns=( st.st_atime_ns, entry['stat'][1] ) )
+    else:
+      os.utime( path, None )
+      changed.append( name )
+
+    outputs[ name ] = { 'digest' : digest, 'stat' : stat_key( path ) }
+
+    if not os.path.isdir( path ):
+      cache[ os.path.realpath( path ) ] = outputs[ name ]['stat'] + [ digest ]
+
+  # Keep the cache small by only keeping entries for files that exist
+
+  cache = { k: v for k, v in cache.items() if os.path.exists( k ) }
+
+  write_digests( build_dir, {
+    'format'   : digest_format,
+    'complete' : True,
+    'metadata' : metadata_digest( build_dir ),
+    'inputs'   : input_digests( build_dir, cache ),
+    'outputs'  : outputs,
+    'cache'    : cache,
+  } )
+
+  return changed
+
+# invalidate_digests
+#
+# Marks the manifest as incomplete before the step executes again, so that
+# a failed or interrupted execution is never considered up to date. The
+# previous digests are kept for the next save.
+#
+
+def invalidate_digests( build_dir ):
+  data = read_digests( build_dir )
+  if data and data.get( 'complete' ):
+    data['complete'] = False
+    write_digests( build_dir, data )
+
+# check_digests
+#
+# Returns True if the step in the build directory is up to date by
+# content, meaning that it has executed successfully before, its metadata
+# and inputs have the same digests as at that time, and all of its
+# outputs still exist
+#
+
+def check_digests( build_dir ):
+  return stale_reason( build_dir ) is None
+
+# stale_reason
+#
+# Returns why the step in the build directory is not up to date by
+# content (see check_digests), or None if it is
+#
+
+def stale_reason( build_dir ):
+
+  data = read_digests( build_dir )
+
+  if not data or not data.get( 'complete' ):
+    return 'never executed successfully'
+
+  if data['metadata'] != metadata_digest( build_dir ):
+    return 'parameters or commands changed'
+
+  for name in data['outputs']:
+    if not os.path.exists( build_dir + '/outputs/' + name ):
+      return 'outputs missing'
+
+  if input_digests( build_dir, data.get( 'cache', {} ) ) != \
+      data['inputs']:
+    return 'inputs changed'
+
+  return None
@@ -0,0 +1,284 @@
+#=========================================================================
+# history.py
+#=========================================================================
+# Runtime history of every step execution
+#
+# When a step finishes, its telemetry record (see telemetry.py) is added
+# to a local SQLite database together with the name of the design, the
+# name of the step, and a fingerprint of its parameters. Unlike the build
+# directories, the history survives "make clean-all", since it is kept in
+# the hidden metadata directory of the build (.mflowgen/history.db). It
+# can also be shared across builds by pointing the MFLOWGEN_HISTORY
+# environment variable at a database file (or set it to "off" to stop
+# recording).
+#
+# The history is used to:
+#
+# - Estimate the runtime of a step from the median of its last runs with
+#   the same parameters (or with any parameters, if there are none)
+# - Estimate the time left for the build in "make status"
+# - Flag steps that ran more than MFLOWGEN_HISTORY_SLOWDOWN percent
+#   (default 50) slower than their estimate
+#
+
+import hashlib
+import json
+import os
+import sqlite3
+
+from mflowgen.utils import read_yaml
+
+# Bump this if the schema changes in an incompatible way
+
+history_format = 1
+
+# Number of recent runs that the estimates are based on
+
+history_window = 10
+
+# Estimates from fewer runs than this are not used to flag regressions
+
+regression_min_runs = 3
+
+# Steps that take less than this many seconds longer than their estimate
+# are never flagged (i.e., short steps vary a lot relative to runtime)
+
+regression_min_seconds = 10
+
+history_schema = '''
+  CREATE TABLE IF NOT EXISTS runs (
+    id          INTEGER PRIMARY KEY,
+    design      TEXT,
+    step        TEXT,
+    fingerprint TEXT,
+    build_dir   TEXT,
+    host        TEXT,
+    start       REAL,
+    wall        REAL,
+    user        REAL,
+    sys         REAL,
+    max_rss     INTEGER,
+    read_bytes  INTEGER,
+    write_bytes INTEGER,
+    status      TEXT,
+    returncode  INTEGER
+  );
+  CREATE INDEX IF NOT EXISTS runs_step ON runs ( design, step, start );
+'''
+
+#-------------------------------------------------------------------------
+# Configuration
+#-------------------------------------------------------------------------
+
+# get_history_path
+#
+# Returns the database for the build in the given directory, or None if
+# the history is off or the directory is not a build
+#
+
+def get_history_path( build_root ):
+
+  path = os.environ.get( 'MFLOWGEN_HISTORY' )
+
+  if path == 'off':
+    return None
+  if path:
+    return path
+
+  metadata_dir = build_root + '/.mflowgen'
+
+  if not os.path.isdir( metadata_dir ):
+    return None
+
+  return metadata_dir + '/history.db'
+
+# get_slowdown
+#
+# Returns the fraction by which a step may run slower than its estimate
+# before it is flagged
+#
+
+def get_slowdown():
+  return float( os.environ.get( 'MFLOWGEN_HISTORY_SLOWDOWN', 50 ) ) / 100
+
+#-------------------------------------------------------------------------
+# Database
+#-------------------------------------------------------------------------
+
+# connect
+#
+# Opens the database and creates the schema if needed. Steps that finish
+# at the same time wait for each other's writes.
+#
+
+def connect( path ):
+
+  conn = sqlite3.connect( path, timeout=60 )
+
+  version = conn.execute( 'PRAGMA user_version' ).fetchone()[0]
+
+  if version == 0:
+    conn.executescript( history_schema )
+    conn.execute( 'PRAGMA user_version = {}'.format( history_format ) )
+    conn.commit()
+  else:
+    assert version == history_format, \
+      'Runtime history "{}" has unknown format {}'.format( path, version )
+
+  return conn
+
+# step_identity
+#
+# Returns the ( design, step, fingerprint ) of a step from its
+# configure.yml in a build. The design is named after the directory of
+# the construct script, and the fingerprint is a hash of the parameters
+# of the step.
+#
+
+def step_identity( config_path, build_root ):
+
+  config = read_yaml( config_path )
+
+  try:
+    construct = read_yaml( build_root + '/.mflowgen.yml' )['construct']
+    design    = os.path.basename( os.path.dirname( os.path.abspath(
+                  os.path.join( build_root, construct ) ) ) )
+  except Exception:
+    design    = os.path.basename( os.path.abspath( build_root ) )
+
+  params      = json.dumps( config.get( 'parameters' ) or {},
+                            sort_keys=True, default=str )
+  fingerprint = hashlib.sha1( params.encode() ).hexdigest()[:16]
+
+  return ( design, config['name'], fingerprint )
+
+# estimate
+#
+# Returns ( seconds, runs ) with the median runtime of the last successful
+# runs of the step, or None if the step never ran
+#
+
+def estimate( conn, identity ):
+
+  design, step, fingerprint = identity
+
+  query = 'SELECT wall FROM runs WHERE design = ? AND step = ? ' \
+          'AND status = ? {} ORDER BY start DESC LIMIT ?'
+
+  walls = [ x[0] for x in conn.execute(
+    query.format( 'AND fingerprint = ?' ),
+    ( design, step, 'done', fingerprint, history_window ) ) ]
+
+  if not walls:
+    walls = [ x[0] for x in conn.execute(
+      query.format( '' ), ( design, step, 'done', history_window ) ) ]
+
+  if not walls:
+    return None
+
+  walls = sorted( walls )
+  n     = len( walls )
+  mid   = walls[ n // 2 ] if n % 2 else \
+          ( walls[ n // 2 - 1 ] + walls[ n // 2 ] ) / 2
+
+  return ( mid, n )
+
+# record
+#
+# Adds a finished telemetry record of the step to the history
+#
+
+def record( conn, identity, build_dir, data ):
+
+  keys = [ 'host', 'start', 'wall', 'user', 'sys', 'max_rss',
+           'read_bytes', 'write_bytes', 'status', 'returncode' ]
+
+  conn.execute(
+    'INSERT INTO runs ( design, step, fingerprint, build_dir, {} ) '
+    'VALUES ( ?, ?, ?, ?, {} )'.format(
+      ', '.join( keys ), ', '.join( [ '?' ] * len( keys ) ) ),
+    tuple( identity ) +
+      ( os.path.basename( os.path.abspath( build_dir ) ), ) +
+      tuple( data.get( k ) for k in keys ) )
+
+  conn.commit()
+
+# get_regression
+#
+# Returns the fraction by which the step ran slower than its estimate in
+# the telemetry record, or None if it is not a regression
+#
+
+def get_regression( data ):
+
+  if data.get( 'status' ) != 'done' or 'estimate' not in data:
+    return None
+
+  wall, est = data['wall'], data['estimate']
+
+  if data.get( 'estimate_runs', 0 ) < regression_min_runs or est <= 0:
+    return None
+
+  if wall - est < regression_min_seconds or \
+      wall <= est * ( 1 + get_slowdown() ):
+    return None
+
+  return wall / est - 1
+
+#-------------------------------------------------------------------------
+# Steps
+#-------------------------------------------------------------------------
+# These look up the history of the step in a build directory. The history
+# is only a convenience, so these never fail (e.g., if the database is
+# locked for too long or the directory is not a build).
+#
+
+# lookup_estimate
+#
+# Returns ( seconds, runs ) for the step with the given configure.yml in
+# the build at build_root (see estimate)
+#
+
+def lookup_estimate( config_path, build_root='.' ):
+
+  path = get_history_path( build_root )
+
+  if not path or not os.path.exists( path ) or \
+      not os.path.exists( config_path ):
+    return None
+
+  try:
+    conn = connect( path )
+    try:
+      return estimate( conn, step_identity( config_path, build_root ) )
+    finally:
+      conn.close()
+  except ( sqlite3.Error, OSError, KeyError, AssertionError ):
+    return None
+
+# record_step
+#
+# Adds the telemetry record of the step in the build directory to the
+# history. Returns True if it was recorded.
+#
+
+def record_step( build_dir, data ):
+
+  build_root  = os.path.dirname( os.path.abspath( build_dir ) )
+  config_path = build_dir + '/configure.yml'
+  path        = get_history_path( build_root )
+
+  if not path or not os.path.exists( config_path ):
+    return False
+
+  try:
+    conn = connect( path )
+    try:
+      record( conn, step_identity( config_path, build_root ), build_dir,
+              data )
+    finally:
+      conn.close()
+  except ( sqlite3.Error, OSError, KeyError, AssertionError ):
+    return False
+
+  return True
@@ -0,0 +1,314 @@
+#=========================================================================
+# profiler.py
+#=========================================================================
+# Phase profiler for "mflowgen run --profile"
+#
+# Each phase of generating the build files (e.g., importing the construct
+# script, expanding parameters, writing the metadata) is timed with a
+# wall-clock timer and a CPU timer, and the peak of the memory traced by
+# tracemalloc while the phase ran is recorded. Phases are either marked
+# explicitly:
+#
+#   with profiler.phase( 'construct' ):
+#     ...
+#
+# or by instrumenting functions (e.g., Step.__init__), so that every call
+# is accounted to the phase. Phases nest, and a phase is reported by its
+# path (e.g., "build / setup / dump_metadata") with the number of calls
+# and the total times, sorted by wall-clock time.
+#
+# Phases may run in worker threads (e.g., the metadata of each step is
+# written in a thread pool). These are nested under the phase that the
+# main thread is in, and their CPU time is the CPU time of the thread.
+# Their wall-clock times add up across threads, so they can exceed the
+# time of the enclosing phase. Memory peaks are only recorded in the main
+# thread.
+#
+# Optionally, cProfile runs at the same time and its stats are dumped to
+# a pstats file (e.g., for snakeviz or "python -m pstats"). Note that
+# cProfile slows down the run, which the phase times then include.
+#
+
+import contextlib
+import cProfile
+import functools
+import threading
+import time
+import tracemalloc
+
+from mflowgen.utils import bold
+
+# thread_time
+#
+# CPU time of the current thread. Python 3.6 has no time.thread_time, so
+# the thread CPU clock is read directly where the platform has one, and
+# the CPU time of the whole process is used otherwise.
+#
+
+if hasattr( time, 'thread_time' ): # Python 3.7+
+  thread_time = time.thread_time
+elif hasattr( time, 'CLOCK_THREAD_CPUTIME_ID' ):
+  thread_time = functools.partial( time.clock_gettime,
+                                   time.CLOCK_THREAD_CPUTIME_ID )
+else:
+  thread_time = time.process_time
+
+class Profiler:
+
+  def __init__( s, enabled=True, pstats_path=None ):
+
+    s.enabled     = enabled
+    s.pstats_path = pstats_path
+
+    # Totals for each phase path: [ calls, wall, cpu, peak ]
+
+    s.stats = {}
+    s.lock  = threading.Lock()
+
+    # Stack of running phases in the main thread and in other threads
+
+    s.main_thread = threading.main_thread()
+    s.main_stack  = []
+    s.local       = threading.local()
+
+    # Instrumented functions ( owner, attr, original )
+
+    s.patched = []
+
+    s.cprofile = None
+    s.total    = None
+    s.peak     = 0
+
+  #-----------------------------------------------------------------------
+  # start / stop
+  #-----------------------------------------------------------------------
+
+  def start( s ):
+
+    if not s.enabled:
+      return
+
+    tracemalloc.start()
+
+    if s.pstats_path:
+      s.cprofile = cProfile.Profile()
+      s.cprofile.enable()
+
+    s.wall0 = time.perf_counter()
+    s.cpu0  = time.process_time()
+
+  def stop( s ):
+
+    if not s.enabled:
+      return
+
+    s.mark_peak()
+
+    s.total = [ time.perf_counter() - s.wall0,
+                time.process_time() - s.cpu0,
+                s.peak / 2**20 ]
+
+    if s.cprofile:
+      s.cprofile.disable()
+      s.cprofile.dump_stats( s.pstats_path )
+
+    tracemalloc.stop()
+
+    s.restore()
+
+  #-----------------------------------------------------------------------
+  # phase
+  #-----------------------------------------------------------------------
+  # Accounts everything that runs within the context to the named phase.
+  # A phase that is already running in this thread (e.g., a recursive
+  # call) is only accounted once.
+  #
+
+  @contextlib.contextmanager
+  def phase( s, name ):
+
+    if not s.enabled:
+      yield
+      return
+
+    main  = threading.current_thread() is s.main_thread
+    stack = s.main_stack if main else s.get_local_stack()
+    names = [ frame['name'] for frame in stack ]
+
+    if name in names:
+      yield
+      return
+
+    # Phases in other threads nest under the phase of the main thread
+
+    parent = stack or ( [] if main else list( s.main_stack ) )
+
+    path  = ' / '.join( [ frame['path'] for frame in parent[-1:] ] +
+                        [ name ] )
+    frame = { 'name': name, 'path': path, 'peak': 0 }
+    clock = time.process_time if main else thread_time
+
+    if main:
+      s.mark_peak()
+
+    stack.append( frame )
+
+    wall0 = time.perf_counter()
+    cpu0  = clock()
+
+    try:
+      yield
+    finally:
+
+      wall = time.perf_counter() - wall0
+      cpu  = clock() - cpu0
+
+      if main:
+        s.mark_peak()
+
+      stack.pop()
+
+      with s.lock:
+        stats = s.stats.setdefault( path, [ 0, 0.0, 0.0, None ] )
+        stats[0] += 1
+        stats[1] += wall
+        stats[2] += cpu
+        if main:
+          stats[3] = max( stats[3] or 0, frame['peak'] / 2**20 )
+
+  # get_local_stack
+
+  def get_local_stack( s ):
+    if not hasattr( s.local, 'stack' ):
+      s.local.stack = []
+    return s.local.stack
+
+  # mark_peak
+  #
+  # Accounts the peak traced memory since the last mark to every running
+  # phase of the main thread and starts a new peak
+  #
+
+  def mark_peak( s ):
+    peak   = tracemalloc.get_traced_memory()[1]
+    s.peak = max( s.peak, peak )
+    for frame in s.main_stack:
+      frame['peak'] = max( frame['peak'], peak )
+    if hasattr( tracemalloc, 'reset_peak' ): # Python 3.9+
+      tracemalloc.reset_peak()
+
+  #-----------------------------------------------------------------------
+  # instrument
+  #-----------------------------------------------------------------------
+  # Replaces the function "attr" of the owner (a class or a module) with a
+  # wrapper that accounts every call to the named phase until stop
+  #
+
+  def instrument( s, owner, attr, name=None ):
+
+    if not s.enabled:
+      return
+
+    func = getattr( owner, attr )
+    name = name or attr
+
+    @functools.wraps( func )
+    def wrapper( *args, **kwargs ):
+      with s.phase( name ):
+        return func( *args, **kwargs )
+
+    s.patched.append( ( owner, attr, vars( owner ).get( attr ) ) )
+    setattr( owner, attr, wrapper )
+
+  # restore
+
+  def restore( s ):
+    for owner, attr, original in reversed( s.patched ):
+      if original is None:
+        delattr( owner, attr )
+      else:
+        setattr( owner, attr, original )
+    s.patched = []
+
+  # instrument_build
+  #
+  # Instruments the phases of constructing a graph and generating the
+  # build files with the given backend
+  #
+
+  def instrument_build( s, backend_cls ):
+
+    from mflowgen.components              import Graph, Step
+    from mflowgen.core                    import build_orchestrator
+    from mflowgen.core.build_orchestrator import BuildOrchestrator
+    from mflowgen.utils                   import helpers
+
+    s.instrument( Step,    '__init__',    'Step.__init__' )
+    s.instrument( Step,    'render_yaml', 'render_yaml'   )
+    s.instrument( helpers, 'read_yaml',   'read_yaml'     )
+
+    for attr in [ 'connect', 'validate', 'expand_params',
+                  'topological_sort', 'dump_metadata_to_steps' ]:
+      s.instrument( Graph, attr )
+
+    s.instrument( Graph, '_param_expand', 'param_space' )
+
+    for attr in [ 'build', 'setup', 'check_graph', 'set_unique_build_ids',
+                  'invalidate_steps', 'dump_metadata',
+                  'dump_step_metadata', 'render_commands',
+                  'render_debug_commands', 'prune_metadata',
+                  'collect_resources', 'dump_graphviz' ]:
+      s.instrument( BuildOrchestrator, attr )
+
+    s.instrument( build_orchestrator, 'render_assertion_check_scripts',
+                  'assertion scripts' )
+
+    # All backend calls count as writing the build files
+
+    for attr in dir( backend_cls ):
+      if attr.startswith( 'gen_' ):
+        s.instrument( backend_cls, attr, 'backend' )
+
+  #-----------------------------------------------------------------------
+  # report
+  #-----------------------------------------------------------------------
+  # Returns the rows ( path, calls, wall, cpu, peak ) sorted by wall-clock
+  # time
+  #
+
+  def report( s ):
+    rows = [ ( path, ) + tuple( stats ) for path, stats in s.stats.items() ]
+    return sorted( rows, key=lambda x: ( -x[2], x[0] ) )
+
+  # print_report
+
+  def print_report( s ):
+
+    if not s.enabled or s.total is None:
+      return
+
+    rows  = s.report()
+    width = max( [ len( x[0] ) for x in rows ] + [ 5 ] )
+
+    fmt = '{:<' + str( width ) + '}  {:>7}  {:>9}  {:>9}  {:>9}'
+
+    def peak( x ):
+      return '-' if x is None else '{:.1f}'.format( x )
+
+    print( bold( 'Profile:' ) )
+    print()
+    print( fmt.format( 'Phase', 'Calls', 'Wall (s)', 'CPU (s)',
+                       'Peak (MB)' ) )
+    print( fmt.format( 'total', '', '{:.3f}'.format( s.total[0] ),
+                       '{:.3f}'.format( s.total[1] ),
+                       peak( s.total[2] ) ) )
+
+    for path, calls, wall, cpu, mem in rows:
+      print( fmt.format( path, calls, '{:.3f}'.format( wall ),
+                         '{:.3f}'.format( cpu ), peak( mem ) ) )
+
+    print()
+
+    if s.pstats_path:
+      print( 'cProfile stats written to', s.pstats_path )
+      print()
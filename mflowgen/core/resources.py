@@ -0,0 +1,364 @@
+#=========================================================================
+# resources.py
+#=========================================================================
+# Resource declarations and accounting for running steps concurrently
+#
+# Steps declare what they need while executing in their configure.yml:
+#
+#   resources:
+#     cpus     : 16          # e.g., '{nthreads}' to follow a parameter
+#     mem_gb   : 32
+#     licenses :
+#       dc     : 1
+#
+# The graph declares the totals (Graph.set_resource_limits). Totals that
+# are not declared default to the cores and memory of the host, and
+# licenses without a declared total are not limited.
+#
+# Each build system honors the limits in its own way:
+#
+# - ninja   : Steps are assigned to pools (see get_pools)
+# - make    : Steps run through the mflowgen-resources wrapper, which
+#             takes cpus from the make jobserver (when it can reach it)
+#             and everything else from a file-based allocator
+# - execute : The native executor accounts for all resources in-process
+#
+
+import fcntl
+import json
+import os
+
+# Name of the file in the metadata directory with the declared totals
+
+limits_name = 'resources.yml'
+
+#-------------------------------------------------------------------------
+# Declarations
+#-------------------------------------------------------------------------
+
+# normalize_resources
+#
+# Returns a resource declaration with all fields filled in (cpus defaults
+# to one and memory to nothing) and checks the types
+#
+
+def normalize_resources( data ):
+
+  data = data or {}
+
+  for k in data:
+    assert k in [ 'cpus', 'mem_gb', 'licenses' ], \
+      'Unrecognized resource "{}" (expected cpus, mem_gb, licenses)'.format(
+        k )
+
+  resources = {
+    'cpus'     : int( data.get( 'cpus', 1 ) ),
+    'mem_gb'   : float( data.get( 'mem_gb', 0 ) ),
+    'licenses' : { k: int( v ) for k, v in
+                   ( data.get( 'licenses' ) or {} ).items() },
+  }
+
+  assert resources['cpus'] >= 1, 'Resource cpus must be at least one'
+  assert resources['mem_gb'] >= 0, 'Resource mem_gb must not be negative'
+
+  return resources
+
+# is_default
+#
+# Returns True if the declaration is what every step needs anyway (i.e.,
+# there is nothing to schedule around)
+#
+
+def is_default( resources ):
+  return resources == normalize_resources( {} )
+
+# get_host_limits
+#
+# Returns the totals of the current host, filled in by any declared
+# totals
+#
+
+def get_host_limits( limits=None ):
+
+  limits = limits or {}
+
+  try:
+    mem_gb = os.sysconf( 'SC_PAGE_SIZE' ) * \
+               os.sysconf( 'SC_PHYS_PAGES' ) / 2**30
+  except ( ValueError, OSError, AttributeError ):
+    mem_gb = float( 'inf' )
+
+  return {
+    'cpus'     : limits.get( 'cpus' ) or os.cpu_count() or 1,
+    'mem_gb'   : limits.get( 'mem_gb' ) or mem_gb,
+    'licenses' : dict( limits.get( 'licenses' ) or {} ),
+  }
+
+#-------------------------------------------------------------------------
+# Accounting
+#-------------------------------------------------------------------------
+# Resource amounts are flattened into dicts like:
+#
+#   { 'cpus': 16, 'mem_gb': 32, 'license:dc': 1 }
+#
+
+# flatten
+
+def flatten( resources ):
+  d = { 'cpus' : resources['cpus'], 'mem_gb' : resources['mem_gb'] }
+  for k, v in resources['licenses'].items():
+    d[ 'license:' + k ] = v
+  return d
+
+# clamp
+#
+# Clamps each amount to the total, so that a step that needs more than
+# the total can still run (alone)
+#
+
+def clamp( need, limits ):
+  total = flatten( limits )
+  return { k: min( v, total[k] ) if k in total else v
+           for k, v in need.items() }
+
+# fits
+#
+# Returns True if the flattened need fits next to the flattened amounts
+# in use
+#
+
+def fits( need, used, limits ):
+  total = flatten( limits )
+  for k, v in need.items():
+    if k in total and v and used.get( k, 0 ) + v > total[k]:
+      return False
+  return True
+
+# add
+
+def add( used, need, sign=1 ):
+  for k, v in need.items():
+    used[k] = used.get( k, 0 ) + sign * v
+
+#-------------------------------------------------------------------------
+# File-based allocator
+#-------------------------------------------------------------------------
+# Processes that share a build (e.g., parallel make jobs) allocate from a
+# state file that maps process IDs to the amounts they hold. Entries of
+# processes that no longer exist are dropped, so a killed job never leaks
+# its resources.
+#
+
+def _alive( pid ):
+  try:
+    os.kill( pid, 0 )
+  except ProcessLookupError:
+    return False
+  except PermissionError:
+    pass
+  return True
+
+# try_allocate
+#
+# Allocates the flattened need if it fits and returns True
+
+def try_allocate( state_path, need, limits, pid=None ):
+
+  pid = pid or os.getpid()
+
+  with open( state_path + '.lock', 'a' ) as lock:
+    fcntl.flock( lock, fcntl.LOCK_EX )
+
+    try:
+      with open( state_path ) as fd:
+        state = json.load( fd )
+    except ( OSError, ValueError ):
+      state = {}
+
+    state = { k: v for k, v in state.items() if _alive( int( k ) ) }
+
+    used = {}
+    for v in state.values():
+      add( used, v )
+
+    ok = fits( need, used, limits )
+
+    if ok:
+      state[ str( pid ) ] = need
+      with open( state_path, 'w' ) as fd:
+        json.dump( state, fd, indent=2, sort_keys=True )
+
+  return ok
+
+# release
+
+def release( state_path, pid=None ):
+
+  pid = pid or os.getpid()
+
+  with open( state_path + '.lock', 'a' ) as lock:
+    fcntl.flock( lock, fcntl.LOCK_EX )
+    try:
+      with open( state_path ) as fd:
+        state = json.load( fd )
+    except ( OSError, ValueError ):
+      return
+    state.pop( str( pid ), None )
+    with open( state_path, 'w' ) as fd:
+      json.dump( state, fd, indent=2, sort_keys=True )
+
+#-------------------------------------------------------------------------
+# Make jobserver
+#-------------------------------------------------------------------------
+# A recipe already holds one implicit job slot, so a step that needs N
+# cpus takes N-1 extra tokens from the jobserver. Tokens are taken all
+# at once without blocking and returned if not all of them are available
+# (i.e., never hold-and-wait), so parallel jobs cannot deadlock.
+#
+
+class Jobserver:
+
+  def __init__( s, fd_r, fd_w, jobs ):
+    s.fd_r = fd_r
+    s.fd_w = fd_w
+    s.jobs = jobs
+    s.held = b''
+
+  # try_take
+  #
+  # Takes n tokens and returns True, or takes nothing and returns False
+
+  def try_take( s, n ):
+    tokens = b''
+    while len( tokens ) < n:
+      try:
+        t = os.read( s.fd_r, n - len( tokens ) )
+      except BlockingIOError:
+        t = b''
+      if not t:
+        break
+      tokens += t
+    if len( tokens ) < n:
+      if tokens:
+        os.write( s.fd_w, tokens )
+      return False
+    s.held += tokens
+    return True
+
+  # give_back
+
+  def give_back( s ):
+    if s.held:
+      os.write( s.fd_w, s.held )
+      s.held = b''
+
+# get_jobserver
+#
+# Returns a Jobserver if this process can reach the jobserver of the
+# make that runs it (i.e., a named pipe from make 4.4+, or inherited
+# pipe file descriptors), otherwise None. The files are opened again so
+# that non-blocking reads do not affect make itself.
+#
+
+def get_jobserver( makeflags=None ):
+
+  if makeflags is None:
+    makeflags = os.environ.get( 'MAKEFLAGS', '' )
+
+  auth = None
+  jobs = None
+
+  for flag in makeflags.split():
+    if flag.startswith( '--jobserver-auth=' ) or \
+        flag.startswith( '--jobserver-fds=' ):
+      auth = flag.split( '=', 1 )[1]
+    elif flag.startswith( '-j' ) and flag[2:].isdigit():
+      jobs = int( flag[2:] )
+
+  if not auth or not jobs:
+    return None
+
+  try:
+    if auth.startswith( 'fifo:' ):
+      path = auth[ len( 'fifo:' ): ]
+    else:
+      r, w = auth.split( ',' )
+      os.fstat( int( r ) )
+      path = '/proc/self/fd/' + r
+    fd_r = os.open( path, os.O_RDONLY | os.O_NONBLOCK )
+    fd_w = os.open( path, os.O_WRONLY )
+  except ( OSError, ValueError ):
+    return None
+
+  return Jobserver( fd_r, fd_w, jobs )
+
+#-------------------------------------------------------------------------
+# Ninja pools
+#-------------------------------------------------------------------------
+
+# get_pools
+#
+# Ninja pools count jobs (not amounts) and each build edge can be in one
+# pool only. So each step that declares resources goes into the pool of
+# its binding resource (i.e., the one it needs the largest share of),
+# and each pool is as deep as the total divided by the largest need of
+# any step in the pool. Steps that are in the same pool can then never
+# oversubscribe that resource. Exact accounting across several resources
+# needs "mflowgen execute" or the make wrapper.
+#
+# - resources : dict of step names to resource declarations
+# - limits    : totals (see get_host_limits)
+#
+# Returns a dict of pool names to depths and a dict of step names to
+# pool names
+#
+
+def get_pools( resources, limits ):
+
+  total = flatten( limits )
+
+  assign = {}
+  needs  = {}
+
+  for step_name, r in sorted( resources.items() ):
+    if is_default( r ):
+      continue
+    binding = None
+    share   = 0
+    for k, v in flatten( r ).items():
+      if k in total and total[k] and v / total[k] > share:
+        binding, share = k, v / total[k]
+    if binding is None:
+      continue
+    pool = binding.replace( ':', '_' )
+    assign[ step_name ] = pool
+    needs[ pool ] = max( needs.get( pool, 0 ),
+                         min( flatten( r )[ binding ], total[ binding ] ) )
+
+  pools = {}
+
+  for pool, need in needs.items():
+    binding = pool.replace( 'license_', 'license:', 1 )
+    pools[ pool ] = max( 1, int( total[ binding ] // need ) )
+
+  return pools, assign
+
+#-------------------------------------------------------------------------
+# Helpers
+#-------------------------------------------------------------------------
+
+# describe
+#
+# Returns a short string for a flattened amount (e.g., for messages)
+
+def describe( need ):
+  return ', '.join( '{}={:g}'.format( k, v )
+                    for k, v in sorted( need.items() ) if v )
+
+# wait_interval
+#
+# Seconds to wait between allocation attempts (grows up to a few seconds
+# so that waiting jobs do not spin)
+
+def wait_interval( attempt ):
+  return min( 0.1 * 2 ** attempt, 5.0 )
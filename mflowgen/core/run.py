@@ -13,6 +13,10 @@ import sys
 import yaml
 
 from mflowgen.core.build_orchestrator import BuildOrchestrator
+from mflowgen.core.profiler           import Profiler
+from mflowgen.core.snapshot           import dump_graph, save_snapshot
+from mflowgen.core.snapshot           import load_snapshot, read_snapshot
+from mflowgen.core.snapshot           import get_module_files, get_graph_files
 from mflowgen.backends                import MakeBackend, NinjaBackend
 from mflowgen.utils                   import bold
 from mflowgen.utils                   import read_yaml, write_yaml
@@ -20,7 +24,7 @@ from mflowgen.utils                   import read_yaml, write_yaml
 class RunHandler:
 
   def __init__( s ):
-    pass
+    s.profiler = Profiler( enabled=False )
 
   #-----------------------------------------------------------------------
   # helpers
@@ -100,13 +104,68 @@ class RunHandler:
     data['construct'] = construct_path
     write_yaml( data = data, path = yaml_path )
 
+  # construct_graph
+  #
+  # Import the construct script and run it to construct the graph
+  #
+  # Returns the graph and the list of files it was constructed from (the
+  # construct script, any modules it imported, and the configure.yml of
+  # each step) for fingerprinting the graph snapshot
+  #
+
+  def construct_graph( s, construct_path ):
+
+    # Import the graph for this design
+
+    c_dirname  = os.path.dirname( construct_path )
+    c_basename = os.path.splitext( os.path.basename( construct_path ) )[0]
+
+    sys.path.append( c_dirname )
+
+    modules_before = set( sys.modules.keys() )
+
+    try:
+      with s.profiler.phase( 'import construct script' ):
+        construct = importlib.import_module( c_basename )
+    except ModuleNotFoundError:
+      print()
+      print( bold( 'Error:' ), 'Could not open construct script at',
+                                      '"{}"'.format( construct_path ) )
+      print()
+      sys.exit( 1 )
+
+    try:
+      construct.construct
+    except AttributeError:
+      print()
+      print( bold( 'Error:' ), 'No module named "construct" in',
+                                      '"{}"'.format( construct_path ) )
+      print()
+      sys.exit( 1 )
+
+    # Construct the graph
+
+    with s.profiler.phase( 'construct' ):
+      g = construct.construct()
+
+    # Collect the files that the graph depends on
+
+    new_modules = set( sys.modules.keys() ) - modules_before
+
+    files = [ os.path.abspath( construct_path ) ]
+    files.extend( get_module_files( new_modules ) )
+    files.extend( get_graph_files( g ) )
+
+    return g, files
+
   #-----------------------------------------------------------------------
   # launch
   #-----------------------------------------------------------------------
   # Dispatch function for commands
   #
 
-  def launch( s, help_, design, update=False, backend='make' ):
+  def launch( s, help_, design, update=False, backend='make',
+                    profile=False, pstats=None ):
 
     # Check that this design directory exists
 
@@ -115,7 +174,28 @@ class RunHandler:
                                'unless using --update or --demo' )
       sys.exit( 1 )
 
-    s.launch_run( design, update, backend )
+    # Profile the phases of the run (see profiler.py)
+
+    if profile or pstats:
+      s.profiler = Profiler( pstats_path=pstats )
+      s.profiler.instrument_build( s.get_backend_cls( backend ) )
+
+    s.profiler.start()
+
+    try:
+      s.launch_run( design, update, backend )
+    finally:
+      s.profiler.stop()
+
+    s.profiler.print_report()
+
+  # get_backend_cls
+
+  def get_backend_cls( s, backend ):
+    if backend == 'make':
+      return MakeBackend
+    elif backend == 'ninja':
+      return NinjaBackend
 
   #-----------------------------------------------------------------------
   # launch_run
@@ -132,46 +212,52 @@ class RunHandler:
     construct_path = s.find_construct_path( design, update )
     s.save_construct_path( construct_path )
 
-    # Import the graph for this design
+    # Load the graph from the previous run (if any) so that only the steps
+    # that changed since then are invalidated
 
-    c_dirname  = os.path.dirname( construct_path )
-    c_basename = os.path.splitext( os.path.basename( construct_path ) )[0]
+    with s.profiler.phase( 'load snapshot' ):
+      prev_graph = load_snapshot( '.mflowgen', check=False )
 
-    sys.path.append( c_dirname )
+    # With --update, reuse the graph snapshot from the previous run if the
+    # construct script and everything it depends on are unchanged
 
-    try:
-      construct = importlib.import_module( c_basename )
-    except ModuleNotFoundError:
-      print()
-      print( bold( 'Error:' ), 'Could not open construct script at',
-                                      '"{}"'.format( construct_path ) )
-      print()
-      sys.exit( 1 )
+    g = None
 
-    try:
-      construct.construct
-    except AttributeError:
-      print()
-      print( bold( 'Error:' ), 'No module named "construct" in',
-                                      '"{}"'.format( construct_path ) )
-      print()
-      sys.exit( 1 )
+    if update:
+      data = read_snapshot( '.mflowgen' )
+      if data and os.path.abspath( construct_path ) in data['files']:
+        g = load_snapshot( '.mflowgen' )
+      if g is not None:
+        print( 'Construct script unchanged, using saved graph snapshot' )
+        print()
+        files = data['files']
 
-    # Construct the graph
+    # Otherwise construct the graph
+
+    if g is None:
+      g, files = s.construct_graph( construct_path )
+
+    # Serialize the graph before the build orchestrator modifies it
 
-    g = construct.construct()
+    with s.profiler.phase( 'dump_graph' ):
+      graph_data = dump_graph( g )
 
     # Generate the build files (e.g., Makefile) for the selected backend
     # build system
 
-    if backend == 'make':
-      backend_cls = MakeBackend
-    elif backend == 'ninja':
-      backend_cls = NinjaBackend
+    backend_cls = s.get_backend_cls( backend )
 
-    b = BuildOrchestrator( g, backend_cls )
+    b = BuildOrchestrator( g, backend_cls, prev_graph )
     b.build()
 
+    # Save the graph snapshot for future use of --update
+
+    with s.profiler.phase( 'save snapshot' ):
+      save_snapshot( metadata_dir = b.metadata_dir,
+                     graph_data   = graph_data,
+                     files        = files,
+                     build_ids    = b.build_ids )
+
     # Done
 
     list_target   = backend + " list"
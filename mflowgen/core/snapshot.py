@@ -0,0 +1,194 @@
+#=========================================================================
+# snapshot.py
+#=========================================================================
+# Saves and loads a compiled snapshot of the user's graph so that running
+# "mflowgen run --update" can skip re-running the construct script when
+# nothing it depends on has changed.
+#
+# The snapshot is saved into the metadata directory and contains:
+#
+# - The graph exactly as returned by construct() (i.e., after any
+#   param_space expansion but before the build orchestrator expands
+#   parameters and attaches build metadata)
+# - The build IDs assigned to each step
+# - The list of files the graph was constructed from and a fingerprint
+#   of their contents
+#
+# The fingerprint covers the construct script, every module that was
+# imported while running it, and the configure.yml of every step in the
+# graph. It also covers the mflowgen version and the environment that
+# affects step lookup (e.g., MFLOWGEN_PATH for ADKs).
+#
+
+import hashlib
+import os
+import pickle
+import sys
+
+from mflowgen.version import __version__
+
+# Bump this if the snapshot contents change in an incompatible way
+
+snapshot_format = 1
+
+# Name of the snapshot file inside the metadata directory
+
+snapshot_name = 'snapshot.pickle'
+
+#-------------------------------------------------------------------------
+# Fingerprinting
+#-------------------------------------------------------------------------
+
+# get_module_files
+#
+# Returns the source files for the given module names (skipping builtin
+# modules and modules without a source file on disk)
+#
+
+def get_module_files( module_names ):
+  files = []
+  for name in module_names:
+    try:
+      f = sys.modules[ name ].__file__
+    except ( KeyError, AttributeError ):
+      continue
+    if f and os.path.isfile( f ):
+      files.append( os.path.abspath( f ) )
+  return files
+
+# get_graph_files
+#
+# Returns the configure.yml paths for all steps in the graph
+#
+
+def get_graph_files( g ):
+  files = []
+  for step_name in g.all_steps():
+    source = g.get_step( step_name ).get_source()
+    if source:
+      files.append( source + '/configure.yml' )
+  return files
+
+# get_mflowgen_files
+#
+# Returns the source files for the graph classes, since the snapshot
+# stores pickled instances of these classes
+#
+
+def get_mflowgen_files():
+  return get_module_files( [ 'mflowgen.components.graph',
+                             'mflowgen.components.step',
+                             'mflowgen.components.edge' ] )
+
+# fingerprint
+#
+# Returns a hex digest over the contents of the given files and over the
+# environment that affects how the graph is constructed. Missing files
+# simply hash differently from present ones.
+#
+
+def fingerprint( files ):
+
+  h = hashlib.sha1()
+
+  h.update( repr( ( snapshot_format, __version__ ) ).encode() )
+  h.update( repr( ( os.getcwd(),
+                    os.environ.get( 'MFLOWGEN_HOME', '' ),
+                    os.environ.get( 'MFLOWGEN_PATH', '' ) ) ).encode() )
+
+  for f in sorted( set( files ) ):
+    h.update( f.encode() + b'\0' )
+    try:
+      with open( f, 'rb' ) as fd:
+        h.update( hashlib.sha1( fd.read() ).digest() )
+    except OSError:
+      h.update( b'<missing>' )
+
+  return h.hexdigest()
+
+#-------------------------------------------------------------------------
+# Save and load
+#-------------------------------------------------------------------------
+
+# dump_graph
+#
+# Serializes the graph. This must be called before the build orchestrator
+# modifies the graph (e.g., expands parameters).
+#
+
+def dump_graph( g ):
+  return pickle.dumps( g, protocol=pickle.HIGHEST_PROTOCOL )
+
+# save_snapshot
+#
+# - metadata_dir : path to the metadata directory
+# - graph_data   : serialized graph from dump_graph
+# - files        : list of files the graph was constructed from
+# - build_ids    : dict of step names to build IDs
+#
+
+def save_snapshot( metadata_dir, graph_data, files, build_ids ):
+
+  files = sorted( set( files + get_mflowgen_files() ) )
+
+  data = {
+    'format'      : snapshot_format,
+    'version'     : __version__,
+    'files'       : files,
+    'fingerprint' : fingerprint( files ),
+    'build_ids'   : dict( build_ids ),
+    'graph'       : graph_data,
+  }
+
+  path     = metadata_dir + '/' + snapshot_name
+  path_tmp = path + '.tmp'
+
+  with open( path_tmp, 'wb' ) as fd:
+    pickle.dump( data, fd, protocol=pickle.HIGHEST_PROTOCOL )
+
+  os.replace( path_tmp, path )
+
+# read_snapshot
+#
+# Returns the raw snapshot data in the metadata directory, or None if
+# there is no readable snapshot
+#
+
+def read_snapshot( metadata_dir ):
+
+  path = metadata_dir + '/' + snapshot_name
+
+  try:
+    with open( path, 'rb' ) as fd:
+      data = pickle.load( fd )
+  except Exception:
+    return None
+
+  if type( data ) != dict or data.get( 'format' ) != snapshot_format:
+    return None
+
+  return data
+
+# load_snapshot
+#
+# Returns the graph saved in the metadata directory if none of the files
+# it was constructed from have changed, otherwise returns None.
+#
+# - check : if False, return the saved graph even if it is out of date
+#           (e.g., to diff against the new graph)
+#
+
+def load_snapshot( metadata_dir, check=True ):
+
+  data = read_snapshot( metadata_dir )
+
+  if not data:
+    return None
+
+  if check and fingerprint( data['files'] ) != data['fingerprint']:
+    return None
+
+  try:
+    return pickle.loads( data['graph'] )
+  except Exception:
+    return None
@@ -0,0 +1,277 @@
+#=========================================================================
+# status.py
+#=========================================================================
+# Native build status
+#
+# The status of each step is computed directly from the files that the
+# build leaves behind instead of from a dry run of the build tool:
+#
+# - The graph comes from the metadata directory (i.e., the upstream steps
+#   in the "edges_i" of each .mflowgen/<build_dir>/configure.yml)
+# - The stamps (.postconditions.stamp and .execstamp) tell whether a step
+#   ever finished
+# - The digest manifest (see digests.py) tells whether a finished step is
+#   still up to date by content
+# - The telemetry record (see telemetry.py) tells whether a step is
+#   running or failed in its last run
+#
+# Each step is one of:
+#
+# - done     : Up to date
+# - stale    : Needs to build (e.g., never built, inputs or parameters
+#              changed, or an upstream step needs to build)
+# - running  : Executing right now
+# - failed   : Failed in its last run (or was interrupted)
+# - prebuilt : Marked as pre-built (i.e., has a ".prebuilt" file)
+#
+# The status is a plain dict so that it can be dumped as JSON:
+#
+#   {
+#     'format'    : 1,
+#     'time'      : when the status was computed (seconds since epoch),
+#     'build_dir' : absolute path of the build,
+#     'steps'     : [ {
+#       'build_dir' : e.g., '3-synopsys-dc-synthesis',
+#       'build_id'  : e.g., 3,
+#       'name'      : e.g., 'synopsys-dc-synthesis',
+#       'status'    : one of the above,
+#       'reason'    : why the step is stale or failed (or None),
+#       'upstream'  : build directories of the steps it depends on,
+#       'telemetry' : record of the last run (or None),
+#       'estimate'  : expected seconds left for steps that need to build
+#                     (from the runtime history, see history.py, or None),
+#     }, ... ],
+#     'counts'    : number of steps for each status,
+#     'order'     : steps that need to build (stale, running, or failed)
+#                   in dependency order,
+#     'time_left' : sum of the estimates (i.e., if the steps run one at a
+#                   time), or None if no step has an estimate,
+#   }
+#
+# Steps are listed in order of their build ids.
+#
+
+import os
+import socket
+import time
+
+from mflowgen.core.digests   import read_digests, stale_reason
+from mflowgen.core.history   import lookup_estimate
+from mflowgen.core.telemetry import read_telemetry, get_runtime
+from mflowgen.utils          import read_yaml_cached
+
+# Bump this if the status contents change in an incompatible way
+
+status_format = 1
+
+# All statuses in the order they are reported
+
+statuses = [ 'done', 'stale', 'running', 'failed', 'prebuilt' ]
+
+#-------------------------------------------------------------------------
+# Helpers
+#-------------------------------------------------------------------------
+
+# list_build_dirs
+#
+# Returns the build directories that have metadata in the build (i.e.,
+# all steps in the graph) in order of their build ids
+#
+
+def list_build_dirs( metadata_dir='.mflowgen' ):
+  try:
+    names = os.listdir( metadata_dir )
+  except OSError:
+    return []
+  names = [ x for x in names if x.split('-')[0].isdigit() and
+              os.path.isdir( metadata_dir + '/' + x ) ]
+  return sorted( names, key=lambda x: int( x.split('-')[0] ) )
+
+# read_upstream
+#
+# Returns the build directories of the steps that the step depends on
+# (i.e., that it collects inputs from)
+#
+
+def read_upstream( build_dir, metadata_dir='.mflowgen' ):
+  try:
+    config = read_yaml_cached( metadata_dir + '/' + build_dir +
+                               '/configure.yml' )
+  except OSError:
+    return []
+  upstream = set()
+  for edges in ( config.get( 'edges_i' ) or {} ).values():
+    for e in edges:
+      upstream.add( e['step'] )
+  return sorted( upstream )
+
+# sort_build_dirs
+#
+# Returns the build directories in dependency order (i.e., upstream steps
+# first), breaking ties by build id
+#
+
+def sort_build_dirs( build_dirs, upstream ):
+
+  order   = []
+  visited = set()
+
+  def visit( d ):
+    if d in visited:
+      return
+    visited.add( d )
+    for u in upstream.get( d, [] ):
+      if u in upstream:
+        visit( u )
+    order.append( d )
+
+  for d in build_dirs:
+    visit( d )
+
+  return order
+
+# is_alive
+#
+# Returns False if the process of the telemetry record is known to have
+# exited (only known for processes on this host)
+#
+
+def is_alive( data ):
+  if 'pid' not in data or data.get( 'host' ) != socket.gethostname():
+    return True
+  try:
+    os.kill( data['pid'], 0 )
+  except ProcessLookupError:
+    return False
+  except OSError:
+    pass # e.g., owned by someone else
+  return True
+
+# mtime
+
+def mtime( path ):
+  try:
+    return os.stat( path ).st_mtime
+  except OSError:
+    return None
+
+#-------------------------------------------------------------------------
+# step_status
+#-------------------------------------------------------------------------
+# Returns the ( status, reason ) of the step in the build directory, given
+# the statuses of the steps it depends on
+#
+
+def step_status( build_dir, upstream, status, telemetry,
+                 metadata_dir='.mflowgen' ):
+
+  if os.path.exists( build_dir + '/.prebuilt' ):
+    return ( 'prebuilt', None )
+
+  if telemetry and telemetry['status'] == 'running':
+    if is_alive( telemetry ):
+      return ( 'running', None )
+    return ( 'failed', 'interrupted' )
+
+  if telemetry and telemetry['status'] == 'failed':
+    return ( 'failed', 'exit code {}'.format(
+                         telemetry.get( 'returncode' ) ) )
+
+  stamp     = mtime( build_dir + '/.postconditions.stamp' )
+  execstamp = mtime( build_dir + '/.execstamp' )
+
+  if stamp is None:
+    if execstamp is None:
+      return ( 'stale', 'never built' )
+    return ( 'stale', 'postconditions not passed' )
+
+  for u in upstream:
+    if status.get( u, 'done' ) not in [ 'done', 'prebuilt' ]:
+      return ( 'stale', 'upstream {} is {}'.format( u, status[u] ) )
+
+  if execstamp is not None and stamp < execstamp:
+    return ( 'stale', 'postconditions not passed' )
+
+  # Up to date by content if there is a digest manifest, otherwise by
+  # timestamps like the build tools
+
+  if read_digests( build_dir ):
+    reason = stale_reason( build_dir )
+    return ( 'stale', reason ) if reason else ( 'done', None )
+
+  newer = [ metadata_dir + '/' + build_dir + '/configure.yml',
+            metadata_dir + '/' + build_dir + '/mflowgen-run' ] + \
+          [ u + '/.execstamp' for u in upstream ]
+
+  if any( ( mtime( p ) or 0 ) > ( execstamp or stamp ) for p in newer ):
+    return ( 'stale', 'inputs or parameters changed' )
+
+  return ( 'done', None )
+
+#-------------------------------------------------------------------------
+# get_status
+#-------------------------------------------------------------------------
+# Returns the status of the build in the current directory (see the top
+# of this file). The steps can be limited to a list of build directories.
+#
+
+def get_status( build_dirs=None, metadata_dir='.mflowgen' ):
+
+  if build_dirs is None:
+    build_dirs = list_build_dirs( metadata_dir )
+
+  build_dirs = sorted( build_dirs, key=lambda x: int( x.split('-')[0] ) )
+
+  upstream = { d: read_upstream( d, metadata_dir ) for d in build_dirs }
+  order    = sort_build_dirs( build_dirs, upstream )
+
+  status  = {}
+  reasons = {}
+  records = {}
+
+  for d in order:
+    records[d] = read_telemetry( d )
+    status[d], reasons[d] = step_status( d, upstream[d], status,
+                                         records[d], metadata_dir )
+
+  # Expected time left from the runtime history (running steps have an
+  # estimate in their record already)
+
+  estimates = {}
+
+  for d in order:
+    data = records[d]
+    if status[d] == 'running':
+      if 'estimate' in data:
+        estimates[d] = max( data['estimate'] - get_runtime( data ), 0 )
+    elif status[d] in [ 'stale', 'failed' ]:
+      est = lookup_estimate( metadata_dir + '/' + d + '/configure.yml' )
+      if est:
+        estimates[d] = est[0]
+
+  steps = []
+
+  for d in build_dirs:
+    tokens = d.split('-')
+    steps.append( {
+      'build_dir' : d,
+      'build_id'  : int( tokens[0] ),
+      'name'      : '-'.join( tokens[1:] ),
+      'status'    : status[d],
+      'reason'    : reasons[d],
+      'upstream'  : upstream[d],
+      'telemetry' : records[d],
+      'estimate'  : estimates.get( d ),
+    } )
+
+  return {
+    'format'    : status_format,
+    'time'      : time.time(),
+    'build_dir' : os.path.abspath( '.' ),
+    'steps'     : steps,
+    'counts'    : { k: list( status.values() ).count( k )
+                      for k in statuses },
+    'order'     : [ d for d in order
+                      if status[d] in [ 'stale', 'running', 'failed' ] ],
+    'time_left' : sum( estimates.values() ) if estimates else None,
+  }
@@ -0,0 +1,386 @@
+#=========================================================================
+# telemetry.py
+#=========================================================================
+# Resource telemetry for each step
+#
+# The generated mflowgen-run script of each step runs itself under the
+# telemetry recorder ("mflowgen-telemetry", see render_commands in the
+# BuildOrchestrator), which saves a JSON record in the build directory:
+#
+#   {
+#     'format'        : 1,
+#     'status'        : 'running' | 'done' | 'failed' | 'cached',
+#     'host'          : host name,
+#     'pid'           : process ID of the recorder,
+#     'command'       : command that ran,
+#     'start'         : start time (seconds since epoch),
+#     'end'           : end time (seconds since epoch),
+#     'wall'          : wall-clock time (seconds),
+#     'user'          : user CPU time of the process tree (seconds),
+#     'sys'           : system CPU time of the process tree (seconds),
+#     'max_rss'       : peak resident memory of the process tree (bytes),
+#                       or None if it could not be measured,
+#     'read_bytes'    : bytes read from storage by the process tree,
+#     'write_bytes'   : bytes written to storage by the process tree,
+#     'returncode'    : exit status,
+#     'estimate'      : runtime expected from the history (seconds),
+#     'estimate_runs' : number of past runs the estimate is based on,
+#     'slowdown'      : fraction by which the step ran slower than expected,
+#   }
+#
+# The estimates come from the runtime history (see history.py), which
+# every finished record is added to. The last three keys are only set if
+# the step has a history, and the slowdown only if it is a regression.
+#
+# The record is written with status "running" when the step starts, so
+# that in-progress steps have a start time, and again when it finishes.
+#
+# CPU times and I/O come from the resource usage of all children once
+# they exit. The peak memory of the tree is sampled from /proc (the sum
+# over all processes in the tree), and is at least the peak of the
+# largest single process from the resource usage (e.g., where there is no
+# /proc or the peak fell between samples). Commands that exit before the
+# first sample and stay below the peak of the recorder itself have no
+# measurement.
+#
+
+import json
+import os
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from mflowgen.core.history import lookup_estimate, record_step
+from mflowgen.core.history import get_regression
+
+# Name of the record inside each build directory
+
+telemetry_name = '.telemetry.json'
+
+# Bump this if the record contents change in an incompatible way
+
+telemetry_format = 1
+
+# Seconds between samples of the memory of the process tree
+
+def get_sample_interval():
+  return float( os.environ.get( 'MFLOWGEN_TELEMETRY_INTERVAL', 1.0 ) )
+
+#-------------------------------------------------------------------------
+# Records
+#-------------------------------------------------------------------------
+
+# read_telemetry
+#
+# Returns the record of the build directory, or None if the step never
+# ran. Build directories from older versions only have timestamps
+# (.time_start and .time_end), which are converted.
+#
+
+def read_telemetry( build_dir ):
+
+  try:
+    with open( build_dir + '/' + telemetry_name ) as fd:
+      data = json.load( fd )
+    if data.get( 'format' ) == telemetry_format:
+      return data
+  except ( OSError, ValueError ):
+    pass
+
+  def read_time( name ):
+    try:
+      with open( build_dir + '/' + name ) as fd:
+        return time.mktime( time.strptime( fd.read().strip(),
+                                           '%Y-%m%d-%H%M-%S' ) )
+    except ( OSError, ValueError ):
+      return None
+
+  start = read_time( '.time_start' )
+  end   = read_time( '.time_end' )
+
+  if start is None:
+    return None
+
+  data = { 'format': telemetry_format, 'status': 'running',
+           'start': start }
+
+  if end is not None:
+    data.update( status='done', end=end, wall=end - start )
+
+  return data
+
+# write_telemetry
+#
+# Writes the record atomically, so that readers never see a partial one
+
+def write_telemetry( build_dir, data ):
+  path = build_dir + '/' + telemetry_name
+  tmp  = path + '.tmp.' + str( os.getpid() )
+  with open( tmp, 'w' ) as fd:
+    json.dump( dict( data, format=telemetry_format ), fd, indent=2,
+               sort_keys=True )
+  os.replace( tmp, path )
+
+# write_cached_telemetry
+#
+# Writes the record of a step whose results came from the step result
+# cache (see cache.py), which took no time to execute
+#
+
+def write_cached_telemetry( build_dir ):
+  now  = time.time()
+  data = { 'status' : 'cached',
+           'host'   : socket.gethostname(),
+           'start'  : now,
+           'end'    : now,
+           'wall'   : 0.0 }
+  write_telemetry( build_dir, data )
+  record_step( build_dir, data )
+
+# get_runtime
+#
+# Returns the wall-clock time of the record so far (for steps that are
+# still running, up to now)
+#
+
+def get_runtime( data ):
+  if 'wall' in data:
+    return data['wall']
+  return max( time.time() - data['start'], 0 )
+
+#-------------------------------------------------------------------------
+# Sampling
+#-------------------------------------------------------------------------
+
+# tree_rss
+#
+# Returns the resident memory in bytes of the process and all of its
+# descendants, or None if /proc is not available
+#
+
+def tree_rss( pid ):
+
+  page_size = os.sysconf( 'SC_PAGE_SIZE' )
+
+  children = {}
+  rss      = {}
+
+  try:
+    pids = [ int( x ) for x in os.listdir( '/proc' ) if x.isdigit() ]
+  except OSError:
+    return None
+
+  for p in pids:
+    try:
+      with open( '/proc/{}/stat'.format( p ) ) as fd:
+        # The command name is in parentheses and may contain spaces
+        fields = fd.read().rsplit( ')', 1 )[1].split()
+    except ( OSError, IndexError ):
+      continue # the process exited
+    children.setdefault( int( fields[1] ), [] ).append( p )
+    rss[ p ] = int( fields[21] ) * page_size
+
+  total = 0
+  stack = [ pid ]
+
+  while stack:
+    p = stack.pop()
+    total += rss.get( p, 0 )
+    stack.extend( children.get( p, [] ) )
+
+  return total
+
+# maxrss_bytes
+#
+# Converts ru_maxrss to bytes (it is in kilobytes except on macOS)
+
+def maxrss_bytes( maxrss ):
+  return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+#-------------------------------------------------------------------------
+# run
+#-------------------------------------------------------------------------
+# Runs the command and saves its record in the build directory. Returns
+# the exit status (128 + the signal number if the command was killed).
+#
+
+def run( args, build_dir='.' ):
+
+  data = {
+    'status'  : 'running',
+    'host'    : socket.gethostname(),
+    'pid'     : os.getpid(),
+    'command' : ' '.join( args ),
+    'start'   : time.time(),
+  }
+
+  # Expected runtime from the history (e.g., for the time left)
+
+  est = lookup_estimate( build_dir + '/configure.yml',
+                         os.path.dirname( os.path.abspath( build_dir ) ) )
+
+  if est:
+    data.update( estimate=est[0], estimate_runs=est[1] )
+
+  write_telemetry( build_dir, data )
+
+  # Resource usage of children that exited before (e.g., from a wrapper
+  # that started this process), which is not part of the command
+
+  usage0 = resource.getrusage( resource.RUSAGE_CHILDREN )
+
+  start = time.perf_counter()
+  proc  = subprocess.Popen( args )
+
+  # Pass termination on to the command (interrupts from the terminal
+  # already reach the whole process group)
+
+  def forward( signum, frame ):
+    proc.send_signal( signum )
+
+  for signum in [ signal.SIGTERM, signal.SIGHUP ]:
+    signal.signal( signum, forward )
+
+  # Sample the memory of the process tree until the command exits
+  # (sooner at first, so that short commands get a sample as well)
+
+  max_rss  = None
+  timeout  = 0.05
+  interval = get_sample_interval()
+
+  while True:
+    try:
+      proc.wait( timeout=timeout )
+      break
+    except subprocess.TimeoutExpired:
+      timeout = min( timeout * 2, interval )
+    rss = tree_rss( proc.pid )
+    if rss:
+      max_rss = max( max_rss or 0, rss )
+
+  wall  = time.perf_counter() - start
+  usage = resource.getrusage( resource.RUSAGE_CHILDREN )
+
+  # The peak of the largest process only counts if it is above the peak
+  # of this process (a child starts as a copy of this process, and the
+  # peak carries over when it executes the command)
+
+  own_peak = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+
+  if usage.ru_maxrss > max( usage0.ru_maxrss, own_peak ):
+    max_rss = max( max_rss or 0, maxrss_bytes( usage.ru_maxrss ) )
+
+  returncode = proc.returncode
+  if returncode < 0:
+    returncode = 128 - returncode
+
+  data.update( {
+    'status'      : 'done' if returncode == 0 else 'failed',
+    'end'         : time.time(),
+    'wall'        : wall,
+    'user'        : usage.ru_utime   - usage0.ru_utime,
+    'sys'         : usage.ru_stime   - usage0.ru_stime,
+    'max_rss'     : max_rss,
+    'read_bytes'  : ( usage.ru_inblock - usage0.ru_inblock ) * 512,
+    'write_bytes' : ( usage.ru_oublock - usage0.ru_oublock ) * 512,
+    'returncode'  : returncode,
+  } )
+
+  slowdown = get_regression( data )
+
+  if slowdown is not None:
+    data['slowdown'] = slowdown
+    print( 'mflowgen-telemetry: Step ran {:.0%} slower than usual'
+           ' ({} vs. {})'.format( slowdown, format_seconds( wall ),
+                                  format_seconds( data['estimate'] ) ),
+           file=sys.stderr )
+
+  write_telemetry( build_dir, data )
+  record_step( build_dir, data )
+
+  return returncode
+
+#-------------------------------------------------------------------------
+# Formatting
+#-------------------------------------------------------------------------
+
+# format_bytes
+#
+# Returns a short human-readable size (e.g., "1.5 GB")
+
+def format_bytes( n ):
+  for unit in [ 'B', 'KB', 'MB', 'GB' ]:
+    if n < 1024:
+      break
+    n /= 1024.0
+  else:
+    unit = 'TB'
+  return '{:.0f} {}'.format( n, unit ) if unit == 'B' else \
+         '{:.1f} {}'.format( n, unit )
+
+# format_rss
+#
+# Returns the peak memory of a record as a short size, or "-" if it could
+# not be measured
+
+def format_rss( max_rss ):
+  return '-' if max_rss is None else format_bytes( max_rss )
+
+# format_seconds
+#
+# Returns a short human-readable duration (e.g., "3m16s")
+
+def format_seconds( seconds ):
+  seconds = int( seconds )
+  h, m, s = seconds // 3600, ( seconds // 60 ) % 60, seconds % 60
+  if h:
+    return '{}h{:02d}m'.format( h, m )
+  if m:
+    return '{}m{:02d}s'.format( m, s )
+  return '{}s'.format( s )
+
+# describe
+#
+# Returns a one-line summary of the record for the build status (e.g.,
+# "[3m16s, 3.8 cpus, 2.1 GB]" or "(running for 5m02s on host, about
+# 1m10s left)")
+#
+
+def describe( data ):
+
+  if not data:
+    return ''
+
+  runtime = format_seconds( get_runtime( data ) )
+
+  if data['status'] == 'running':
+    left = ''
+    if 'estimate' in data:
+      left = ', about {} left'.format( format_seconds(
+        max( data['estimate'] - get_runtime( data ), 0 ) ) )
+    return '(running for {}{}{})'.format( runtime,
+      ' on ' + data['host'] if 'host' in data else '', left )
+
+  if data['status'] == 'failed':
+    return '(failed with exit code {} after {})'.format(
+      data.get( 'returncode' ), runtime )
+
+  if data['status'] == 'cached':
+    return '[cached]'
+
+  info = [ runtime ]
+
+  if 'user' in data and data['wall'] > 0:
+    info.append( '{:.1f} cpus'.format(
+      ( data['user'] + data['sys'] ) / data['wall'] ) )
+
+  if 'max_rss' in data:
+    info.append( format_rss( data['max_rss'] ) )
+
+  if 'slowdown' in data:
+    info.append( '{:.0%} slower than usual'.format( data['slowdown'] ) )
+
+  return '[' + ', '.join( info ) + ']'
@@ -0,0 +1,40 @@
+#=========================================================================
+# test_broker.py
+#=========================================================================
+
+import threading
+
+from mflowgen.core.broker import Broker, serve, acquire, query_status
+
+def test_broker_scheduling():
+  b  = Broker( { 'dc': 2 } )
+  r0 = b.request( { 'dc': 2 }, '/x/0-syn' )
+  r1 = b.request( { 'dc': 1 }, '/x/1-syn' )
+  r2 = b.request( { 'dc': 1 }, '/x/2-syn' )
+  r3 = b.request( { 'dc': 1 }, '/y/0-syn' )
+  assert r0['granted'] and not r1['granted']
+  # Once build x holds a token, build y goes first
+  b.release( r0 )
+  assert r1['granted'] and r3['granted'] and not r2['granted']
+  # Higher priority goes first
+  r4 = b.request( { 'dc': 1 }, '/y/1-syn', priority=1 )
+  b.release( r1 )
+  assert r4['granted'] and not r2['granted']
+  b.release( r3 )
+  assert r2['granted']
+  # Classes without a total are not limited
+  assert b.request( { 'pt': 5 }, '/x/3-sta' )['granted']
+  assert b.status()['used'] == { 'dc': 2, 'pt': 5 }
+
+def test_broker_socket( tmpdir ):
+  path = str( tmpdir ) + '/b.sock'
+  threading.Thread( target=serve, args=( { 'dc': 1 }, path ),
+                    daemon=True ).start()
+  while query_status( path ) is None:
+    pass
+  sock = acquire( { 'dc': 1 }, '/x/0-syn', path=path )
+  assert query_status( path )['used'] == { 'dc': 1 }
+  # Closing the connection releases the tokens
+  sock.close()
+  while query_status( path )['used']['dc']:
+    pass
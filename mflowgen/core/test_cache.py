@@ -0,0 +1,42 @@
+#=========================================================================
+# test_cache.py
+#=========================================================================
+
+import os
+
+from mflowgen.core.cache import fetch, store, evict, list_entries
+from mflowgen.utils      import write_yaml
+
+def make_build_dir( tmpdir, name, src ):
+  d = str( tmpdir ) + '/' + name
+  os.makedirs( d + '/outputs' )
+  write_yaml( data = { 'name': 'foo', 'build_dir': name, 'source': src,
+                       'commands': [ 'echo 1 > outputs/x.txt' ] },
+              path = d + '/configure.yml' )
+  return d
+
+def test_cache_store_and_fetch( tmpdir, monkeypatch ):
+  monkeypatch.setenv( 'MFLOWGEN_CACHE', str( tmpdir ) + '/cache' )
+  src = str( tmpdir.mkdir( 'src' ) )
+  # Miss, execute, and store
+  d0 = make_build_dir( tmpdir, '0-foo', src )
+  assert fetch( d0 ) is None
+  with open( d0 + '/outputs/x.txt', 'w' ) as fd:
+    fd.write( '1\n' )
+  assert store( d0 )
+  # Another build of the same step hits (build_dir does not matter)
+  d1 = make_build_dir( tmpdir, '3-foo', src )
+  assert fetch( d1 )
+  with open( d1 + '/outputs/x.txt' ) as fd:
+    assert fd.read() == '1\n'
+  assert not store( d1 )
+  # Changing the template directory misses
+  with open( src + '/script.sh', 'w' ) as fd:
+    fd.write( 'echo\n' )
+  d2 = make_build_dir( tmpdir, '4-foo', src )
+  assert fetch( d2 ) is None
+  # Eviction
+  cache_dir = str( tmpdir ) + '/cache'
+  assert len( list_entries( cache_dir ) ) == 1
+  assert len( evict( cache_dir, 0 ) ) == 1
+  assert list_entries( cache_dir ) == []
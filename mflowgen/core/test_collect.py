@@ -0,0 +1,23 @@
+#=========================================================================
+# test_collect.py
+#=========================================================================
+
+import os
+
+from mflowgen.core.collect import collect_inputs, render_manifest
+
+def test_collect_inputs( tmpdir, monkeypatch ):
+  monkeypatch.chdir( tmpdir )
+  os.makedirs( '0-a/outputs' )
+  os.makedirs( '1-b/outputs' )
+  with open( 'manifest.json', 'w' ) as fd:
+    fd.write( render_manifest( '2-c/inputs/.stamp', [
+      { 'dst': '2-c/inputs/x', 'src': '0-a/outputs/x' },
+      { 'dst': '2-c/inputs/y', 'src': '0-a/outputs/y' } ] ) )
+  collect_inputs( 'manifest.json' )
+  assert os.readlink( '2-c/inputs/x' ) == '../../0-a/outputs/x'
+  assert os.path.exists( '2-c/inputs/.stamp' )
+  # Rewired inputs are relinked
+  collect_inputs( { 'stamp' : '2-c/inputs/.stamp', 'inputs' : [
+      { 'dst': '2-c/inputs/x', 'src': '1-b/outputs/x' } ] } )
+  assert os.readlink( '2-c/inputs/x' ) == '../../1-b/outputs/x'
@@ -0,0 +1,47 @@
+#=========================================================================
+# test_digests.py
+#=========================================================================
+
+import os
+
+from mflowgen.core.digests import save_digests, check_digests
+from mflowgen.core.digests import invalidate_digests
+
+def make_steps( tmpdir ):
+  for d in [ '0-a/outputs', '1-b/inputs', '1-b/outputs' ]:
+    os.makedirs( str( tmpdir ) + '/' + d )
+  with open( str( tmpdir ) + '/0-a/outputs/x.txt', 'w' ) as fd:
+    fd.write( '1' )
+  os.symlink( '../../0-a/outputs/x.txt', str( tmpdir ) + '/1-b/inputs/x.txt' )
+
+def test_digests_early_cutoff( tmpdir, monkeypatch ):
+  monkeypatch.chdir( tmpdir )
+  make_steps( tmpdir )
+  x = '0-a/outputs/x.txt'
+  assert save_digests( '0-a' ) == [ 'x.txt' ]
+  assert save_digests( '1-b' ) == []
+  assert check_digests( '1-b' )
+  # Re-executing with identical output restores the previous mtime
+  mtime = os.stat( x ).st_mtime_ns
+  with open( x, 'w' ) as fd:
+    fd.write( '1' )
+  os.utime( x, ns=( mtime + 10**9, mtime + 10**9 ) )
+  assert save_digests( '0-a' ) == []
+  assert os.stat( x ).st_mtime_ns == mtime
+  assert check_digests( '1-b' )
+  # Changed content is detected downstream
+  with open( x, 'w' ) as fd:
+    fd.write( '2' )
+  assert save_digests( '0-a' ) == [ 'x.txt' ]
+  assert not check_digests( '1-b' )
+
+def test_digests_invalidate( tmpdir, monkeypatch ):
+  monkeypatch.chdir( tmpdir )
+  make_steps( tmpdir )
+  save_digests( '0-a' )
+  assert check_digests( '0-a' )
+  invalidate_digests( '0-a' )
+  assert not check_digests( '0-a' )
+  save_digests( '0-a' )
+  os.remove( '0-a/outputs/x.txt' )
+  assert not check_digests( '0-a' )
@@ -0,0 +1,74 @@
+#=========================================================================
+# test_history.py
+#=========================================================================
+
+import contextlib
+import io
+import shutil
+import sqlite3
+import subprocess
+
+import pytest
+
+from mflowgen.components   import Graph
+from mflowgen.core         import BuildOrchestrator
+from mflowgen.backends     import MakeBackend
+from mflowgen.core.history import lookup_estimate, record_step
+from mflowgen.core.history import get_regression
+
+def test_history_estimates( tmpdir, monkeypatch ):
+  monkeypatch.delenv( 'MFLOWGEN_HISTORY', raising=False )
+  tmpdir.mkdir( '.mflowgen' )
+  tmpdir.join( '.mflowgen.yml' ).write( 'construct: design/construct.py' )
+  step = tmpdir.mkdir( '3-syn' )
+  step.join( 'configure.yml' ).write( 'name: syn\nparameters:\n  x: 1\n' )
+  config = str( step.join( 'configure.yml' ) )
+  assert lookup_estimate( config, str( tmpdir ) ) is None
+  for wall, status in [ ( 10, 'done' ), ( 30, 'done' ), ( 20, 'done' ),
+                        ( 99, 'failed' ), ( 0, 'cached' ) ]:
+    assert record_step( str( step ), { 'status': status, 'wall': wall } )
+  # Median of the successful runs
+  assert lookup_estimate( config, str( tmpdir ) ) == ( 20, 3 )
+  # Runs with other parameters are only used without a better match
+  step.join( 'configure.yml' ).write( 'name: syn\nparameters:\n  x: 2\n' )
+  assert lookup_estimate( config, str( tmpdir ) ) == ( 20, 3 )
+  record_step( str( step ), { 'status': 'done', 'wall': 50 } )
+  assert lookup_estimate( config, str( tmpdir ) ) == ( 50, 1 )
+
+# make
+#
+# Runs make with the given arguments and returns the output
+
+def make( *args ):
+  proc = subprocess.run( [ 'make' ] + list( args ), stdout=subprocess.PIPE,
+                         stderr=subprocess.STDOUT, universal_newlines=True )
+  assert proc.returncode == 0, proc.stdout
+  return proc.stdout
+
+@pytest.mark.skipif( not shutil.which( 'make' ), reason='needs make' )
+def test_history_survives_clean_all( tmpdir, make_step, build_env,
+                                     monkeypatch ):
+  monkeypatch.delenv( 'MFLOWGEN_HISTORY', raising=False )
+  tmpdir.mkdir( 'build' ).chdir()
+  g = Graph()
+  g.add_step( make_step( 'foo', outputs=[ 'a' ],
+                         commands=[ 'echo 1 > outputs/a' ] ) )
+  with contextlib.redirect_stdout( io.StringIO() ):
+    BuildOrchestrator( g, MakeBackend ).build()
+  make()
+  db = tmpdir.join( 'build', '.mflowgen', 'history.db' )
+  def runs():
+    with contextlib.closing( sqlite3.connect( str( db ) ) ) as conn:
+      return conn.execute( 'SELECT step, status FROM runs' ).fetchall()
+  assert runs() == [ ( 'foo', 'done' ) ]
+  # Only the build directories are removed
+  make( 'clean-all' )
+  assert not tmpdir.join( 'build', '0-foo' ).check()
+  assert db.check() and runs() == [ ( 'foo', 'done' ) ]
+
+def test_history_regression():
+  data = { 'status': 'done', 'wall': 100, 'estimate': 40,
+           'estimate_runs': 3 }
+  assert abs( get_regression( data ) - 1.5 ) < 1e-9
+  assert get_regression( dict( data, wall=50 ) ) is None
+  assert get_regression( dict( data, estimate_runs=1 ) ) is None
@@ -0,0 +1,31 @@
+#=========================================================================
+# test_profiler.py
+#=========================================================================
+
+import threading
+
+from mflowgen.core.profiler import Profiler
+
+class Foo:
+  def bar( s, n ):
+    return [ 0 ] * n
+
+def test_profiler_phases():
+  p = Profiler()
+  p.instrument( Foo, 'bar' )
+  p.start()
+  with p.phase( 'outer' ):
+    Foo().bar( 10**6 )
+    Foo().bar( 1 )
+    t = threading.Thread( target=Foo().bar, args=( 1, ) )
+    t.start()
+    t.join()
+  p.stop()
+  rows = { x[0]: x[1:] for x in p.report() }
+  # Calls from other threads nest under the phase of the main thread
+  assert rows[ 'outer / bar' ][0] == 3
+  assert rows[ 'outer' ][1] >= rows[ 'outer / bar' ][1] * 0.5
+  # The list of a million entries is at least 8 MB
+  assert rows[ 'outer' ][3] > 7
+  # Instrumented functions are restored
+  assert 'bar' in vars( Foo ) and not hasattr( Foo.bar, '__wrapped__' )
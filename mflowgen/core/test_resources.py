@@ -0,0 +1,39 @@
+#=========================================================================
+# test_resources.py
+#=========================================================================
+
+import os
+
+from mflowgen.core.resources import normalize_resources, flatten, clamp
+from mflowgen.core.resources import get_pools, get_jobserver
+from mflowgen.core.resources import try_allocate, release
+
+limits = { 'cpus': 8, 'mem_gb': 64, 'licenses': { 'dc': 2 } }
+
+def test_resources_pools():
+  resources = {
+    'syn'  : normalize_resources( { 'cpus': 4, 'licenses': { 'dc': 1 } } ),
+    'fill' : normalize_resources( { 'cpus': '8', 'mem_gb': 16 } ),
+    'lint' : normalize_resources( {} ),
+  }
+  pools, assign = get_pools( resources, limits )
+  # Synthesis needs half the cpus and half the dc licenses (ties go to
+  # cpus), and fill needs all cpus, so only one of them runs at a time
+  assert assign == { 'syn': 'cpus', 'fill': 'cpus' }
+  assert pools  == { 'cpus': 1 }
+  # A step that needs more than the total can still run alone
+  assert clamp( flatten( normalize_resources( { 'cpus': 32 } ) ),
+                limits )['cpus'] == 8
+
+def test_resources_allocate( tmpdir ):
+  state = str( tmpdir ) + '/state'
+  need  = { 'cpus': 6, 'mem_gb': 0, 'license:dc': 1 }
+  assert try_allocate( state, need, limits, pid=os.getpid() )
+  # Not enough cpus left for another one
+  assert not try_allocate( state, need, limits, pid=os.getppid() )
+  release( state, pid=os.getpid() )
+  assert try_allocate( state, need, limits, pid=os.getppid() )
+
+def test_resources_no_jobserver():
+  assert get_jobserver( '' ) is None
+  assert get_jobserver( '-j4 --jobserver-auth=fifo:/nonexistent' ) is None
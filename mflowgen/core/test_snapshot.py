@@ -0,0 +1,27 @@
+#=========================================================================
+# test_snapshot.py
+#=========================================================================
+
+from mflowgen.components import Graph
+from mflowgen.core.snapshot import dump_graph, save_snapshot, load_snapshot
+from mflowgen.core.snapshot import get_graph_files
+
+def make_graph( make_step ):
+  g = Graph()
+  g.add_step( make_step( 'foo', outputs=[ 'a' ] ) )
+  g.add_step( make_step( 'bar', inputs=[ 'a' ] ) )
+  g.connect_by_name( 'foo', 'bar' )
+  return g
+
+def test_snapshot_roundtrip_and_invalidation( tmpdir, make_step ):
+  g     = make_graph( make_step )
+  files = get_graph_files( g )
+  mdir  = str( tmpdir.mkdir( '.mflowgen' ) )
+  save_snapshot( mdir, dump_graph( g ), files, { 'foo': '0', 'bar': '1' } )
+  h = load_snapshot( mdir )
+  assert h.topological_sort() == [ 'foo', 'bar' ]
+  assert [ e.get_src() for e in h.get_edges_i( 'bar' ) ] == [ ( 'foo', 'a' ) ]
+  # Editing any configure.yml invalidates the snapshot
+  with open( files[0], 'a' ) as fd:
+    fd.write( '\n# edit\n' )
+  assert load_snapshot( mdir ) is None
@@ -0,0 +1,56 @@
+#=========================================================================
+# test_status.py
+#=========================================================================
+
+import os
+import socket
+
+from mflowgen.core.status    import get_status
+from mflowgen.core.telemetry import write_telemetry
+
+def make_step( tmpdir, build_dir, upstream=None ):
+  config = 'name: {}\n'.format( build_dir.split('-')[1] )
+  if upstream:
+    config += 'edges_i:\n  x:\n  - f: x\n    step: {}\n'.format( upstream )
+  tmpdir.join( '.mflowgen', build_dir ).ensure( dir=True )
+  tmpdir.join( '.mflowgen', build_dir, 'configure.yml' ).write( config )
+
+def test_status( tmpdir, monkeypatch ):
+  monkeypatch.chdir( tmpdir )
+  make_step( tmpdir, '0-a' )
+  make_step( tmpdir, '1-b', upstream='0-a' )
+  make_step( tmpdir, '10-c', upstream='1-b' )
+
+  def status():
+    data = get_status()
+    return [ ( x['status'], x['reason'] ) for x in data['steps'] ]
+
+  assert status() == [ ( 'stale', 'never built' ),
+                       ( 'stale', 'never built' ),
+                       ( 'stale', 'never built' ) ]
+
+  # Finished steps are done (by timestamps without a digest manifest)
+
+  for d in [ '0-a', '1-b', '10-c' ]:
+    tmpdir.join( d, '.execstamp' ).ensure()
+    tmpdir.join( d, '.postconditions.stamp' ).ensure()
+
+  assert [ x[0] for x in status() ] == [ 'done' ] * 3
+
+  # Failures and interrupted runs stop everything downstream
+
+  write_telemetry( '1-b', { 'status': 'failed', 'returncode': 2 } )
+  assert status()[1:] == [ ( 'failed', 'exit code 2' ),
+                           ( 'stale', 'upstream 1-b is failed' ) ]
+
+  write_telemetry( '1-b', { 'status': 'running', 'start': 0,
+                            'host': socket.gethostname(),
+                            'pid': os.getpid() } )
+  assert status()[1][0] == 'running'
+
+  data = get_status()
+  assert data['order'] == [ '1-b', '10-c' ]
+  assert data['counts'][ 'done' ] == 1
+
+  tmpdir.join( '0-a', '.prebuilt' ).ensure()
+  assert status()[0] == ( 'prebuilt', None )
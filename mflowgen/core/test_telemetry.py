@@ -0,0 +1,33 @@
+#=========================================================================
+# test_telemetry.py
+#=========================================================================
+
+import sys
+
+from mflowgen.core.telemetry import run, read_telemetry, describe
+
+def test_telemetry_run( tmpdir ):
+  d = str( tmpdir )
+  command = 'x = bytearray( 64 * 2**20 ); x[::4096] = b"1" * len( x[::4096] )'
+  assert run( [ sys.executable, '-c', command ], d ) == 0
+  data = read_telemetry( d )
+  assert data[ 'status' ] == 'done' and data[ 'returncode' ] == 0
+  assert data[ 'max_rss' ] >= 64 * 2**20
+  assert data[ 'user' ] + data[ 'sys' ] > 0
+  assert describe( data ).startswith( '[0s' )
+  # Failures and signals
+  assert run( [ 'sh', '-c', 'exit 3' ], d ) == 3
+  assert run( [ 'sh', '-c', 'kill -9 $$' ], d ) == 128 + 9
+  assert read_telemetry( d )[ 'status' ] == 'failed'
+
+def test_telemetry_legacy_timestamps( tmpdir ):
+  tmpdir.join( '.time_start' ).write( '2020-0102-0304-05\n' )
+  assert read_telemetry( str( tmpdir ) )[ 'status' ] == 'running'
+  tmpdir.join( '.time_end' ).write( '2020-0102-0404-05\n' )
+  assert read_telemetry( str( tmpdir ) )[ 'wall' ] == 3600
+  assert read_telemetry( str( tmpdir.mkdir( 'x' ) ) ) is None
+
+def test_telemetry_no_rss():
+  data = { 'status': 'done', 'start': 0, 'end': 3, 'wall': 3,
+           'user': 0, 'sys': 0, 'max_rss': None }
+  assert describe( data ) == '[3s, 0.0 cpus, -]'
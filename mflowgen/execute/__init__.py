@@ -0,0 +1,2 @@
+from mflowgen.execute.execute_handler import ExecuteHandler
+from mflowgen.execute.executor        import Executor
@@ -0,0 +1,139 @@
+#=========================================================================
+# execute_handler.py
+#=========================================================================
+# Handler for "mflowgen execute", which runs the graph of an existing
+# build with the native executor instead of make or ninja
+#
+
+import contextlib
+import io
+import json
+import sys
+
+from mflowgen.backends         import ExecBackend
+from mflowgen.core             import BuildOrchestrator
+from mflowgen.core.snapshot    import load_snapshot
+from mflowgen.execute.executor import Executor
+from mflowgen.utils            import bold, red
+
+class ExecuteHandler:
+
+  def __init__( s ):
+    pass
+
+  #-----------------------------------------------------------------------
+  # launch
+  #-----------------------------------------------------------------------
+  # Dispatch function for commands
+  #
+
+  def launch( s, args, help_, jobs=None, keep_going=False, events=None ):
+
+    if help_:
+      s.launch_help()
+      return
+
+    s.launch_execute( args, jobs or 1, keep_going, events )
+
+  #-----------------------------------------------------------------------
+  # launch_help
+  #-----------------------------------------------------------------------
+
+  def launch_help( s ):
+    print()
+    print( bold( 'Usage:' ), 'mflowgen execute [<step> ...]',
+                             '[--jobs/-j <n>] [--keep-going/-k]',
+                             '[--events <file>]' )
+    print()
+    print( 'Runs the given steps (step names or build IDs) and everything' )
+    print( 'they depend on without make or ninja. With no steps given,' )
+    print( 'the whole graph runs. Run this from a build directory that' )
+    print( 'was set up with "mflowgen run".' )
+    print()
+    print( '  --jobs/-j       Number of stages to run in parallel'         )
+    print( '  --keep-going/-k Keep running other stages after a failure'   )
+    print( '  --events        Append JSON events for every stage to a file')
+    print()
+
+  #-----------------------------------------------------------------------
+  # load_orchestrator
+  #-----------------------------------------------------------------------
+  # Loads the graph snapshot of the build in the current directory and
+  # collects the rules of each step. The snapshot must be up to date, so
+  # that the executor runs exactly what "mflowgen run" generated.
+  #
+
+  def load_orchestrator( s ):
+
+    g = load_snapshot( '.mflowgen' )
+
+    if g is None:
+      print()
+      print( bold( 'Error:' ), 'No up-to-date build in the current',
+                               'directory. Run "mflowgen run --update"',
+                               'first.' )
+      print()
+      sys.exit( 1 )
+
+    b = BuildOrchestrator( g, ExecBackend )
+
+    with contextlib.redirect_stdout( io.StringIO() ):
+      b.build()
+
+    return b
+
+  #-----------------------------------------------------------------------
+  # launch_execute
+  #-----------------------------------------------------------------------
+
+  def launch_execute( s, targets, jobs, keep_going, events ):
+
+    b = s.load_orchestrator()
+    e = Executor( b, jobs=jobs, keep_going=keep_going )
+
+    e.listeners.append( s.print_event )
+
+    if events:
+      events_fd = open( events, 'a' )
+      e.listeners.append(
+        lambda data: print( json.dumps( data ), file=events_fd, flush=True )
+      )
+
+    try:
+      e.run( targets )
+    except AssertionError as err:
+      print()
+      print( bold( 'Error:' ), err )
+      print()
+      sys.exit( 1 )
+    finally:
+      if events:
+        events_fd.close()
+
+    # Summary
+
+    print()
+    print( bold( 'Executed:' ), ', '.join( e.executed ) or '(nothing)' )
+
+    if e.failed:
+      print( bold( 'Failed:' ),
+             ', '.join( '{} ({})'.format( *x ) for x in e.failed ) )
+      print()
+      sys.exit( 1 )
+
+    print()
+
+  # print_event
+  #
+  # Prints failures (the stages print their own output)
+  #
+
+  def print_event( s, data ):
+    if data['event'] == 'fail':
+      msg = 'Stage "{}" of step "{}" failed'.format( data['stage'],
+                                                     data['step'] )
+      if 'returncode' in data:
+        msg += ' with exit code {}'.format( data['returncode'] )
+      if 'error' in data:
+        msg += ': ' + data['error']
+      print( red( msg ) )
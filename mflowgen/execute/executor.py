@@ -0,0 +1,490 @@
+#=========================================================================
+# executor.py
+#=========================================================================
+# Native executor that runs a graph without make or ninja
+#
+# The executor consumes the rules and dependencies that the
+# BuildOrchestrator collects for each stage of each step (see
+# get_all_rules and get_all_deps) and schedules the stages with asyncio:
+#
+# - directory       -- Copy (or symlink) the step template directory
+# - collect-inputs  -- Symlink the outputs of other steps to the inputs
+# - execute         -- Run the commands for the step
+# - collect-outputs -- Symlink tagged outputs to the outputs directory
+# - post-conditions -- Run the postcondition checker
+# - alias           -- Marks the step as done
+#
+# Each stage starts as soon as the stages it depends on are done, and at
+# most "jobs" subprocesses run at the same time. Steps that declare
+# resources (see resources.py) also wait to execute until the resources
+# are free, so they never run together beyond the limits of the graph.
+#
+# The executor shares stamps and content digests with the make backend,
+# so builds can switch between "make" and "mflowgen execute" at any time:
+#
+# - directory runs if the directory stamp is missing, or if an upstream
+#   step executed in this run and the inputs changed by content
+# - execute runs if the step is not up to date by content (see digests.py)
+# - post-conditions run if the step executed in this run or if they never
+#   passed before
+#
+# Every stage emits structured events (dicts) to the listeners:
+#
+#   { 'time'  : <seconds since epoch>,
+#     'step'  : <step name>,
+#     'stage' : <stage name>,
+#     'event' : 'start' | 'finish' | 'skip' | 'fail' | 'blocked' | 'wait',
+#     ... additional data (e.g., 'command', 'returncode', 'elapsed') }
+#
+
+import asyncio
+import os
+import time
+
+from mflowgen.core.collect import collect_inputs
+from mflowgen.core.digests import check_digests, save_digests
+from mflowgen.core.digests import invalidate_digests
+from mflowgen.core.resources import get_host_limits, is_default
+from mflowgen.core.resources import flatten, clamp, fits, add, describe
+
+class Executor:
+
+  # Stages of each step in execution order
+
+  stages = [
+    'directory',
+    'collect-inputs',
+    'execute',
+    'collect-outputs',
+    'post-conditions',
+    'alias',
+  ]
+
+  def __init__( s, orchestrator, jobs=1, keep_going=False ):
+
+    s.b     = orchestrator
+    s.rules = orchestrator.get_all_rules()
+    s.deps  = orchestrator.get_all_deps()
+
+    # Maximum number of subprocesses at the same time
+
+    s.jobs = jobs
+
+    # Keep starting new stages after a stage fails
+
+    s.keep_going = keep_going
+
+    # Totals of the resources that steps declare
+
+    s.limits = get_host_limits( orchestrator.resource_limits )
+
+    # Shell for running commands (same as the make backend)
+
+    s.shell_cmd = [ 'bash', '-euo', 'pipefail', '-c' ]
+
+    # Callables that receive every event
+
+    s.listeners = []
+
+    # Stages that did work in this run (e.g., a step that executed)
+
+    s.ran = set()
+
+    # Results
+
+    s.failed   = []
+    s.executed = []
+
+  #-----------------------------------------------------------------------
+  # Targets
+  #-----------------------------------------------------------------------
+
+  # resolve_targets
+  #
+  # Returns the step names for the given targets, which can be step names
+  # or build IDs. No targets means all steps.
+  #
+
+  def resolve_targets( s, targets ):
+
+    if not targets:
+      return list( s.b.get_order() )
+
+    ids = { v: k for k, v in s.b.build_ids.items() }
+
+    steps = []
+
+    for t in targets:
+      t = str( t )
+      step_name = t if t in s.rules else ids.get( t )
+      assert step_name, 'Unknown target "{}"'.format( t )
+      steps.append( step_name )
+
+    return steps
+
+  # needed_nodes
+  #
+  # Returns the set of ( step, stage ) nodes that the steps depend on
+  #
+
+  def needed_nodes( s, steps ):
+
+    needed = set()
+    stack  = [ ( step_name, 'alias' ) for step_name in steps ]
+
+    while stack:
+      node = stack.pop()
+      if node in needed:
+        continue
+      needed.add( node )
+      step_name, stage = node
+      stack.extend( s.deps[ step_name ][ stage ] )
+
+    return needed
+
+  #-----------------------------------------------------------------------
+  # Events
+  #-----------------------------------------------------------------------
+
+  def emit( s, node, event, **kwargs ):
+    data = {
+      'time'  : time.time(),
+      'step'  : node[0],
+      'stage' : node[1],
+      'event' : event,
+    }
+    data.update( kwargs )
+    for f in s.listeners:
+      f( data )
+
+  #-----------------------------------------------------------------------
+  # Running
+  #-----------------------------------------------------------------------
+
+  # run
+  #
+  # Runs the stages needed for the targets and returns True on success
+  #
+
+  def run( s, targets=None ):
+
+    # Runs on a new event loop that is set for this thread, since child
+    # processes need the loop of the thread on Python 3.6 (which does not
+    # have asyncio.run)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop( loop )
+
+    try:
+      return loop.run_until_complete(
+               s.run_async( s.resolve_targets( targets ) ) )
+    finally:
+      asyncio.set_event_loop( None )
+      loop.close()
+
+  async def run_async( s, steps ):
+
+    s.needed  = s.needed_nodes( steps )
+    s.sem     = asyncio.Semaphore( s.jobs )
+    s.tasks   = {}
+    s.stopped = False
+    s.cond    = asyncio.Condition()
+    s.used    = {}
+
+    await asyncio.gather( *[ s.get_task( node ) for node in
+                             sorted( s.needed ) ] )
+
+    return not s.failed
+
+  # get_task
+  #
+  # Returns the task for the node (creating it on first use)
+  #
+
+  def get_task( s, node ):
+    if node not in s.tasks:
+      s.tasks[ node ] = asyncio.ensure_future( s.run_node( node ) )
+    return s.tasks[ node ]
+
+  # run_node
+  #
+  # Waits for the dependencies of the node and then runs its stage.
+  # Returns True if the stage is done.
+  #
+
+  async def run_node( s, node ):
+
+    step_name, stage = node
+
+    deps = s.deps[ step_name ][ stage ]
+    oks  = await asyncio.gather( *[ s.get_task( d ) for d in deps ] )
+
+    if not all( oks ) or s.stopped:
+      s.emit( node, 'blocked' )
+      return False
+
+    handler = getattr( s, 'run_' + stage.replace( '-', '_' ) )
+
+    try:
+      ok = await handler( step_name )
+    except Exception as e:
+      s.emit( node, 'fail', error=str( e ) )
+      ok = False
+
+    if not ok:
+      s.failed.append( node )
+      if not s.keep_going:
+        s.stopped = True
+
+    return ok
+
+  # shell
+  #
+  # Runs the command in a subprocess (limited by the job limit) and
+  # returns True if it succeeded
+  #
+
+  async def shell( s, node, command ):
+
+    async with s.sem:
+
+      start = time.time()
+      s.emit( node, 'start', command=command )
+
+      proc = await asyncio.create_subprocess_exec(
+               *s.shell_cmd, command )
+      returncode = await proc.wait()
+
+      elapsed = time.time() - start
+
+    if returncode == 0:
+      s.emit( node, 'finish', returncode=returncode, elapsed=elapsed )
+    else:
+      s.emit( node, 'fail',   returncode=returncode, elapsed=elapsed )
+
+    return returncode == 0
+
+  # acquire
+  #
+  # Waits until the flattened need fits next to the resources in use and
+  # takes it
+  #
+
+  async def acquire( s, node, need ):
+    async with s.cond:
+      if not fits( need, s.used, s.limits ):
+        s.emit( node, 'wait', resources=describe( need ) )
+      await s.cond.wait_for( lambda: fits( need, s.used, s.limits ) )
+      add( s.used, need )
+
+  # release
+
+  async def release( s, need ):
+    async with s.cond:
+      add( s.used, need, -1 )
+      s.cond.notify_all()
+
+  #-----------------------------------------------------------------------
+  # Helpers
+  #-----------------------------------------------------------------------
+
+  def build_dir( s, step_name ):
+    return s.b.get_build_dir( step_name )
+
+  def is_prebuilt( s, step_name ):
+    return os.path.exists( s.build_dir( step_name ) + '/.prebuilt' )
+
+  # symlink
+  #
+  # Symlinks the src to the dst (relative to the directory of the dst) and
+  # stamps the dst, like the symlink rules of the make backend
+  #
+
+  def symlink( s, dst, src ):
+    dst_dir = os.path.dirname( dst )
+    os.makedirs( dst_dir, exist_ok=True )
+    if os.path.lexists( dst ):
+      os.remove( dst )
+    os.symlink( os.path.relpath( src, dst_dir ), dst )
+    with open( dst_dir + '/.stamp.' + os.path.basename( dst ), 'w' ):
+      pass
+
+  # touch
+
+  def touch( s, path ):
+    with open( path, 'a' ):
+      os.utime( path, None )
+
+  #-----------------------------------------------------------------------
+  # Stages
+  #-----------------------------------------------------------------------
+
+  # run_directory
+
+  async def run_directory( s, step_name ):
+
+    node = ( step_name, 'directory' )
+    rule = s.rules[ step_name ][ 'directory' ]
+    dst  = rule[ 'dst' ]
+    src  = rule[ 'src' ]
+
+    if s.is_prebuilt( step_name ):
+      s.emit( node, 'skip', reason='prebuilt' )
+      return True
+
+    upstream_ran = any( d in s.ran for d in s.deps[ step_name ][ 'directory' ] )
+
+    if os.path.exists( dst + '/.stamp' ) and \
+        ( not upstream_ran or check_digests( dst ) ):
+      s.emit( node, 'skip', reason='up to date' )
+      return True
+
+    configure_yml = s.b.metadata_dir + '/' + dst + '/configure.yml'
+
+    # Instantiate the directory like the make rules for each sandbox mode
+    # (see makefile_syntax.make_common_rules)
+
+    mode = rule[ 'sandbox' ]
+
+    if mode == 'symlink':
+      instantiate = [
+        'mkdir -p ' + dst,
+        'ln -sf {}/* {}'.format( os.path.relpath( src, dst ), dst ),
+      ]
+    elif mode == 'hardlink':
+      instantiate = [
+        '{{ cp -alL {0} {1} 2>/dev/null || '
+        '{{ rm -rf ./{1}; cp -aL {0} {1} || true; }}; }}'.format( src, dst ),
+        'find {} -type d -exec chmod +w {{}} +'.format( dst ),
+      ]
+    elif mode == 'reflink':
+      instantiate = [
+        '{{ cp -aL --reflink=auto {} {} || true; }}'.format( src, dst ),
+        'chmod -R +w ' + dst,
+      ]
+    elif mode == 'symlink-farm':
+      instantiate = [
+        '{{ cp -sRL {} {} || true; }}'.format( os.path.abspath( src ), dst ),
+        'find {} -type d -exec chmod +w {{}} +'.format( dst ),
+      ]
+    else:
+      instantiate = [
+        '{{ cp -aL {} {} || true; }}'.format( src, dst ),
+        'chmod -R +w ' + dst,
+      ]
+
+    commands = [ 'rm -rf ./' + dst ] + instantiate + [
+      'rm -f {}/configure.yml'.format( dst ),
+      'cp {} {}'.format( configure_yml, dst ),
+      'touch ' + dst + '/.stamp',
+    ]
+
+    ok = await s.shell( node, ' && '.join( commands ) )
+
+    if ok:
+      s.ran.add( node )
+
+    return ok
+
+  # run_collect_inputs
+
+  async def run_collect_inputs( s, step_name ):
+
+    node = ( step_name, 'collect-inputs' )
+
+    if s.is_prebuilt( step_name ):
+      s.emit( node, 'skip', reason='prebuilt' )
+      return True
+
+    rule = s.rules[ step_name ][ 'collect-inputs' ]
+
+    if rule[ 'inputs' ]:
+      collect_inputs( rule )
+
+    s.emit( node, 'finish' )
+
+    return True
+
+  # run_execute
+
+  async def run_execute( s, step_name ):
+
+    node      = ( step_name, 'execute' )
+    rule      = s.rules[ step_name ][ 'execute' ]
+    build_dir = s.build_dir( step_name )
+
+    if s.is_prebuilt( step_name ):
+      s.emit( node, 'skip', reason='prebuilt' )
+      return True
+
+    if ( step_name, 'directory' ) not in s.ran and \
+        check_digests( build_dir ):
+      s.emit( node, 'skip', reason='up to date' )
+      return True
+
+    os.makedirs( build_dir + '/outputs', exist_ok=True )
+    invalidate_digests( build_dir )
+
+    # Only steps that declare resources are accounted for (like with the
+    # make and ninja backends), so other steps are limited by jobs only
+
+    need = {}
+
+    if not is_default( rule[ 'resources' ] ):
+      need = clamp( flatten( rule[ 'resources' ] ), s.limits )
+
+    await s.acquire( node, need )
+
+    try:
+      ok = await s.shell( node, rule[ 'command' ] )
+    finally:
+      await s.release( need )
+
+    if ok:
+      changed = save_digests( build_dir )
+      s.touch( build_dir + '/.execstamp' )
+      s.ran.add( node )
+      s.executed.append( step_name )
+      # Downstream steps only need to rebuild if an output changed
+      if changed:
+        s.ran.add( ( step_name, 'alias' ) )
+
+    return ok
+
+  # run_collect_outputs
+
+  async def run_collect_outputs( s, step_name ):
+
+    node = ( step_name, 'collect-outputs' )
+
+    for rule in s.rules[ step_name ][ 'collect-outputs' ][ 'tagged' ]:
+      s.symlink( rule[ 'dst' ], rule[ 'src' ] )
+
+    s.emit( node, 'finish' )
+
+    return True
+
+  # run_post_conditions
+
+  async def run_post_conditions( s, step_name ):
+
+    node  = ( step_name, 'post-conditions' )
+    rule  = s.rules[ step_name ][ 'post-conditions' ]
+    stamp = s.build_dir( step_name ) + '/.postconditions.stamp'
+
+    if ( step_name, 'execute' ) not in s.ran and os.path.exists( stamp ):
+      s.emit( node, 'skip', reason='up to date' )
+      return True
+
+    ok = await s.shell( node, rule[ 'command' ] )
+
+    if ok:
+      s.touch( stamp )
+
+    return ok
+
+  # run_alias
+
+  async def run_alias( s, step_name ):
+    s.emit( ( step_name, 'alias' ), 'finish' )
+    return True
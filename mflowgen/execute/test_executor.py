@@ -0,0 +1,72 @@
+#=========================================================================
+# test_executor.py
+#=========================================================================
+
+import contextlib
+import io
+import os
+
+from mflowgen.backends   import ExecBackend
+from mflowgen.components import Graph
+from mflowgen.core       import BuildOrchestrator
+from mflowgen.execute    import Executor
+
+def make_executor( make_step, parent, fail=False, sandbox=True ):
+  parent.mkdir( 'build' ).chdir()
+  g = Graph()
+  for name, inputs, outputs, command in [
+      ( 'foo', [],      [ 'a' ], 'echo 1 > outputs/a' ),
+      ( 'bar', [ 'a' ], [ 'b' ], 'cat inputs/a > outputs/b' ),
+      ( 'baz', [ 'b' ], [],      'false' if fail else 'cat inputs/b' ) ]:
+    step = make_step( name, parent, inputs=inputs, outputs=outputs,
+                      commands=[ command ] )
+    step.set_sandbox( sandbox )
+    g.add_step( step )
+  g.connect_by_name( 'foo', 'bar' )
+  g.connect_by_name( 'bar', 'baz' )
+
+  b = BuildOrchestrator( g, ExecBackend )
+  with contextlib.redirect_stdout( io.StringIO() ):
+    b.build()
+  return b
+
+def test_executor_runs_and_skips( tmpdir, make_step, build_env ):
+  b = make_executor( make_step, tmpdir )
+  e = Executor( b, jobs=2 )
+  events = []
+  e.listeners.append( events.append )
+  assert e.run()
+  assert e.executed == [ 'foo', 'bar', 'baz' ]
+  with open( b.get_build_dir( 'bar' ) + '/outputs/b' ) as fd:
+    assert fd.read() == '1\n'
+  assert ( 'bar', 'execute', 'finish' ) in \
+           [ ( x['step'], x['stage'], x['event'] ) for x in events ]
+  # Nothing runs again since nothing changed
+  e = Executor( b )
+  assert e.run( [ 'baz' ] )
+  assert e.executed == []
+
+def test_executor_failure_blocks_downstream( tmpdir, make_step, build_env ):
+  b = make_executor( make_step, tmpdir, fail=True )
+  e = Executor( b )
+  events = []
+  e.listeners.append( events.append )
+  assert not e.run()
+  assert e.failed == [ ( 'baz', 'execute' ) ]
+  assert ( 'baz', 'post-conditions', 'blocked' ) in \
+           [ ( x['step'], x['stage'], x['event'] ) for x in events ]
+
+def test_executor_sandbox_modes( tmpdir, make_step, build_env ):
+  for mode in [ 'hardlink', 'reflink', 'symlink-farm' ]:
+    b   = make_executor( make_step, tmpdir.mkdir( mode ), sandbox=mode )
+    src = str( tmpdir ) + '/' + mode + '/foo'
+    dst = b.get_build_dir( 'foo' )
+    with open( src + '/data', 'w' ) as fd:
+      fd.write( 'data' )
+    assert Executor( b ).run()
+    assert os.path.samefile( src + '/data', dst + '/data' ) == \
+             ( mode != 'reflink' )
+    assert os.path.islink( dst + '/data' ) == ( mode == 'symlink-farm' )
+    # The configure.yml is always a private copy
+    assert not os.path.samefile( src + '/configure.yml',
+                                 dst + '/configure.yml' )
@@ -0,0 +1,3 @@
+from mflowgen.monitor.monitor_handler import MonitorHandler
+from mflowgen.monitor.monitor         import BuildMonitor, LogTail
+from mflowgen.monitor.monitor         import make_server
@@ -0,0 +1,357 @@
+#=========================================================================
+# monitor.py
+#=========================================================================
+# Live build monitor for "mflowgen monitor"
+#
+# The monitor polls the build in the current directory and serves its
+# state over HTTP while the build runs (with make, ninja, or "mflowgen
+# execute"):
+#
+# - The status of every step comes from the native status engine (see
+#   mflowgen/core/status.py), so the build tool never runs a dry run.
+#   It is refreshed every few seconds.
+# - The log (mflowgen-run.log) of every running or failed step is tailed
+#   every second. Only the bytes appended since the last poll are read,
+#   and only the last lines are kept in a bounded ring buffer per step,
+#   so the monitor stays cheap with hundreds of steps running at once.
+#
+# All requests are served from the last snapshot in memory, so the
+# number of clients does not add any work on the build directories.
+#
+# The server has these endpoints:
+#
+# - /                      : Page that shows the state of the build
+# - /api/status            : The status (see status.py) as JSON, with a
+#                            one-line 'summary' of the last run of each
+#                            step (see telemetry.describe)
+# - /api/logs              : The log tails of all tailed steps
+# - /api/logs/<build_dir>  : The log tail of one step. With "?since=<seq>",
+#                            only the lines after the given sequence
+#                            number are returned.
+#
+# Each log tail is { 'seq' : number of lines read so far, 'lines' : [...] },
+# so clients can poll for new lines with the last sequence number.
+#
+# Build directories are polled instead of watched with inotify, since
+# inotify is not available on every platform and not in the standard
+# library, and builds often live on network filesystems where it does
+# not see changes from other hosts.
+#
+
+import collections
+import http.server
+import json
+import os
+import socketserver
+import threading
+import time
+import urllib.parse
+
+from mflowgen.core.status    import get_status
+from mflowgen.core.telemetry import describe
+
+#-------------------------------------------------------------------------
+# LogTail
+#-------------------------------------------------------------------------
+# Follows a log file and keeps its last lines. A log that is truncated or
+# replaced (e.g., when a step runs again) is followed from the start.
+#
+
+class LogTail:
+
+  # Most bytes read from a log that has not been read before (e.g., if
+  # the monitor starts late, only the end of a long log is read)
+
+  max_read = 1 << 20
+
+  def __init__( s, path, maxlen=100 ):
+
+    s.path    = path
+    s.lines   = collections.deque( maxlen=maxlen )
+    s.seq     = 0      # number of lines read so far
+    s.offset  = 0      # bytes read so far
+    s.inode   = None
+    s.partial = b''    # last line if it is not complete yet
+
+  # poll
+  #
+  # Reads the lines appended since the last poll. Returns True if there
+  # were any.
+  #
+
+  def poll( s ):
+
+    try:
+      st = os.stat( s.path )
+    except OSError:
+      return False
+
+    if st.st_ino != s.inode or st.st_size < s.offset:
+      s.inode   = st.st_ino
+      s.offset  = max( st.st_size - s.max_read, 0 )
+      s.partial = b''
+      s.lines.clear()
+
+    if st.st_size == s.offset:
+      return False
+
+    with open( s.path, 'rb' ) as fd:
+      fd.seek( s.offset )
+      data = fd.read( st.st_size - s.offset )
+
+    s.offset += len( data )
+
+    lines     = ( s.partial + data ).split( b'\n' )
+    s.partial = lines.pop()
+
+    for line in lines:
+      s.lines.append( line.decode( errors='replace' ).rstrip( '\r' ) )
+
+    s.seq += len( lines )
+
+    return len( lines ) > 0
+
+  # get
+  #
+  # Returns the lines after the given sequence number (all kept lines by
+  # default)
+  #
+
+  def get( s, since=0 ):
+    lines = list( s.lines )
+    new   = s.seq - since
+    if 0 <= new < len( lines ):
+      lines = lines[ len( lines ) - new: ]
+    return { 'seq': s.seq, 'lines': lines }
+
+#-------------------------------------------------------------------------
+# BuildMonitor
+#-------------------------------------------------------------------------
+# Polls the build in the current directory. Call poll (or start, which
+# polls in a background thread) and read the state with get_status and
+# get_logs.
+#
+
+class BuildMonitor:
+
+  # Log of each step that is tailed
+
+  log_name = 'mflowgen-run.log'
+
+  def __init__( s, interval=1.0, status_interval=5.0, lines=100 ):
+
+    s.interval        = interval
+    s.status_interval = status_interval
+    s.lines           = lines
+
+    s.lock   = threading.Lock()
+    s.status = None
+    s.tails  = {}
+    s.last   = 0.0
+
+    s.thread = None
+    s.done   = threading.Event()
+
+  # poll
+  #
+  # Refreshes the status if it is older than the status interval and
+  # reads new log lines of the steps that are running or failed
+  #
+
+  def poll( s ):
+
+    now = time.time()
+
+    if s.status is None or now - s.last >= s.status_interval:
+
+      status = get_status()
+
+      for x in status['steps']:
+        x['summary'] = describe( x['telemetry'] )
+
+      tailed = set( x['build_dir'] for x in status['steps']
+                      if x['status'] in [ 'running', 'failed' ] )
+
+      with s.lock:
+        s.status = status
+        s.last   = now
+        for d in tailed - set( s.tails ):
+          s.tails[d] = LogTail( d + '/' + s.log_name, s.lines )
+        for d in set( s.tails ) - tailed:
+          del s.tails[d]
+
+    with s.lock:
+      tails = list( s.tails.values() )
+
+    for tail in tails:
+      with s.lock:
+        tail.poll()
+
+  # start
+  #
+  # Polls in a background thread until stop
+  #
+
+  def start( s ):
+
+    def loop():
+      while not s.done.is_set():
+        s.poll()
+        s.done.wait( s.interval )
+
+    s.poll()
+    s.thread = threading.Thread( target=loop, daemon=True )
+    s.thread.start()
+
+  # stop
+
+  def stop( s ):
+    s.done.set()
+    if s.thread:
+      s.thread.join()
+
+  # get_status
+
+  def get_status( s ):
+    with s.lock:
+      return s.status
+
+  # get_logs
+  #
+  # Returns the log tail of the step (or of all tailed steps), or None if
+  # the step is not tailed
+  #
+
+  def get_logs( s, build_dir=None, since=0 ):
+    with s.lock:
+      if build_dir is None:
+        return { d: t.get() for d, t in s.tails.items() }
+      if build_dir not in s.tails:
+        return None
+      return s.tails[ build_dir ].get( since )
+
+#-------------------------------------------------------------------------
+# Server
+#-------------------------------------------------------------------------
+
+# ThreadingHTTPServer
+#
+# Serves each request in its own thread, so that a slow client does not
+# hold up the others (http.server.ThreadingHTTPServer is Python 3.7+)
+#
+
+class ThreadingHTTPServer( socketserver.ThreadingMixIn,
+                           http.server.HTTPServer ):
+  daemon_threads = True
+
+# make_server
+#
+# Returns an HTTP server for the monitor (call serve_forever to serve)
+#
+
+def make_server( monitor, host='127.0.0.1', port=8765 ):
+
+  class Handler( http.server.BaseHTTPRequestHandler ):
+
+    def do_GET( self ):
+
+      url   = urllib.parse.urlsplit( self.path )
+      query = urllib.parse.parse_qs( url.query )
+      path  = url.path.rstrip( '/' )
+
+      if path == '':
+        self.reply( 200, monitor_page.encode(), 'text/html' )
+      elif path == '/api/status':
+        self.reply_json( monitor.get_status() )
+      elif path == '/api/logs':
+        self.reply_json( monitor.get_logs() )
+      elif path.startswith( '/api/logs/' ):
+        try:
+          since = int( query.get( 'since', [ 0 ] )[0] )
+        except ValueError:
+          since = 0
+        data = monitor.get_logs( path[ len( '/api/logs/' ): ], since )
+        if data is None:
+          self.reply( 404, b'Step is not running\n', 'text/plain' )
+        else:
+          self.reply_json( data )
+      else:
+        self.reply( 404, b'Not found\n', 'text/plain' )
+
+    def reply_json( self, data ):
+      self.reply( 200, json.dumps( data ).encode(), 'application/json' )
+
+    def reply( self, code, body, content_type ):
+      self.send_response( code )
+      self.send_header( 'Content-Type', content_type )
+      self.send_header( 'Content-Length', str( len( body ) ) )
+      self.send_header( 'Cache-Control', 'no-store' )
+      self.end_headers()
+      self.wfile.write( body )
+
+    def log_message( self, *args ):
+      pass # quiet
+
+  return ThreadingHTTPServer( ( host, port ), Handler )
+
+#-------------------------------------------------------------------------
+# Page
+#-------------------------------------------------------------------------
+# Polls the status and the log tails of the running and failed steps
+#
+
+monitor_page = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>mflowgen monitor</title>
+<style>
+  body  { font-family: monospace; margin: 1em 2em; }
+  table { border-collapse: collapse; }
+  td    { padding: 0 1em 0 0; }
+  pre   { background: #f4f4f4; margin: 0.3em 0 1em 0; padding: 0.5em;
+          max-height: 20em; overflow: auto; }
+  .done, .prebuilt { color: green; }
+  .stale  { color: gray; }
+  .running { color: darkorange; font-weight: bold; }
+  .failed  { color: red; font-weight: bold; }
+</style>
+</head>
+<body>
+<h3 id="title">mflowgen monitor</h3>
+<div id="counts"></div>
+<table id="steps"></table>
+<div id="logs"></div>
+<script>
+function esc( x ) {
+  return String( x ).replace( /[&<>]/g,
+    c => ( { '&': '&amp;', '<': '&lt;', '>': '&gt;' } )[c] );
+}
+async function refresh() {
+  try {
+    const status = await ( await fetch( '/api/status' ) ).json();
+    const logs   = await ( await fetch( '/api/logs'   ) ).json();
+    document.getElementById( 'title' ).textContent =
+      'mflowgen monitor: ' + status.build_dir;
+    document.getElementById( 'counts' ).textContent =
+      Object.entries( status.counts ).map( x => x.join( ': ' ) )
+        .join( ', ' ) + ( status.time_left == null ? '' :
+        ', about ' + Math.round( status.time_left / 60 ) + ' min left' );
+    document.getElementById( 'steps' ).innerHTML = status.steps.map( x =>
+      '<tr><td>' + x.build_id + '</td><td>' + esc( x.name ) +
+      '</td><td class="' + x.status + '">' + x.status + '</td><td>' +
+      esc( x.summary ) + '</td><td>' + esc( x.reason || '' ) +
+      '</td></tr>' ).join( '' );
+    document.getElementById( 'logs' ).innerHTML =
+      Object.entries( logs ).map( ( [ d, t ] ) => '<h4>' + esc( d ) +
+        '</h4><pre>' + esc( t.lines.join( '\\n' ) ) + '</pre>' ).join( '' );
+  } catch ( e ) {
+    document.getElementById( 'counts' ).textContent = 'Disconnected';
+  }
+}
+refresh();
+setInterval( refresh, 2000 );
+</script>
+</body>
+</html>
+'''
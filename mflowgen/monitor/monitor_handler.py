@@ -0,0 +1,91 @@
+#=========================================================================
+# monitor_handler.py
+#=========================================================================
+# Handler for "mflowgen monitor", which serves the live state of the
+# build in the current directory over HTTP (see monitor.py)
+#
+
+import os
+import sys
+
+from mflowgen.monitor.monitor import BuildMonitor, make_server
+from mflowgen.utils           import bold
+
+class MonitorHandler:
+
+  def __init__( s ):
+    pass
+
+  #-----------------------------------------------------------------------
+  # launch
+  #-----------------------------------------------------------------------
+  # Dispatch function for commands
+  #
+
+  def launch( s, args, help_, host=None, port=None ):
+
+    if help_ or args:
+      s.launch_help()
+      return
+
+    s.launch_monitor( host or '127.0.0.1', 8765 if port is None else port )
+
+  #-----------------------------------------------------------------------
+  # launch_help
+  #-----------------------------------------------------------------------
+
+  def launch_help( s ):
+    print()
+    print( bold( 'Usage:' ), 'mflowgen monitor [--host <host>]',
+                             '[--port <port>]' )
+    print()
+    print( 'Serves the status of every step and the last lines of the' )
+    print( 'logs of running and failed steps while the build runs. Run' )
+    print( 'this from a build directory that was set up with "mflowgen' )
+    print( 'run", then open the printed address in a browser or poll' )
+    print( '/api/status and /api/logs for JSON.' )
+    print()
+    print( '  --host  Address to listen on (default: 127.0.0.1)' )
+    print( '  --port  Port to listen on (default: 8765)'          )
+    print()
+
+  #-----------------------------------------------------------------------
+  # launch_monitor
+  #-----------------------------------------------------------------------
+
+  def launch_monitor( s, host, port ):
+
+    if not os.path.isdir( '.mflowgen' ):
+      print()
+      print( bold( 'Error:' ), 'No build in the current directory. Run',
+                               '"mflowgen run" first.' )
+      print()
+      sys.exit( 1 )
+
+    monitor = BuildMonitor()
+
+    try:
+      server = make_server( monitor, host, port )
+    except OSError as e:
+      print()
+      print( bold( 'Error:' ), 'Cannot listen on {}:{} ({})'.format(
+                                 host, port, e.strerror ) )
+      print()
+      sys.exit( 1 )
+
+    monitor.start()
+
+    print()
+    print( bold( 'Monitoring:' ), os.getcwd() )
+    print( bold( 'Serving:' ), 'http://{}:{}/'.format(
+                                 host, server.server_address[1] ) )
+    print()
+    print( 'Press Ctrl-C to stop.' )
+
+    try:
+      server.serve_forever()
+    except KeyboardInterrupt:
+      print()
+    finally:
+      server.server_close()
+      monitor.stop()
@@ -0,0 +1,51 @@
+#=========================================================================
+# test_monitor.py
+#=========================================================================
+
+import json
+import threading
+import urllib.request
+
+from mflowgen.core.telemetry import write_telemetry
+from mflowgen.monitor        import BuildMonitor, LogTail, make_server
+
+def test_log_tail( tmpdir ):
+  log  = tmpdir.join( 'mflowgen-run.log' )
+  tail = LogTail( str( log ), maxlen=3 )
+  assert not tail.poll()
+  log.write( 'a\nb\nc\nd\npart' )
+  assert tail.poll()
+  assert tail.get() == { 'seq': 4, 'lines': [ 'b', 'c', 'd' ] }
+  log.write( 'ial\ne\n', mode='a' )
+  tail.poll()
+  assert tail.get( since=4 ) == { 'seq': 6, 'lines': [ 'partial', 'e' ] }
+  # A log that is written again is followed from the start
+  log.write( 'x\n' )
+  tail.poll()
+  assert tail.get()[ 'lines' ] == [ 'x' ]
+
+def test_monitor_server( tmpdir, monkeypatch ):
+  monkeypatch.chdir( tmpdir )
+  tmpdir.join( '.mflowgen', '0-a', 'configure.yml' ).write( 'name: a\n',
+                                                            ensure=True )
+  write_telemetry( str( tmpdir.mkdir( '0-a' ) ),
+                   { 'status': 'failed', 'returncode': 1, 'start': 0,
+                     'wall': 1 } )
+  tmpdir.join( '0-a', 'mflowgen-run.log' ).write( 'Error: oops\n' )
+
+  monitor = BuildMonitor()
+  monitor.poll()
+  server = make_server( monitor, port=0 )
+  threading.Thread( target=server.serve_forever, daemon=True ).start()
+
+  def get( path ):
+    url = 'http://127.0.0.1:{}{}'.format( server.server_address[1], path )
+    return json.loads( urllib.request.urlopen( url ).read() )
+
+  try:
+    assert get( '/api/status' )[ 'steps' ][0][ 'status' ] == 'failed'
+    assert get( '/api/logs/0-a' )[ 'lines' ] == [ 'Error: oops' ]
+    assert get( '/api/logs/0-a?since=1' )[ 'lines' ] == []
+  finally:
+    server.shutdown()
+    server.server_close()
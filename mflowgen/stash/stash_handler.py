@@ -513,8 +513,7 @@ class StashHandler:
         'reports',   # TEMPORARY
         'configure.yml',
         'mflowgen-run.log',
-        '.time_start',
-        '.time_end',
+        '.telemetry.json',
         '.stamp',
         '.execstamp',
         '.postconditions.stamp',
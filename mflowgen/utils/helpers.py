@@ -5,6 +5,8 @@
 # Date   : June 2, 2019
 #
 
+import collections
+import copy
 import os
 import yaml
 
@@ -63,10 +65,47 @@ def stamp( p, stamp='.stamp.' ):
   if p_dirname : return p_dirname + '/' + p_stamp
   else         : return p_stamp
 
+# write_if_changed
+#
+# Writes the text to the file only if the file does not already have
+# exactly this content, so that unchanged files keep their timestamps.
+# The file is replaced atomically (i.e., written to a temporary file and
+# then renamed) so that readers never see a partially written file.
+#
+# Returns True if the file was written
+#
+
+def write_if_changed( path, text ):
+  try:
+    with open( path ) as fd:
+      if fd.read() == text:
+        return False
+  except ( OSError, UnicodeDecodeError ):
+    pass
+  path_tmp = path + '.tmp'
+  with open( path_tmp, 'w' ) as fd:
+    fd.write( text )
+  os.replace( path_tmp, path )
+  return True
+
 #-------------------------------------------------------------------------
 # YAML helper functions
 #-------------------------------------------------------------------------
 
+# Use the libyaml bindings if PyYAML was built with them, since they are
+# much faster than the pure-Python loader and dumper
+
+try:
+  YamlLoader = yaml.CFullLoader
+except AttributeError:
+  # PyYAML for python2 does not have FullLoader
+  YamlLoader = getattr( yaml, 'FullLoader', yaml.Loader )
+
+try:
+  YamlDumper = yaml.CDumper
+except AttributeError:
+  YamlDumper = yaml.Dumper
+
 # read_yaml
 #
 # Takes a path to a yaml file and returns the data
@@ -74,11 +113,7 @@ def stamp( p, stamp='.stamp.' ):
 
 def read_yaml( path ):
   with open( path ) as f:
-    try:
-      data = yaml.load( f, Loader=yaml.FullLoader )
-    except AttributeError:
-      # PyYAML for python2 does not have FullLoader
-      data = yaml.load( f )
+    data = yaml.load( f, Loader=YamlLoader )
   return data
 
 # write_yaml
@@ -88,7 +123,69 @@ def read_yaml( path ):
 
 def write_yaml( data, path ):
   with open( path, 'w' ) as f:
-    yaml.dump( data, f, default_flow_style=False )
+    yaml.dump( data, f, default_flow_style=False, Dumper=YamlDumper )
+
+# read_yaml_cached
+#
+# Same as read_yaml, but the parsed data is cached for the lifetime of the
+# process. Construct scripts instantiate the same steps many times (e.g.,
+# across designs and clones), so this avoids re-parsing the same YAML.
+#
+# - Entries are keyed by path and validated against the file mtime and
+#   size, so edited files are re-read
+# - The cache is bounded with least-recently-used eviction
+# - Callers always get their own deep copy and are free to modify it
+#
+
+_yaml_cache = {
+  'data'    : collections.OrderedDict(), # path -> ( mtime, size, data )
+  'maxsize' : 512,
+  'hits'    : 0,
+  'misses'  : 0,
+}
+
+def read_yaml_cached( path ):
+  cache = _yaml_cache['data']
+  key   = os.path.abspath( path )
+  st    = os.stat( key )
+  try:
+    mtime, size, data = cache[ key ]
+    if ( mtime, size ) != ( st.st_mtime_ns, st.st_size ):
+      raise KeyError( key )
+    cache.move_to_end( key )
+    _yaml_cache['hits'] += 1
+  except KeyError:
+    data = read_yaml( key )
+    cache[ key ] = ( st.st_mtime_ns, st.st_size, data )
+    if len( cache ) > _yaml_cache['maxsize']:
+      cache.popitem( last=False )
+    _yaml_cache['misses'] += 1
+  return copy.deepcopy( data )
+
+# yaml_cache_info
+#
+# Returns a dict with the hit and miss counts of the YAML cache
+#
+
+def yaml_cache_info():
+  return {
+    'hits'    : _yaml_cache['hits'],
+    'misses'  : _yaml_cache['misses'],
+    'size'    : len( _yaml_cache['data'] ),
+    'maxsize' : _yaml_cache['maxsize'],
+  }
+
+# yaml_cache_clear
+#
+# Empties the YAML cache and resets its counters. Optionally resizes it.
+#
+
+def yaml_cache_clear( maxsize=None ):
+  _yaml_cache['data'].clear()
+  _yaml_cache['hits']   = 0
+  _yaml_cache['misses'] = 0
+  if maxsize is not None:
+    _yaml_cache['maxsize'] = maxsize
 
 #-------------------------------------------------------------------------
 # Colors
@@ -0,0 +1,58 @@
+#=========================================================================
+# test_helpers.py
+#=========================================================================
+
+import os
+
+from mflowgen.utils import read_yaml_cached, write_yaml
+from mflowgen.utils import yaml_cache_info, yaml_cache_clear
+from mflowgen.utils import write_if_changed
+
+def test_yaml_cache_hit_returns_copy( tmpdir ):
+  yaml_cache_clear()
+  path = str( tmpdir ) + '/configure.yml'
+  write_yaml( data = { 'name' : 'foo', 'inputs' : [ 'a' ] }, path = path )
+  data = read_yaml_cached( path )
+  data['inputs'].append( 'b' ) # must not leak into the cache
+  assert read_yaml_cached( path ) == { 'name' : 'foo', 'inputs' : [ 'a' ] }
+  info = yaml_cache_info()
+  assert ( info['hits'], info['misses'] ) == ( 1, 1 )
+
+def test_yaml_cache_invalidated_by_edit( tmpdir ):
+  yaml_cache_clear()
+  path = str( tmpdir ) + '/configure.yml'
+  write_yaml( data = { 'name' : 'foo' }, path = path )
+  read_yaml_cached( path )
+  write_yaml( data = { 'name' : 'foobar' }, path = path )
+  os.utime( path, ns=( 0, 0 ) ) # force a different mtime
+  assert read_yaml_cached( path ) == { 'name' : 'foobar' }
+  assert yaml_cache_info()['misses'] == 2
+
+def test_yaml_cache_lru_eviction( tmpdir ):
+  yaml_cache_clear( maxsize=2 )
+  paths = []
+  for name in [ 'a', 'b', 'c' ]:
+    path = str( tmpdir ) + '/' + name + '.yml'
+    write_yaml( data = { 'name' : name }, path = path )
+    paths.append( path )
+  read_yaml_cached( paths[0] )
+  read_yaml_cached( paths[1] )
+  read_yaml_cached( paths[0] ) # hit, now most recently used
+  read_yaml_cached( paths[2] ) # evicts paths[1]
+  assert yaml_cache_info()['size'] == 2
+  read_yaml_cached( paths[0] )
+  read_yaml_cached( paths[1] )
+  info = yaml_cache_info()
+  assert ( info['hits'], info['misses'] ) == ( 2, 4 )
+  yaml_cache_clear( maxsize=512 )
+
+def test_write_if_changed( tmpdir ):
+  path = str( tmpdir ) + '/mflowgen-run'
+  assert write_if_changed( path, 'foo\n' )
+  os.utime( path, ns=( 0, 0 ) )
+  assert not write_if_changed( path, 'foo\n' )
+  assert os.stat( path ).st_mtime_ns == 0
+  assert write_if_changed( path, 'bar\n' )
+  with open( path ) as fd:
+    assert fd.read() == 'bar\n'
+  assert os.listdir( str( tmpdir ) ) == [ 'mflowgen-run' ]